@@ -8,12 +8,13 @@ import argparse
 import logging
 import time
 import tools
+import transport
 import sys
 from sbml import sbml
 from interfaces.enzymeAssignment import EnzymeAssignment
 from interfaces.databaseExtraction import DatabaseExtraction
-from interfaces.sbmlExtraction import SBMLExtraction
-from network_merging import merge
+from interfaces.sbmlExtraction import SBMLExtraction, claiming_plugin
+from network_merging import merge, metanetx
 
 
 def main():
@@ -23,6 +24,8 @@ def main():
 
     args = parse_arguments()
     logging.info("Program arguments: %s" % args)
+    transport.configure(timeout=(args.connectTimeout, args.readTimeout), retries=args.retries,
+                        cassette=args.cassette, cassette_mode=args.cassetteMode, offline=args.offline)
 
     # STEP 1 - Assign enzymes
     enzymes = enzyme_assignment(args)
@@ -50,32 +53,70 @@ def enzyme_assignment(args):
 
 def database_extraction(args, enzymes):
     logging.info("\nBeginning database extraction")
-    database_extractor_classes = tools.load_classes('databaseExtraction', DatabaseExtraction, enzymes=enzymes)
+    database_extractor_classes = tools.load_classes('databaseExtraction', DatabaseExtraction, enzymes=enzymes,
+                                                    kegg_workers=args.keggWorkers, kegg_rate=args.keggRate,
+                                                    kegg_cache=args.keggCache, kegg_release=args.keggRelease,
+                                                    kegg_cache_ttl=args.keggCacheTTL * 86400 if args.keggCacheTTL else None,
+                                                    kegg_cache_size=args.keggCacheSize, kegg_bulk=args.keggBulk,
+                                                    kegg_mirror=args.keggMirror, offline=args.offline,
+                                                    mnxref_extraction=args.mnxrefExtraction, mnxref_path=args.mnxref,
+                                                    mnxref_store=mnxref_store(args) if args.mnxrefExtraction else None,
+                                                    mnxref_columnar=args.mnxrefColumnar)
     logging.info("Database extraction classes: %s" % database_extractor_classes)
     for database_extractor in database_extractor_classes:
         # Extract reactions and metabolites for the selected database and build a SBML model
             database_extractor.get_reactions()
-            sbml.build_sbml(database_extractor, args.outPath, args.name)
+            if not database_extractor.reactions:
+                logging.info("No reactions extracted from %s, no SBML model built" % database_extractor.database_name())
+                continue
+            sbml.build_sbml(database_extractor, args.outPath, args.name, writer=args.sbmlWriter,
+                            compress_level=args.gzipLevel)
 
 
 def sbml_extraction(args, enzymes):
+    if not args.sbmlFiles:
+        return
+    # Each file is parsed once and handed only to the plugin that claims it
+    plugins = tools.find_classes('sbmlExtraction', SBMLExtraction)
     sbml_extractor_classes = []
-    try:
-        for sbml_file in args.sbmlFiles:
-            logging.info('')
-            sbml_extractor_classes.extend(
-                tools.load_classes('sbmlExtraction', SBMLExtraction, enzymes=enzymes, sbml_file=sbml_file))
-    except:
-        logging.error("Failed to load")
+    for sbml_input in sbml.load_inputs(args.sbmlFiles, stream=args.sbmlStream):
+        logging.info('')
+        plugin = claiming_plugin(plugins, sbml_input)
+        if plugin is None:
+            logging.warning("No SBML extraction plugin claims %s, not extracted" % sbml_input.path)
+            continue
+        logging.info("%s claimed by %s" % (sbml_input.path, plugin.__name__))
+        sbml_extractor_classes.append(plugin(enzymes=enzymes, sbml_file=sbml_input.path, sbml_input=sbml_input))
 
     for sbml_extractor in sbml_extractor_classes:
         sbml_extractor.get_reactions()
-        sbml.build_sbml(sbml_extractor, args.outPath, args.name + '_' + sbml_extractor.sbml_file.getModel().getId())
+        sbml.build_sbml(sbml_extractor, args.outPath, args.name + '_' + sbml_extractor.model_id,
+                        writer=args.sbmlWriter, compress_level=args.gzipLevel)
+
+
+_mnxref_store = None
+
+
+def mnxref_store(args):
+    """
+    The compiled MNXref store selected by the arguments, opened once per run
+    :param args:
+    :return: a metanetx.MNXrefStore, or None without --mnxrefStore
+    """
+    global _mnxref_store
+    if args.mnxrefStore and _mnxref_store is None:
+        _mnxref_store = metanetx.open_store(args.mnxrefStore, release=args.mnxrefRelease, mnxref_path=args.mnxref)
+    return _mnxref_store
 
 
 def merge_networks(args, enzymes):
-    merged_network = merge.NetworkMerger(path=args.outPath, enzymes=enzymes)
-    sbml.build_sbml(merged_network, args.outPath, args.name)
+    merged_network = merge.NetworkMerger(path=args.outPath, enzymes=enzymes, mnxref_path=args.mnxref,
+                                         mnxref_store=mnxref_store(args), mnxref_lazy=args.mnxrefLazy,
+                                         mnxref_columnar=args.mnxrefColumnar, merge_workers=args.mergeWorkers,
+                                         files=args.mergeFiles, merge_cache=args.mergeCache,
+                                         fuzzy_report=args.fuzzyReport, fuzzy_top=args.fuzzyTop,
+                                         sbml_stream=args.sbmlStream)
+    sbml.build_sbml(merged_network, args.outPath, args.name, writer=args.sbmlWriter, compress_level=args.gzipLevel)
 
 
 def parse_arguments():
@@ -100,7 +141,107 @@ def parse_arguments():
     # sbml folder path
     parser.add_argument('-f', '--sbmlFiles',
                         type=str, nargs='+', required=False,
-                        help="Paths of SBML files to extract reactions and metabolites from")
+                        help="Paths of SBML files (.xml, .sbml, or gzip compressed .xml.gz, .sbml.gz) to extract "
+                             "reactions and metabolites from")
+    parser.add_argument('-ss', '--sbmlStream',
+                        action='store_true',
+                        help="Read input SBML files one species or reaction at a time instead of loading them with "
+                             "libsbml, so very large models are extracted and merged in bounded memory")
+    # SBML output
+    parser.add_argument('-sw', '--sbmlWriter',
+                        type=str, choices=sbml.writers, default='libsbml',
+                        help="Build SBML models as libsbml objects, or stream them directly to the output files, "
+                             "which is faster and uses less memory for large networks")
+    parser.add_argument('-gz', '--gzipLevel',
+                        type=int, choices=range(1, 10), required=False,
+                        help="Write SBML models gzip compressed (.xml.gz) at this level, 1 fastest to 9 smallest")
+    # KEGG REST concurrency
+    parser.add_argument('-kw', '--keggWorkers',
+                        type=int, default=4,
+                        help="Number of concurrent KEGG REST calls")
+    parser.add_argument('-kr', '--keggRate',
+                        type=float, default=3,
+                        help="Maximum number of KEGG REST calls per second")
+    parser.add_argument('-kb', '--keggBulk',
+                        action='store_true',
+                        help="Read E.C. to reaction links and compound cross references from whole KEGG link/conv tables")
+    parser.add_argument('-km', '--keggMirror',
+                        type=str, required=False,
+                        help="Path to a local copy of the KEGG ligand flat files (enzyme, reaction, compound) "
+                             "to read entries from instead of KEGG REST")
+    # KEGG entry cache
+    parser.add_argument('-kc', '--keggCache',
+                        type=str, required=False,
+                        help="Path to a SQLite database used to cache KEGG entries between runs")
+    parser.add_argument('--keggRelease',
+                        type=str, required=False,
+                        help="KEGG release to use cached entries for. Defaults to the current KEGG release")
+    parser.add_argument('--keggCacheTTL',
+                        type=float, required=False,
+                        help="Days after which cached KEGG entries are fetched again")
+    parser.add_argument('--keggCacheSize',
+                        type=int, required=False,
+                        help="Maximum number of entries kept in the KEGG cache")
+    parser.add_argument('--offline',
+                        action='store_true',
+                        help="Never call remote services, fail on anything that is not available locally "
+                             "(KEGG cache or mirror, local MNXref tables, or a replayed cassette)")
+    # MetaNetX
+    parser.add_argument('-mnx', '--mnxref',
+                        type=str, required=False,
+                        help="Directory of MNXref tables (reac_xref, reac_prop, chem_xref, chem_prop as .tsv or .tsv.gz). "
+                             "Missing tables are downloaded to it")
+    parser.add_argument('-mnxs', '--mnxrefStore',
+                        type=str, required=False,
+                        help="Directory of compiled MNXref releases (SQLite). A release that is not compiled yet is "
+                             "compiled once from the MNXref tables")
+    parser.add_argument('-mnxr', '--mnxrefRelease',
+                        type=str, required=False,
+                        help="MNXref release to use from the store. Defaults to the most recently compiled release")
+    parser.add_argument('-mnxl', '--mnxrefLazy',
+                        action='store_true',
+                        help="Only load the MNXref rows needed by the reactions in the SBML files being merged")
+    parser.add_argument('-mnxc', '--mnxrefColumnar',
+                        action='store_true',
+                        help="Hold loaded MNXref tables in a compact columnar form instead of a dict per row")
+    parser.add_argument('-mnxe', '--mnxrefExtraction',
+                        action='store_true',
+                        help="Also extract reactions and metabolites for the assigned enzymes from the MNXref tables")
+    # Network merging
+    parser.add_argument('-mw', '--mergeWorkers',
+                        type=int, default=1,
+                        help="Number of processes used to read and resolve the SBML files being merged")
+    parser.add_argument('-mf', '--mergeFiles',
+                        type=str, nargs='+', required=False,
+                        help="SBML files to merge. Defaults to every .xml, .sbml, .xml.gz and .sbml.gz file in the "
+                             "output path")
+    parser.add_argument('-mc', '--mergeCache',
+                        type=str, required=False,
+                        help="JSON file caching the resolved reactions of each merged SBML file by content hash "
+                             "and MNXref release, so only changed files are processed again")
+    parser.add_argument('-fz', '--fuzzyReport',
+                        type=str, required=False,
+                        help="Tab separated file to write MetaNetX ids proposed by name for the reactions and species "
+                             "left unmapped by the merge")
+    parser.add_argument('--fuzzyTop',
+                        type=int, default=3,
+                        help="Number of MetaNetX ids proposed for each unmapped reaction or species")
+    # HTTP transport
+    parser.add_argument('--connectTimeout',
+                        type=float, default=transport.default_timeout[0],
+                        help="Seconds to wait for a connection to a remote service")
+    parser.add_argument('--readTimeout',
+                        type=float, default=transport.default_timeout[1],
+                        help="Seconds to wait for data from a remote service")
+    parser.add_argument('--retries',
+                        type=int, default=transport.default_retries,
+                        help="Number of times a failed call to a remote service is retried")
+    parser.add_argument('--cassette',
+                        type=str, required=False,
+                        help="Directory to record responses of remote services to, or to replay them from")
+    parser.add_argument('--cassetteMode',
+                        type=str, choices=transport.cassette_modes, default='record',
+                        help="Record responses to the cassette, or replay them from it without using the network")
     args = parser.parse_args()
     return args
 
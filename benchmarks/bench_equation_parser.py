@@ -0,0 +1,100 @@
+"""
+Micro-benchmark of the reaction equation parser (tools.parse_equation) against the split, regex and index scans
+KeggExtraction used before it, on the KEGG equations in data/kegg_equations.tsv
+
+Each path derives the substrates, products and stoichiometry of every equation
+The memoized path is what KeggExtraction and NetworkMerger do for a reaction seen again
+
+Usage, from the repository root:
+    python benchmarks/bench_equation_parser.py [--repeat N]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from databaseExtraction.keggExtractor import kegg_compound_pattern
+
+equations_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'kegg_equations.tsv')
+
+
+def read_equations(path):
+    """
+    :param path: a tab separated file of reaction id and equation, '#' lines are comments
+    :return: a list of (reaction id, equation) tuples
+    """
+    with open(path) as f:
+        return [tuple(line.rstrip('\n').split('\t')) for line in f if line.strip() and not line.startswith('#')]
+
+
+def scan_side(equation, side):
+    compound_ids = []
+    for kegg_compound_id in equation.split('<=>')[side].split(' '):
+        compound_ids.extend(re.findall(kegg_compound_pattern, kegg_compound_id))
+    return compound_ids
+
+
+def scan_stoichiometry(equation, substrates, products):
+    stoichiometry = {}
+    equation = equation.replace(" ", "")
+    for metabolite in substrates + products:
+        index = equation.index(metabolite)
+        if not index == 0 and equation[index - 1].isdigit():
+            stoichiometry[metabolite] = int(equation[index - 1])
+        else:
+            stoichiometry[metabolite] = 1
+    return stoichiometry
+
+
+def scan(equation):
+    """
+    The path before tools.parse_equation: KeggExtraction.reaction_substrates, reaction_products and
+    reaction_stoichiometry each scanned the equation again
+    """
+    substrates = scan_side(equation, 0)
+    products = scan_side(equation, 1)
+    return substrates, products, scan_stoichiometry(equation, substrates, products)
+
+
+def parse(equation):
+    parsed = tools.parse_equation(equation, kegg_compound_pattern)
+    substrates = [i for i, side in zip(parsed.ids, parsed.sides) if side == 0]
+    products = [i for i, side in zip(parsed.ids, parsed.sides) if side == 1]
+    return substrates, products, dict(zip(parsed.ids, parsed.coefficients))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000, help='Times each path is run over every equation')
+    args = parser.parse_args()
+
+    equations = read_equations(equations_path)
+    memo = {}
+
+    def memoized():
+        for reaction_id, equation in equations:
+            if reaction_id not in memo:
+                memo[reaction_id] = tools.parse_equation(equation, kegg_compound_pattern)
+            parsed = memo[reaction_id]
+            [i for i, side in zip(parsed.ids, parsed.sides) if side == 0]
+            [i for i, side in zip(parsed.ids, parsed.sides) if side == 1]
+            dict(zip(parsed.ids, parsed.coefficients))
+
+    paths = [('scan', lambda: [scan(equation) for reaction_id, equation in equations]),
+             ('parse once', lambda: [parse(equation) for reaction_id, equation in equations]),
+             ('memoized', memoized)]
+    print('%d equations from %s, %d runs' % (len(equations), equations_path, args.repeat))
+    for name, path in paths:
+        seconds = timeit.timeit(path, number=args.repeat)
+        print('%-12s %8.2f us per reaction' % (name, seconds / args.repeat / len(equations) * 1e6))
+
+    differ = [reaction_id for reaction_id, equation in equations if scan(equation)[2] != parse(equation)[2]]
+    print('Stoichiometry read differently by the scan in %d equations: %s' % (len(differ), ' '.join(differ)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark of the E.C. to reaction index of MetaCycSBMLExtraction.get_reactions on a synthetic MetaCyc-sized model,
+against the per E.C. regex scan of every reaction's notes string it replaced
+
+The reaction notes are generated with a fixed seed: --reactions reactions with one or two 'EC Number: EC-x.x.x.x'
+notes drawn from --ec-numbers E.C. numbers, and --assigned of those E.C. numbers are assigned.
+With --write, the notes are also written as a SBML model that MetaCycSBMLExtraction can read
+
+The index is timed with the parsing of every notes string (sbml.notes_index does it once per model). The scan is
+timed on --sample assigned E.C. numbers, checked against the index, and extrapolated to every assigned E.C. number
+
+Usage, from the repository root:
+    python benchmarks/bench_metacyc_ec_index.py [--reactions 15000] [--ec-numbers 8000] [--assigned 1200]
+                                                [--sample 100] [--write model.xml]
+"""
+import argparse
+import html
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from sbmlExtraction import metacyc_SBMLExtractor
+
+
+def reaction_notes(reactions, ec_numbers, seed):
+    """
+    :return: the E.C. numbers, and a list of (reaction id, notes string) tuples
+    """
+    rng = random.Random(seed)
+    numbers = set()
+    while len(numbers) < ec_numbers:
+        numbers.add('%d.%d.%d.%d' % (rng.randint(1, 7), rng.randint(1, 20), rng.randint(1, 20), rng.randint(1, 200)))
+    numbers = sorted(numbers)
+    notes = []
+    for i in range(reactions):
+        ecs = ', '.join('EC-' + ec for ec in rng.sample(numbers, rng.randint(1, 2)))
+        notes.append(('RXN-%d' % i, '<body xmlns="http://www.w3.org/1999/xhtml"><p>EC Number: %s</p>'
+                                    '<p>SUBSYSTEM: pathway %d</p></body>' % (ecs, i % 300)))
+    return numbers, notes
+
+
+def write_model(file, notes):
+    with open(file, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" level="3" version="1">\n'
+                '<model id="metacyc" name="MetaCyc benchmark">\n<listOfCompartments>'
+                '<compartment id="c" constant="true"/></listOfCompartments>\n<listOfSpecies>\n'
+                '<species id="s" compartment="c" hasOnlySubstanceUnits="false" boundaryCondition="false" '
+                'constant="false"/>\n<species id="p" compartment="c" hasOnlySubstanceUnits="false" '
+                'boundaryCondition="false" constant="false"/>\n</listOfSpecies>\n<listOfReactions>\n')
+        for reaction_id, notes_string in notes:
+            f.write('<reaction id="%s" reversible="true" fast="false"><notes>%s</notes><listOfReactants>'
+                    '<speciesReference species="s" stoichiometry="1" constant="true"/></listOfReactants>'
+                    '<listOfProducts><speciesReference species="p" stoichiometry="1" constant="true"/>'
+                    '</listOfProducts></reaction>\n' % (html.escape(reaction_id), notes_string))
+        f.write('</listOfReactions>\n</model>\n</sbml>\n')
+
+
+def scan(notes, ec_number):
+    """
+    The reactions of an E.C. number as get_reactions found them before the index: two regex scans of every
+    reaction's notes string
+    """
+    positions = []
+    for position, (reaction_id, notes_string) in enumerate(notes):
+        if len(re.findall('\\b' + ec_number + '\\b', notes_string)) > 0:
+            for ec in re.findall('\\b' + ec_number + '\\b', notes_string):
+                if ec == ec_number:
+                    positions.append(position)
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reactions', type=int, default=15000)
+    parser.add_argument('--ec-numbers', type=int, default=8000)
+    parser.add_argument('--assigned', type=int, default=1200)
+    parser.add_argument('--sample', type=int, default=100, help='Assigned E.C. numbers the scan is timed on')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--write', help='Also write the notes as a SBML model to this file')
+    args = parser.parse_args()
+
+    numbers, notes = reaction_notes(args.reactions, args.ec_numbers, args.seed)
+    assigned = random.Random(args.seed).sample(numbers, args.assigned)
+    if args.write:
+        write_model(args.write, notes)
+
+    start = time.time()
+    index = metacyc_SBMLExtractor.ec_index(tools.notes2dict(notes_string) for reaction_id, notes_string in notes)
+    matches = dict((ec_number, sorted(index.match(ec_number))) for ec_number in assigned)
+    index_seconds = time.time() - start
+
+    sample = assigned[:args.sample]
+    start = time.time()
+    scanned = dict((ec_number, scan(notes, ec_number)) for ec_number in sample)
+    scan_seconds = (time.time() - start) / len(sample) * len(assigned)
+    assert all(scanned[ec_number] == matches[ec_number] for ec_number in sample)
+
+    print('%d reactions, %d E.C. numbers, %d assigned' % (len(notes), len(numbers), len(assigned)))
+    print('index, notes parsing included  %8.2f s, %d matches' % (index_seconds, sum(map(len, matches.values()))))
+    print('regex scan                     %8.2f s (extrapolated from %d E.C. numbers, %d matches, same as the index)'
+          % (scan_seconds, len(sample), sum(map(len, scanned.values()))))
+
+
+if __name__ == '__main__':
+    main()
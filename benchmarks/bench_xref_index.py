@@ -0,0 +1,169 @@
+"""
+Benchmark of NetworkMerger on a synthetic network, comparing the dblinks of merged reactions and metabolites
+looked up in the MNX id to xref indexes (MetaNetXDict.reaction_xref_index and metabolite_xref_index) with the
+scan of every reac_xref or chem_xref row that NetworkMerger did before them
+
+The MNXref tables and the SBML model are generated with a fixed seed into --data (a temporary directory by
+default), so runs with the same arguments read the same inputs:
+    reac_prop     4 x --reactions reactions over --metabolites metabolites
+    reac_xref     --xrefs / 2 rows, including a kegg xref for every reaction
+    chem_prop     --metabolites metabolites
+    chem_xref     --xrefs / 2 rows
+    model.xml     --reactions reactions, each with the KEGG note of one MNXref reaction
+
+The merge is timed with the indexes. The scan is timed on --sample reactions and their metabolites, checked
+against the indexes, and extrapolated to the whole merge
+
+Usage, from the repository root (libsbml is needed to read the model):
+    python benchmarks/bench_xref_index.py [--reactions 5000] [--xrefs 400000] [--sample 20] [--data DIR]
+"""
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interfaces.enzymeAssignment import AssignedEnzymeDict
+from network_merging import merge, metanetx
+
+xref_databases = ('seed', 'bigg', 'metacyc', 'rhea', 'sabiork')
+
+
+def write_tables(path, reactions, metabolites, xrefs, seed):
+    """
+    Generate the MNXref tables
+    :return:
+    """
+    rng = random.Random(seed)
+    header = '### MNXref Version benchmark ###\n'
+    with open(os.path.join(path, 'reac_prop.tsv'), 'w') as f:
+        f.write(header)
+        for i in range(1, 4 * reactions + 1):
+            substrates, products = rng.sample(range(1, metabolites + 1), 2), rng.sample(range(1, metabolites + 1), 2)
+            equation = ' = '.join(' + '.join('1 MNXM%d@MNXD1' % m for m in side) for side in (substrates, products))
+            f.write('MNXR%d\t%s\treaction %d\ttrue\t1.1.1.%d\tkegg:R%05d\n' % (i, equation, i, i % 200, i))
+    with open(os.path.join(path, 'reac_xref.tsv'), 'w') as f:
+        f.write(header)
+        for i in range(1, 4 * reactions + 1):
+            f.write('kegg:R%05d\tMNXR%d\n' % (i, i))
+        for i in range(xrefs // 2 - 4 * reactions):
+            f.write('%s:rxn%d\tMNXR%d\n' % (rng.choice(xref_databases), i, rng.randint(1, 4 * reactions)))
+    with open(os.path.join(path, 'chem_prop.tsv'), 'w') as f:
+        f.write(header)
+        for i in range(1, metabolites + 1):
+            f.write('MNXM%d\tmetabolite %d\tC%dH4O2\t0\t60.0\t\t\tkegg:C%05d\t\n' % (i, i, i % 20 + 1, i))
+    with open(os.path.join(path, 'chem_xref.tsv'), 'w') as f:
+        f.write(header)
+        for i in range(1, metabolites + 1):
+            f.write('kegg:C%05d\tMNXM%d\n' % (i, i))
+        for i in range(xrefs // 2 - metabolites):
+            f.write('%s:cpd%d\tMNXM%d\n' % (rng.choice(xref_databases), i, rng.randint(1, metabolites)))
+
+
+def write_model(path, reactions):
+    """
+    Generate a SBML model whose reactions resolve to the first reactions of reac_prop through their KEGG note
+    :return: the model file
+    """
+    file = os.path.join(path, 'model.xml')
+    with open(file, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" level="3" version="1">\n'
+                '<model id="benchmark">\n<listOfCompartments><compartment id="c" constant="true"/>'
+                '</listOfCompartments>\n<listOfSpecies>\n'
+                '<species id="s" compartment="c" hasOnlySubstanceUnits="false" boundaryCondition="false" '
+                'constant="false"/>\n</listOfSpecies>\n<listOfReactions>\n')
+        for i in range(1, reactions + 1):
+            f.write('<reaction id="r%d" reversible="true" fast="false"><notes><body '
+                    'xmlns="http://www.w3.org/1999/xhtml"><p>KEGG: R%05d</p><p>SUBSYSTEM: pathway %d</p></body>'
+                    '</notes><listOfReactants><speciesReference species="s" stoichiometry="1" constant="true"/>'
+                    '</listOfReactants></reaction>\n' % (i, i, i % 50))
+        f.write('</listOfReactions>\n</model>\n</sbml>\n')
+    return file
+
+
+def scan_dblinks(xrefs, mnx_id):
+    """
+    The dblinks of a MNX id by scanning every row of an xref table, as NetworkMerger did before the indexes
+    """
+    db_links = {}
+    for xref in xrefs:
+        if xrefs[xref]['MNXR'] == mnx_id:
+            database, value = metanetx.db_link(xrefs[xref]['DB'])
+            db_links[database] = value
+    return db_links
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reactions', type=int, default=5000, help='Reactions in the SBML model')
+    parser.add_argument('--metabolites', type=int, default=8000, help='Metabolites in chem_prop')
+    parser.add_argument('--xrefs', type=int, default=400000, help='Rows of reac_xref and chem_xref together')
+    parser.add_argument('--sample', type=int, default=20, help='Reactions the scan is timed on')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data', help='Directory the inputs are generated in, kept after the run')
+    args = parser.parse_args()
+
+    path = args.data or tempfile.mkdtemp()
+    os.makedirs(path, exist_ok=True)
+    try:
+        write_tables(path, args.reactions, args.metabolites, args.xrefs, args.seed)
+        model = write_model(path, args.reactions)
+
+        start = time.time()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            merger = merge.NetworkMerger(path=path, enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}),
+                                         mnxref_path=path, files=[model])
+        merge_seconds = time.time() - start
+        metanetx_dict = merger.metanetx_dict
+
+        start = time.time()
+        metanetx.xref_index(metanetx_dict.reactions_xref)
+        metanetx.xref_index(metanetx_dict.metabolites_xref)
+        index_seconds = time.time() - start
+
+        reaction_ids = list(merger.reactions)
+        metabolite_ids = list(merger.metabolites)
+        start = time.time()
+        for reaction_id in reaction_ids:
+            merger.reaction_dblinks(reaction_id=reaction_id)
+        for metabolite_id in metabolite_ids:
+            merger.metabolite_dblinks(metabolite_id=metabolite_id)
+        lookup_seconds = time.time() - start
+
+        sample = reaction_ids[:args.sample]
+        sample_metabolites = list(dict.fromkeys(m for r in sample for m in merger.reactions[r]['STOICHIOMETRY']))
+        start = time.time()
+        for reaction_id in sample:
+            assert scan_dblinks(metanetx_dict.reactions_xref, reaction_id) == \
+                merger.reaction_dblinks(reaction_id=reaction_id)
+        reaction_scan = (time.time() - start) / len(sample)
+        start = time.time()
+        for metabolite_id in sample_metabolites:
+            assert scan_dblinks(metanetx_dict.metabolites_xref, metabolite_id) == \
+                merger.metabolite_dblinks(metabolite_id=metabolite_id)
+        metabolite_scan = (time.time() - start) / len(sample_metabolites)
+        scan_seconds = reaction_scan * len(reaction_ids) + metabolite_scan * len(metabolite_ids)
+
+        print('%d reactions and %d metabolites merged, %d xref rows' % (
+            len(reaction_ids), len(metabolite_ids), len(metanetx_dict.reactions_xref) +
+            len(metanetx_dict.metabolites_xref)))
+        print('merge with indexes        %8.2f s' % merge_seconds)
+        print('  building the indexes    %8.2f s' % index_seconds)
+        print('  dblinks from indexes    %8.2f s' % lookup_seconds)
+        print('dblinks by scan           %8.2f s (extrapolated from %d reactions and %d metabolites)' % (
+            scan_seconds, len(sample), len(sample_metabolites)))
+        print('merge with scan           %8.2f s (estimated)' % (merge_seconds - lookup_seconds - index_seconds +
+                                                                 scan_seconds))
+    finally:
+        if args.data is None:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,29 @@
 import collections
+import concurrent.futures
 import logging
 import re
+import threading
+import urllib.parse
 
-import requests
-
-from interfaces import databaseExtraction
+import tools
+import transport
+from interfaces import databaseExtraction, enzymeAssignment
+from kegg import cache, mirror
 
 kegg_url = "http://rest.kegg.jp/get/%s"
-kegg_reaction_pattern = re.compile("^[R]\d{5}")
-kegg_compound_pattern = re.compile("^[CG]\d{5}")
+kegg_host = urllib.parse.urlparse(kegg_url).netloc
+kegg_rest_url = "http://rest.kegg.jp/%s"
+kegg_ec_reaction_link = 'link/reaction/enzyme'
+# KEGG REST list of every E.C. number, used to expand partial E.C. numbers
+kegg_ec_list = 'list/enzyme'
+# KEGG conv databases for compound cross references, keyed by the DBLINKS name they replace
+kegg_conv_databases = collections.OrderedDict([('PubChem', 'pubchem'), ('ChEBI', 'chebi')])
+kegg_batch_size = 10
+# KEGG asks that REST clients make no more than 3 calls per second
+kegg_rate = 3
+kegg_workers = 4
+kegg_reaction_pattern = re.compile(r"^[R]\d{5}")
+kegg_compound_pattern = re.compile(r"^[CG]\d{5}")
 
 
 class KeggExtraction(databaseExtraction.DatabaseExtraction):
@@ -16,8 +31,75 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
     Database extraction module to extract reactions and metabolites from KEGG
     The module extends the databaseExtraction interface
     It works by making use of the KEGG REST services
+    Entries are fetched in batches of up to kegg_batch_size ids per REST call and kept in kegg_entries
+    Batches are fetched concurrently by kegg_workers threads, and the shared transport limits calls to KEGG to
+    kegg_rate calls per second
+    If kegg_cache is given, entries are looked up in an on-disk cache (see kegg.cache) before calling KEGG,
+    and in offline mode a cache miss raises cache.CacheMissError instead of calling KEGG
+    With kegg_bulk, E.C. to reaction links and compound cross references are read from whole KEGG link/conv tables
+    held in memory, so E.C. entries are never fetched
+    With kegg_mirror, entries are read from a local copy of the KEGG ligand flat files instead of KEGG REST
     """
 
+    def __init__(self, **kwargs):
+        super(KeggExtraction, self).__init__(**kwargs)
+        self._kegg_entries = {}
+        self._kegg_workers = kwargs.get('kegg_workers') or kegg_workers
+        transport.limit_host(kegg_host, rate=kwargs.get('kegg_rate', kegg_rate))
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._offline = kwargs.get('offline', False)
+        self._mirror = mirror.Mirror(kwargs['kegg_mirror']) if kwargs.get('kegg_mirror') else None
+        self._entry_cache = self.open_cache(kwargs.get('kegg_cache'), kwargs.get('kegg_release'),
+                                            kwargs.get('kegg_cache_ttl'), kwargs.get('kegg_cache_size'))
+        self._bulk = kwargs.get('kegg_bulk', False)
+        self._ec_reactions = enzymeAssignment.ECTrie()
+        self._ec_numbers = None
+        self._compound_xrefs = {}
+        self._equations = {}
+
+    def open_cache(self, path, release, ttl, max_entries):
+        """
+        Open the KEGG entry cache for the current KEGG release
+        Offline, the release defaults to the most recent release in the cache
+        :param path: path to the cache database, or None to run without a cache
+        :param release: the KEGG release, looked up from the KEGG info REST service if not given
+        :param ttl: time to live of cached entries in seconds
+        :param max_entries: the maximum number of entries kept by the cache
+        :return: a cache.EntryCache, or None
+        """
+        if self._mirror is not None:
+            logging.info("Reading KEGG entries from the flat file mirror %s" % self._mirror.path)
+            return None
+        if path is None:
+            if self._offline:
+                raise cache.CacheMissError("Offline mode requires a KEGG cache")
+            return None
+        if release is None:
+            if self._offline:
+                release = cache.latest_release(path)
+                if release is None:
+                    raise cache.CacheMissError("KEGG cache %s is empty, it can not be used offline" % path)
+            else:
+                logging.info("Calling KEGG REST service: %s" % cache.kegg_info_url)
+                response = transport.get(cache.kegg_info_url)
+                response.raise_for_status()
+                release = cache.parse_release(response.text)
+        logging.info("Using KEGG cache %s for release %s" % (path, release))
+        return cache.EntryCache(path, release, ttl=ttl, max_entries=max_entries)
+
+    @property
+    def entry_cache(self):
+        return self._entry_cache
+
+    @property
+    def kegg_entries(self):
+        """
+        KEGG entries fetched so far, keyed by E.C. number, reaction id or compound id
+        :return:
+        """
+        return self._kegg_entries
+
     def metabolite_inchi_key(self, **kwargs):
         pass
 
@@ -51,6 +133,12 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
                 db_links[l.split(': ')[0]] = l.split(': ')[1]
         except KeyError:
             db_links = {}
+        if self._bulk and self._mirror is None:
+            # The PubChem and ChEBI links of the entry are replaced by those of the bulk conv tables, if they have one
+            db_links.setdefault('KEGG', kwargs['metabolite_id'])
+            for db, xrefs in self._compound_xrefs.items():
+                if kwargs['metabolite_id'] in xrefs:
+                    db_links[db] = ' '.join(xrefs[kwargs['metabolite_id']])
         return db_links
 
     def metabolite_formula(self, **kwargs):
@@ -117,8 +205,7 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
         :return:
         """
         if metabolite_id not in self.metabolites:
-            logging.info("\t\tCalling KEGG REST service: %s" % metabolite_id)
-            compound_kegg_entry = get_entry(rest2dict(requests.get(kegg_url % metabolite_id)))
+            compound_kegg_entry = self.kegg_entry(metabolite_id)
 
             name = self.metabolite_name(compound_kegg_entry=compound_kegg_entry, metabolite_id=metabolite_id)
             formula = self.metabolite_formula(compound_kegg_entry=compound_kegg_entry)
@@ -132,26 +219,260 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
             logging.info("\t\tCompound %s already extracted from KEGG" % metabolite_id)
             return self.metabolites[metabolite_id]
 
-    def get_reactions(self):
+    def kegg_entry(self, entry_id):
+        """
+        Return the KEGG entry for an id, fetching it if it has not been fetched yet
+        :param entry_id:
+        :return:
         """
+        self.fetch_entries([entry_id])
+        return self.kegg_entries[entry_id]
 
+    def fetch_entries(self, entry_ids):
+        """
+        Fetch the KEGG entries that are not already in kegg_entries
+        Ids are joined with '+' into multi-entry REST calls of up to kegg_batch_size ids
+        :param entry_ids: E.C. numbers, reaction ids or compound ids
+        :return:
+        """
+        pending = self.load_cached(entry_ids)
+        if self._mirror is not None:
+            for entry_id in pending:
+                lines = self._mirror.lines(entry_id)
+                self.kegg_entries[entry_id] = get_entry(lines) if lines else {}
+            return
+        for i in range(0, len(pending), kegg_batch_size):
+            self.fetch_batch(pending[i:i + kegg_batch_size])
+
+    def fetch_batch(self, batch):
+        """
+        Fetch up to kegg_batch_size KEGG entries in one REST call and store them in kegg_entries
+        KEGG answers 404 when none of the ids exist. Ids that KEGG does not return are stored in kegg_entries
+        as empty entries so that they are not requested again in this run, but only the entries that were
+        returned are stored in the cache
+        Any other error status raises requests.HTTPError, and nothing is stored
+        :param batch: the ids to fetch
+        :return: the ids in the batch
+        """
+        try:
+            if self._offline:
+                raise cache.CacheMissError("KEGG entries not in the cache: %s" % ' '.join(batch))
+            logging.info("Calling KEGG REST service: %s" % ' '.join(batch))
+            response = transport.get(kegg_url % '+'.join(batch))
+            if response.status_code == 404:
+                entries = []
+            else:
+                response.raise_for_status()
+                entries = rest2entries(response)
+            fetched = {}
+            for entry in entries:
+                if 'ENTRY' not in entry:
+                    logging.warning("Skipping a KEGG response record without an ENTRY field for %s" %
+                                    ' '.join(batch))
+                    continue
+                fetched[get_entry_id(entry)] = entry
+            if self.entry_cache is not None and fetched:
+                self.entry_cache.put_many(fetched)
+            for entry_id in batch:
+                if entry_id not in fetched:
+                    logging.info("No KEGG entry returned for %s" % entry_id)
+                    fetched[entry_id] = {}
+            self.kegg_entries.update(fetched)
+            return batch
+        finally:
+            with self._in_flight_lock:
+                for entry_id in batch:
+                    self._in_flight.pop(entry_id, None)
+
+    def load_cached(self, entry_ids):
+        """
+        Move the entries that are in the cache into kegg_entries
+        :param entry_ids: E.C. numbers, reaction ids or compound ids
+        :return: the unique ids, in order, that are still not in kegg_entries
+        """
+        pending = list(collections.OrderedDict.fromkeys(e for e in entry_ids if e not in self.kegg_entries))
+        if self.entry_cache is not None and pending:
+            cached = self.entry_cache.get_many(pending)
+            self.kegg_entries.update(cached)
+            pending = [e for e in pending if e not in cached]
+        return pending
+
+    def submit_entries(self, executor, entry_ids):
+        """
+        Submit batches for the ids that are neither fetched nor already in flight
+        An id that is already in flight is not requested again, the future of the batch fetching it is returned instead
+        :param executor: the executor the batches are submitted to
+        :param entry_ids: E.C. numbers, reaction ids or compound ids
+        :return: the set of futures that will fetch the ids, and the list of ids that are already in kegg_entries
+        """
+        futures = set()
+        pending = []
+        entry_ids = list(collections.OrderedDict.fromkeys(entry_ids))
+        self.load_cached(entry_ids)
+        with self._in_flight_lock:
+            ready = [e for e in entry_ids if e in self.kegg_entries]
+            for entry_id in entry_ids:
+                if entry_id in self._in_flight:
+                    futures.add(self._in_flight[entry_id])
+                elif entry_id not in self.kegg_entries:
+                    pending.append(entry_id)
+            for i in range(0, len(pending), kegg_batch_size):
+                batch = pending[i:i + kegg_batch_size]
+                future = executor.submit(self.fetch_batch, batch)
+                for entry_id in batch:
+                    self._in_flight[entry_id] = future
+                futures.add(future)
+        return futures, ready
+
+    def prefetch_entries(self):
+        """
+        Fetch the E.C., reaction and compound entries for the assigned enzymes with a pool of kegg_workers threads
+        The levels are pipelined: as soon as a batch of E.C. entries arrives its reactions are submitted,
+        and as soon as a batch of reactions arrives their compounds are submitted
+        :return:
+        """
+        next_level = {'EC': (self.ec_reaction_ids, 'REACTION'),
+                      'REACTION': (self.equation_compound_ids, 'COMPOUND'),
+                      'COMPOUND': (None, None)}
+        pending = {}
+
+        def submit(executor, entry_ids, level):
+            futures, ready = self.submit_entries(executor, entry_ids)
+            for future in futures:
+                pending.setdefault(future, level)
+            submit_linked(executor, ready, level)
+
+        def submit_linked(executor, entry_ids, level):
+            linked_ids, linked_level = next_level[level]
+            if linked_ids is not None and entry_ids:
+                submit(executor, [i for e in entry_ids for i in linked_ids(self.kegg_entries[e])], linked_level)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._kegg_workers) as executor:
+            if self._bulk:
+                submit(executor, [r for ec_number in self.enzymes.keys() for r in self.reaction_ids(ec_number)],
+                       'REACTION')
+            else:
+                submit(executor, [ec for ec_number in self.enzymes.keys() for ec in self.expand_ec(ec_number)], 'EC')
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    submit_linked(executor, future.result(), pending.pop(future))
+
+    def kegg_table(self, operation):
+        """
+        A whole KEGG link or conv table, looked up in the cache before calling KEGG
+        :param operation: the REST operation, E.G.: link/reaction/enzyme
+        :return: a dict of lists, see rest2links
+        """
+        if self.entry_cache is not None:
+            cached = self.entry_cache.get_many([operation])
+            if operation in cached:
+                return cached[operation]
+        if self._offline:
+            raise cache.CacheMissError("KEGG table not in the cache: %s" % operation)
+        logging.info("Calling KEGG REST service: %s" % operation)
+        response = transport.get(kegg_rest_url % operation)
+        response.raise_for_status()
+        table = rest2links(response)
+        if self.entry_cache is not None:
+            self.entry_cache.put_many({operation: table})
+        return table
+
+    def load_tables(self):
+        """
+        Load the E.C. to reaction link table and the compound conv tables used in bulk mode
+        :return:
+        """
+        self._ec_reactions = enzymeAssignment.ECTrie(self.kegg_table(kegg_ec_reaction_link))
+        for db, kegg_db in kegg_conv_databases.items():
+            self._compound_xrefs[db] = self.kegg_table('conv/%s/compound' % kegg_db)
+
+    def reaction_ids(self, ec_number):
+        """
+        KEGG reaction ids linked to an E.C. number, or to every E.C. number under a partial one
+        :param ec_number:
+        :return:
+        """
+        if self._bulk and self._mirror is None:
+            return self._ec_reactions.match(ec_number)
+        return list(collections.OrderedDict.fromkeys(
+            r for ec in self.expand_ec(ec_number) for r in self.ec_reaction_ids(self.kegg_entry(ec))))
+
+    def expand_ec(self, ec_number):
+        """
+        The KEGG E.C. numbers matching an E.C. number: itself if it is fully specified, or every KEGG E.C. number
+        under a partial one (see enzymeAssignment.ECTrie)
+        :param ec_number:
+        :return: a list of E.C. numbers
+        """
+        if not enzymeAssignment.is_partial(ec_number):
+            return [ec_number]
+        if self._ec_numbers is None:
+            if self._mirror is not None:
+                flat_file = self._mirror.flat_file(ec_number)
+                ec_numbers = flat_file.index.keys() if flat_file is not None else []
+            else:
+                ec_numbers = self.kegg_table(kegg_ec_list).keys()
+            self._ec_numbers = enzymeAssignment.ECTrie(
+                dict((ec, [ec]) for ec in ec_numbers if re.fullmatch(enzymeAssignment.ec_pattern, ec)))
+        return self._ec_numbers.match(ec_number)
+
+    @staticmethod
+    def ec_reaction_ids(ec_kegg_entry):
+        """
+        KEGG reaction ids listed in the ALL_REAC field of an E.C. entry
+        :param ec_kegg_entry:
+        :return:
+        """
+        kegg_reaction_ids = []
+        try:
+            for e in ec_kegg_entry['ALL_REAC']:
+                for r in e.split(' '):
+                    kegg_reaction_ids.extend(re.findall(kegg_reaction_pattern, r))
+        except KeyError:
+            pass
+        return kegg_reaction_ids
+
+    def equation_compound_ids(self, reaction_kegg_entry):
+        """
+        KEGG compound ids on either side of the EQUATION field of a reaction entry
+        :param reaction_kegg_entry:
+        :return:
+        """
+        try:
+            return self.reaction_equation(reaction_id=get_entry_id(reaction_kegg_entry),
+                                          reaction_kegg_entry=reaction_kegg_entry).ids
+        except KeyError:
+            return ()
+
+    def get_reactions(self):
+        """
+        All E.C., reaction and compound entries are fetched concurrently (see prefetch_entries) before
+        the reactions are built in assigned enzyme order, so the output does not depend on completion order
         :return:
         """
         logging.info("Executing KEGG Extractor")
+        if self._mirror is not None:
+            with self._mirror:
+                self.extract_reactions()
+            return
+        if self._bulk:
+            self.load_tables()
+        self.prefetch_entries()
+        if self.entry_cache is not None and not self._offline:
+            self.entry_cache.evict()
+        self.extract_reactions()
+
+    def extract_reactions(self):
+        """
+        Build the reactions of the assigned enzymes, and their metabolites, from the KEGG entries
+        :return:
+        """
         for ec_number in self.enzymes.keys():
-            logging.info("Calling KEGG REST service: %s" % ec_number)
-            ec_kegg_entry = get_entry(rest2dict(requests.get(kegg_url % ec_number)))
-            kegg_reaction_ids = []
-            try:
-                for e in ec_kegg_entry['ALL_REAC']:
-                    for r in e.split(' '):
-                        kegg_reaction_ids.extend(re.findall(kegg_reaction_pattern, r))
-            except KeyError:
-                pass
-            for r in kegg_reaction_ids:
+            for r in self.reaction_ids(ec_number):
                 if r not in self.reactions:
-                    logging.info("\tCalling KEGG REST service: %s" % r)
-                    reaction_kegg_entry = get_entry(rest2dict(requests.get(kegg_url % r)))
+                    logging.info("\tExtracting reaction: %s" % r)
+                    reaction_kegg_entry = self.kegg_entry(r)
 
                     name = self.reaction_name(reaction_id=r, reaction_kegg_entry=reaction_kegg_entry)
                     reversible = self.reaction_reversibility(reaction_kegg_entry=reaction_kegg_entry)
@@ -161,7 +482,8 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
                                                           reaction_id=r)
                     products = self.reaction_products(reaction_kegg_entry=reaction_kegg_entry, reaction_id=r)
                     stoichiometry = self.reaction_stoichiometry(substrates=substrates, products=products,
-                                                                reaction_kegg_entry=reaction_kegg_entry)
+                                                                reaction_kegg_entry=reaction_kegg_entry,
+                                                                reaction_id=r)
                     pathways = self.reaction_pathways(reaction_kegg_entry=reaction_kegg_entry)
 
                     reaction = databaseExtraction.ReactionDict(r, name, substrates, products, reversible, ec_number,
@@ -175,18 +497,28 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
                     reaction.append_enzyme(ec_number)
                     reaction.append_gene(self.enzymes[ec_number])
 
+    def reaction_equation(self, **kwargs):
+        """
+        The parsed EQUATION of a reaction entry (see tools.parse_equation), memoized per reaction id
+        :return:
+        """
+        reaction_id = kwargs['reaction_id']
+        if reaction_id not in self._equations:
+            self._equations[reaction_id] = tools.parse_equation(kwargs['reaction_kegg_entry']['EQUATION'][0],
+                                                                kegg_compound_pattern)
+        return self._equations[reaction_id]
+
     def reaction_substrates(self, **kwargs):
         """
 
         :return:
         """
-        reaction_substrate_ids = []
-        for kegg_compound_id in kwargs['reaction_kegg_entry']['EQUATION'][0].split('<=>')[0].split(' '):
-            reaction_substrate_ids.extend(re.findall(kegg_compound_pattern, kegg_compound_id))
+        equation = self.reaction_equation(**kwargs)
         substrates = {}
-        for substrate in reaction_substrate_ids:
-            substrates[substrate] = self.extract_metabolite(substrate)
-            logging.info("\t\t\tAdding %s as substrate to %s" % (substrate, kwargs['reaction_id']))
+        for substrate, side in zip(equation.ids, equation.sides):
+            if side == 0:
+                substrates[substrate] = self.extract_metabolite(substrate)
+                logging.info("\t\t\tAdding %s as substrate to %s" % (substrate, kwargs['reaction_id']))
         return substrates
 
     def reaction_products(self, **kwargs):
@@ -194,39 +526,17 @@ class KeggExtraction(databaseExtraction.DatabaseExtraction):
 
         :return:
         """
-        reaction_product_ids = []
-        for kegg_compound_id in kwargs['reaction_kegg_entry']['EQUATION'][0].split('<=>')[1].split(' '):
-            reaction_product_ids.extend(re.findall(kegg_compound_pattern, kegg_compound_id))
+        equation = self.reaction_equation(**kwargs)
         products = {}
-        for product in reaction_product_ids:
-            products[product] = self.extract_metabolite(product)
-            logging.info("\t\t\tAdding %s as product to %s" % (product, kwargs['reaction_id']))
+        for product, side in zip(equation.ids, equation.sides):
+            if side == 1:
+                products[product] = self.extract_metabolite(product)
+                logging.info("\t\t\tAdding %s as product to %s" % (product, kwargs['reaction_id']))
         return products
 
     def reaction_stoichiometry(self, **kwargs):
-        stoichiometry = {}
-        equation = kwargs['reaction_kegg_entry']['EQUATION'][0].replace(" ", "")
-        for substrate in kwargs['substrates']:
-            index = equation.index(substrate)
-            if not index == 0:
-                if equation[index - 1].isdigit():
-                    stoichiometry[substrate] = int(equation[index - 1])
-                else:
-                    stoichiometry[substrate] = 1
-            else:
-                stoichiometry[substrate] = 1
-
-        for product in kwargs['products']:
-            index = equation.index(product)
-            if not index == 0:
-                if equation[index - 1].isdigit():
-                    stoichiometry[product] = int(equation[index - 1])
-                else:
-                    stoichiometry[product] = 1
-            else:
-                stoichiometry[product] = 1
-
-        return stoichiometry
+        equation = self.reaction_equation(**kwargs)
+        return dict(zip(equation.ids, equation.coefficients))
 
     def reaction_pathways(self, **kwargs):
         try:
@@ -252,6 +562,51 @@ def rest2dict(request):
     return res
 
 
+def rest2entries(request):
+    """
+    Transforms a multi-entry KEGG get REST request into a list of entries (see get_entry)
+    Entries in the response are separated by '///' lines
+    :param request:
+    :return:
+    """
+    entries = []
+    for text in request.text.split('///'):
+        lines = [line for line in text.split('\n') if line]
+        if lines:
+            entries.append(get_entry(lines))
+    return entries
+
+
+def rest2links(request):
+    """
+    Transforms a KEGG link or conv REST request into a dict of lists
+    Database prefixes are removed from both columns
+    E.G.: 'ec:1.1.1.1	rn:R00623' = {'1.1.1.1': ['R00623']}
+    :param request:
+    :return:
+    """
+    links = collections.OrderedDict()
+    for line in request.text.split('\n'):
+        if '\t' in line:
+            source, target = line.split('\t', 1)
+            links.setdefault(source.split(':', 1)[-1], []).append(target.strip().split(':', 1)[-1])
+    return links
+
+
+def get_entry_id(entry):
+    """
+    The id of a KEGG entry, taken from its ENTRY field
+    E.C. entries are returned without the 'EC ' prefix
+    E.G.: 'EC 1.1.1.1   Enzyme' = 1.1.1.1, 'R00001   Reaction' = R00001
+    :param entry:
+    :return:
+    """
+    fields = entry['ENTRY'][0].split()
+    if fields[0] == 'EC':
+        return fields[1]
+    return fields[0]
+
+
 def get_entry(r):
     e = {}
     temp = []
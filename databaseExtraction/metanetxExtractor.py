@@ -0,0 +1,168 @@
+import logging
+
+import tools
+from interfaces import databaseExtraction
+from network_merging import metanetx
+
+
+class MetaNetXExtraction(databaseExtraction.DatabaseExtraction):
+    """
+    Database extraction module to extract reactions and metabolites from the MNXref tables
+    The module extends the databaseExtraction interface
+    Reactions are found for each assigned E.C. number through MetaNetXDict.ec_index, and their metabolites,
+    stoichiometry and cross references are read from the local MNXref tables, so no remote service is called
+    It only runs with mnxref_extraction, reading the tables from mnxref_store, or mnxref_path (see MetaNetXDict)
+    """
+
+    def __init__(self, **kwargs):
+        super(MetaNetXExtraction, self).__init__(**kwargs)
+        self._enabled = kwargs.get('mnxref_extraction', False)
+        self._mnxref_path = kwargs.get('mnxref_path')
+        self._mnxref_store = kwargs.get('mnxref_store')
+        self._mnxref_columnar = kwargs.get('mnxref_columnar', False)
+        self._metanetx_dict = None
+        self._equations = {}
+
+    def database_name(self):
+        return "MNXref"
+
+    @property
+    def metanetx_dict(self):
+        """
+        The MNXref tables, loaded the first time they are used
+        :return:
+        """
+        if self._metanetx_dict is None:
+            self._metanetx_dict = metanetx.MetaNetXDict(mnxref_path=self._mnxref_path, store=self._mnxref_store,
+                                                        columnar=self._mnxref_columnar)
+        return self._metanetx_dict
+
+    def get_reactions(self):
+        """
+        Build the reactions of every assigned E.C. number, in assigned enzyme order
+        :return:
+        """
+        if not self._enabled:
+            return
+        logging.info("Executing MNXref Extractor")
+        ec_index = self.metanetx_dict.ec_index
+        for ec_number in self.enzymes.keys():
+            for r in ec_index.match(ec_number):
+                if r not in self.reactions:
+                    equation = self.reaction_equation(reaction_id=r)
+                    if 0 not in equation.sides or 1 not in equation.sides:
+                        logging.info("\tSkipping reaction %s, its equation has an empty side" % r)
+                        continue
+                    logging.info("\tExtracting reaction: %s" % r)
+                    name = self.reaction_name(reaction_id=r)
+                    substrates = self.reaction_substrates(reaction_id=r)
+                    products = self.reaction_products(reaction_id=r)
+                    reversible = self.reaction_reversibility(reaction_id=r)
+                    db_links = self.reaction_dblinks(reaction_id=r)
+                    stoichiometry = self.reaction_stoichiometry(reaction_id=r)
+                    pathways = self.reaction_pathways(reaction_id=r)
+
+                    reaction = databaseExtraction.ReactionDict(r, name, substrates, products, reversible, ec_number,
+                                                               self.enzymes[ec_number], db_links, stoichiometry,
+                                                               pathways)
+                    self.reactions[r] = reaction
+                else:
+                    logging.info("\tReaction %s already extracted from MNXref .... appending E.C. number and Gene IDs" % r)
+                    reaction = self.reactions[r]
+                    reaction.append_enzyme(ec_number)
+                    reaction.append_gene(self.enzymes[ec_number])
+
+    def reaction_equation(self, **kwargs):
+        """
+        The parsed MNXref equation of a reaction (see tools.parse_equation), memoized per reaction id
+        :return:
+        """
+        reaction_id = kwargs['reaction_id']
+        if reaction_id not in self._equations:
+            self._equations[reaction_id] = tools.parse_equation(self.metanetx_dict.reactions[reaction_id]['EQUATION'],
+                                                                metanetx.metanetx_metabolite_pattern)
+        return self._equations[reaction_id]
+
+    def reaction_substrates(self, **kwargs):
+        equation = self.reaction_equation(**kwargs)
+        return dict((i, self.extract_metabolite(i)) for i, side in zip(equation.ids, equation.sides) if side == 0)
+
+    def reaction_products(self, **kwargs):
+        equation = self.reaction_equation(**kwargs)
+        return dict((i, self.extract_metabolite(i)) for i, side in zip(equation.ids, equation.sides) if side == 1)
+
+    def reaction_stoichiometry(self, **kwargs):
+        equation = self.reaction_equation(**kwargs)
+        return dict(zip(equation.ids, equation.coefficients))
+
+    def reaction_name(self, **kwargs):
+        reaction_id = kwargs['reaction_id']
+        return [self.metanetx_dict.reactions[reaction_id]['DESCRIPTION'] or reaction_id]
+
+    def reaction_reversibility(self, **kwargs):
+        # MNXref equations carry no direction
+        return True
+
+    def reaction_dblinks(self, **kwargs):
+        db_links = {'METANETX': kwargs['reaction_id']}
+        for db, reaction_xref in self.metanetx_dict.reaction_xref_index.get(kwargs['reaction_id'], []):
+            database, xref = metanetx.db_link(db)
+            db_links[database] = xref
+        return db_links
+
+    def reaction_pathways(self, **kwargs):
+        return []
+
+    def extract_metabolite(self, metabolite_id):
+        if metabolite_id not in self.metabolites:
+            name = self.metabolite_name(metabolite_id=metabolite_id)
+            formula = self.metabolite_formula(metabolite_id=metabolite_id)
+            db_links = self.metabolite_dblinks(metabolite_id=metabolite_id)
+            metabolite = databaseExtraction.MetaboliteDict(
+                metabolite_id, name, formula, db_links, charge=self.metabolite_charge(metabolite_id=metabolite_id),
+                inchi=self.metabolite_inchi(metabolite_id=metabolite_id),
+                inchikey=self.metabolite_inchi_key(metabolite_id=metabolite_id),
+                smiles=self.metabolite_smiles(metabolite_id=metabolite_id))
+            self.metabolites[metabolite_id] = metabolite
+        return self.metabolites[metabolite_id]
+
+    def metabolite_property(self, metabolite_id, column, default='NA'):
+        """
+        A chem_prop column of a metabolite, or default if the metabolite is not in chem_prop or the value is empty
+        :param metabolite_id:
+        :param column:
+        :param default:
+        :return:
+        """
+        try:
+            return self.metanetx_dict.metabolites[metabolite_id][column] or default
+        except KeyError:
+            return default
+
+    def metabolite_name(self, **kwargs):
+        return [self.metabolite_property(kwargs['metabolite_id'], 'DESCRIPTION', kwargs['metabolite_id'])]
+
+    def metabolite_formula(self, **kwargs):
+        return self.metabolite_property(kwargs['metabolite_id'], 'FORMULA')
+
+    def metabolite_charge(self, **kwargs):
+        return self.metabolite_property(kwargs['metabolite_id'], 'CHARGE')
+
+    def metabolite_inchi(self, **kwargs):
+        return self.metabolite_property(kwargs['metabolite_id'], 'INCHI')
+
+    def metabolite_inchi_key(self, **kwargs):
+        return self.metabolite_property(kwargs['metabolite_id'], 'INCHIKEY')
+
+    def metabolite_smiles(self, **kwargs):
+        return self.metabolite_property(kwargs['metabolite_id'], 'SMILES')
+
+    def metabolite_compartment(self, **kwargs):
+        pass
+
+    def metabolite_dblinks(self, **kwargs):
+        db_links = {'METANETX': kwargs['metabolite_id']}
+        for db, metabolite_xref in self.metanetx_dict.metabolite_xref_index.get(kwargs['metabolite_id'], []):
+            database, xref = metanetx.db_link(db)
+            db_links[database] = xref
+        return db_links
@@ -2,8 +2,8 @@
 import csv
 import logging
 import re
-import urllib.request
 
+import transport
 from xml.etree import ElementTree
 from interfaces import enzymeAssignment
 from interfaces.enzymeAssignment import ec_pattern
@@ -41,15 +41,10 @@ class OrthoMCL(enzymeAssignment.EnzymeAssignment):
         """
         url = 'http://www.orthomcl.org/webservices/GroupQuestions/ByNameList.xml?group_names_data=%s&o-fields=ec_numbers' % (
             orthoMCL_group)
-        req = urllib.request.urlopen(url)
-        rdata = []
-        chunk = 'xx'
-        while chunk:
-            chunk = req.read()
-            if chunk:
-                rdata.append(chunk)
-        tree = ElementTree.fromstring(b''.join(rdata))
-        for i, elem in enumerate(tree.getiterator('field')):
+        response = transport.get(url)
+        response.raise_for_status()
+        tree = ElementTree.fromstring(response.content)
+        for i, elem in enumerate(tree.iter('field')):
             try:
                 return re.findall(ec_pattern, elem.text)
             except TypeError:
@@ -1,5 +1,5 @@
 import abc
-import collections
+import collections.abc
 import sys
 
 from interfaces.enzymeAssignment import AssignedEnzymeDict
@@ -134,7 +134,7 @@ class DatabaseExtraction(abc.ABC):
             sys.exit()
 
 
-class ReactionDict(collections.MutableMapping):
+class ReactionDict(collections.abc.MutableMapping):
     """
     An object designed to store reactions.
     Reaction id is the key
@@ -321,7 +321,7 @@ class ReactionDict(collections.MutableMapping):
                 sys.exit()
 
 
-class MetaboliteDict(collections.MutableMapping):
+class MetaboliteDict(collections.abc.MutableMapping):
     """
     A dictionary designed to store metabolites.
     Metabolite id is the key
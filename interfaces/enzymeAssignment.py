@@ -1,11 +1,147 @@
 # -*- coding: utf-8 -*-
 
 import abc
-import collections
+import collections.abc
 import re
 import sys
 
-ec_pattern = re.compile('\d+\.\d+\.\d+\.\d+')
+# An E.C. number, fully specified (1.1.1.1), preliminary (2.7.1.n1) or partial with '-' levels (1.1.1.-, 1.1.-.-)
+ec_pattern = re.compile(r'\d+\.(?:n?\d+|-)\.(?:n?\d+|-)\.(?:n?\d+|-)')
+ec_wildcard = '-'
+
+
+def ec_levels(ec_number):
+    """
+    The four levels of an E.C. number, every level after a '-' is a wildcard too
+    E.G.: '1.1.1.1' = ('1', '1', '1', '1'), '1.1.-.-' = ('1', '1', '-', '-'), '1.-.1.-' = ('1', '-', '-', '-')
+    :param ec_number:
+    :return: a tuple of four strings
+    """
+    levels = ec_number.split('.')
+    if len(levels) != 4:
+        raise ValueError('Not an E.C. number: %s' % ec_number)
+    prefix = ec_prefix(ec_number)
+    return tuple(prefix) + (ec_wildcard,) * (len(levels) - len(prefix))
+
+
+def ec_prefix(ec_number):
+    """
+    The specified levels of an E.C. number, up to its first '-'
+    E.G.: '1.1.1.1' = ('1', '1', '1', '1'), '1.1.-.-' = ('1', '1')
+    :param ec_number:
+    :return: a tuple of strings
+    """
+    prefix = []
+    for level in ec_number.split('.'):
+        if level == ec_wildcard:
+            break
+        prefix.append(level)
+    return tuple(prefix)
+
+
+def is_partial(ec_number):
+    return ec_wildcard in ec_number.split('.')
+
+
+def ec_wildcards(ec_number):
+    """
+    An E.C. number and every partial E.C. number covering it, most specific first
+    E.G.: '1.1.1.1' = ['1.1.1.1', '1.1.1.-', '1.1.-.-', '1.-.-.-']
+    :param ec_number:
+    :return: a list of E.C. numbers
+    """
+    levels = ec_levels(ec_number)
+    return ['.'.join(levels[:depth] + (ec_wildcard,) * (4 - depth))
+            for depth in range(len(ec_prefix(ec_number)), 0, -1)]
+
+
+class ECTrie:
+    """
+    E.C. numbers in a four-level trie, one node per level, each E.C. number with a list of values
+    E.G. reactions by E.C. number. A partial E.C. number (1.1.1.-) is resolved to the values of every E.C. number
+    under it with a single walk down its prefix, instead of a scan of every E.C. number
+    Partial E.C. numbers can be stored too, with their '-' levels
+    """
+
+    def __init__(self, index=None):
+        """
+        :param index: an optional dict of E.C. number to a list of values to add
+        """
+        self._root = {}
+        self._size = 0
+        for ec_number, values in (index or {}).items():
+            for value in values:
+                self.add(ec_number, value)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, ec_number):
+        return self.node(ec_levels(ec_number)) is not None
+
+    def add(self, ec_number, value):
+        """
+        Add a value to an E.C. number
+        :param ec_number:
+        :param value:
+        :return:
+        """
+        node = self._root
+        levels = ec_levels(ec_number)
+        for level in levels[:-1]:
+            node = node.setdefault(level, {})
+        if levels[-1] not in node:
+            node[levels[-1]] = []
+            self._size += 1
+        node[levels[-1]].append(value)
+
+    def node(self, levels):
+        """
+        The node at the end of a path of levels
+        :param levels:
+        :return: a dict of the next level to its node, the list of values after four levels, or None
+        """
+        node = self._root
+        for level in levels:
+            node = node.get(level)
+            if node is None:
+                return None
+        return node
+
+    def items(self, ec_number):
+        """
+        The E.C. numbers matching an E.C. number and their values: the E.C. number itself if it is fully specified,
+        or every E.C. number under the prefix of a partial one, including the partial ones
+        :param ec_number:
+        :return: a generator of (E.C. number, list of values) tuples, in the order they were added
+        """
+        prefix = ec_prefix(ec_number)
+        node = self.node(prefix)
+        if node is None:
+            return
+        stack = [(prefix, node)]
+        while stack:
+            levels, node = stack.pop()
+            if len(levels) == 4:
+                yield '.'.join(levels), node
+            else:
+                stack.extend((levels + (level,), child) for level, child in reversed(list(node.items())))
+
+    def match(self, ec_number):
+        """
+        The values of every E.C. number matching an E.C. number, see items
+        :param ec_number:
+        :return: a list of values, without duplicates
+        """
+        return list(collections.OrderedDict.fromkeys(v for ec, values in self.items(ec_number) for v in values))
+
+    def ec_numbers(self, ec_number):
+        """
+        The E.C. numbers matching an E.C. number, see items
+        :param ec_number:
+        :return: a list of E.C. numbers
+        """
+        return [ec for ec, values in self.items(ec_number)]
 
 
 class EnzymeAssignment(abc.ABC):
@@ -41,7 +177,7 @@ class EnzymeAssignment(abc.ABC):
         pass
 
 
-class AssignedEnzymeDict(collections.MutableMapping):
+class AssignedEnzymeDict(collections.abc.MutableMapping):
     """
     A dictionary designed to store enzyme numbers as keys, with gene ids as values
     """
@@ -65,15 +201,27 @@ class AssignedEnzymeDict(collections.MutableMapping):
     def __len__(self):
         return len(self.store)
 
+    def genes(self, ec_number):
+        """
+        The genes assigned to an E.C. number, or to a partial E.C. number covering it
+        E.G. the genes of 1.1.1.- are also genes of 1.1.1.1
+        :param ec_number:
+        :return: a list of gene ids
+        """
+        genes = []
+        for ec in ec_wildcards(ec_number):
+            genes.extend(gene for gene in self.store.get(ec, []) if gene not in genes)
+        return genes
+
     @staticmethod
     def enzyme_key(key):
         """
-        check that key is an enzyme number
+        check that key is an enzyme number, fully specified or partial (see ec_pattern)
         :param key:
         :return key:
         """
         try:
-            assert re.match(ec_pattern, key)
+            assert re.fullmatch(ec_pattern, key)
             return key
         except AssertionError:
             print('Keys for the assigned_enzyme dict must be valid E.C. numbers')
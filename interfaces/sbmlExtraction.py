@@ -8,12 +8,51 @@ class SBMLExtraction(databaseExtraction.DatabaseExtraction):
         self._reactions = {}
         self._metabolites = {}
         self._assigned_enzymes = self.assigned_enzymes(kwargs['enzymes'])
-        self._sbml_file = sbml.load_sbml(kwargs['sbml_file'])
+        # The SBML file parsed once by sbml.load_inputs and shared with source detection, or parsed here
+        # With sbml_stream, the file is not loaded with libsbml. Extractors read it with sbml.reader instead,
+        # one species or reaction at a time, and sbml_file is None
+        sbml_input = kwargs.get('sbml_input') or sbml.SBMLInput(kwargs['sbml_file'], kwargs.get('sbml_stream', False))
+        self._sbml_path = sbml_input.path
+        self._sbml_stream = sbml_input.stream
+        self._sbml_file = sbml_input.document
+        self._notes = sbml_input.notes
+        self._model_id = sbml_input.model_id
+
+    @classmethod
+    def claims(cls, sbml_input):
+        """
+        Whether this plugin extracts a SBML file, detected from the model metadata and notes
+        :param sbml_input: a sbml.SBMLInput
+        :return:
+        """
+        return False
 
     @property
     def sbml_file(self):
         return self._sbml_file
 
+    @property
+    def sbml_path(self):
+        return self._sbml_path
+
+    @property
+    def sbml_stream(self):
+        return self._sbml_stream
+
+    @property
+    def model_id(self):
+        return self._model_id
+
+    @property
+    def notes(self):
+        """
+        The parsed notes of every species and reaction in sbml_file, see sbml.notes_index
+        Extractors that change a notes dict must change a copy. Empty with sbml_stream, where the notes of each
+        species and reaction are read with it
+        :return:
+        """
+        return self._notes
+
     def reaction_name(self, **kwargs):
         """
 
@@ -81,3 +120,16 @@ class SBMLExtraction(databaseExtraction.DatabaseExtraction):
 
     def metabolite_smiles(self, **kwargs):
         pass
+
+
+def claiming_plugin(plugins, sbml_input):
+    """
+    The first SBMLExtraction plugin that claims a SBML file
+    :param plugins: SBMLExtraction subclasses, see tools.find_classes
+    :param sbml_input: a sbml.SBMLInput
+    :return: a SBMLExtraction subclass, or None if no plugin claims the file
+    """
+    for plugin in plugins:
+        if plugin.claims(sbml_input):
+            return plugin
+    return None
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+kegg_info_url = "http://rest.kegg.jp/info/kegg"
+kegg_release_pattern = re.compile(r"Release ([^,\s]+)")
+
+
+class CacheMissError(LookupError):
+    """
+    Raised in offline mode when a KEGG entry is not in the cache
+    """
+    pass
+
+
+class EntryCache:
+    """
+    On-disk cache of KEGG entries stored in a SQLite database
+    Entries are keyed by entry id and KEGG release, so a new KEGG release never returns stale entries
+    The database runs in WAL mode so several METRONOME processes can read and write the same cache file
+    """
+
+    def __init__(self, path, release, ttl=None, max_entries=None):
+        """
+        :param path: path to the SQLite database file, created if it does not exist
+        :param release: the KEGG release entries are stored and looked up under
+        :param ttl: entries older than ttl seconds are treated as missing and removed by evict
+        :param max_entries: evict keeps at most max_entries of the most recently fetched entries
+        """
+        self._path = path
+        self._release = release
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS entries (entry_id TEXT NOT NULL, release TEXT NOT NULL, '
+                               'entry TEXT NOT NULL, fetched REAL NOT NULL, PRIMARY KEY (entry_id, release))')
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def release(self):
+        return self._release
+
+    def connection(self):
+        """
+        SQLite connections can not be shared between threads, so each thread opens its own
+        :return: the sqlite3 connection of the calling thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def oldest_allowed(self):
+        if self._ttl:
+            return time.time() - self._ttl
+        return 0
+
+    def get_many(self, entry_ids):
+        """
+        Look up several entries at once
+        :param entry_ids:
+        :return: a dict of the cached entries, keyed by entry id. Missing and expired ids are left out
+        """
+        entry_ids = list(entry_ids)
+        entries = {}
+        for i in range(0, len(entry_ids), 500):
+            batch = entry_ids[i:i + 500]
+            rows = self.connection().execute(
+                'SELECT entry_id, entry FROM entries WHERE release = ? AND fetched >= ? AND entry_id IN (%s)' %
+                ','.join('?' * len(batch)), [self.release, self.oldest_allowed()] + batch)
+            for entry_id, entry in rows:
+                entries[entry_id] = json.loads(entry)
+        return entries
+
+    def put_many(self, entries):
+        """
+        Store several entries at once, replacing any previous version for the same release
+        :param entries: a dict of entries keyed by entry id
+        :return:
+        """
+        fetched = time.time()
+        with self.connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                                   [(entry_id, self.release, json.dumps(entry), fetched)
+                                    for entry_id, entry in entries.items()])
+
+    def evict(self):
+        """
+        Remove entries of other KEGG releases, entries older than the ttl and,
+        if max_entries is set, the least recently fetched entries over that limit
+        :return: the number of entries removed
+        """
+        with self.connection() as connection:
+            removed = connection.execute('DELETE FROM entries WHERE release != ? OR fetched < ?',
+                                         (self.release, self.oldest_allowed())).rowcount
+            if self._max_entries is not None:
+                removed += connection.execute(
+                    'DELETE FROM entries WHERE rowid NOT IN '
+                    '(SELECT rowid FROM entries ORDER BY fetched DESC LIMIT ?)', (self._max_entries,)).rowcount
+        logging.info("Evicted %d entries from the KEGG cache %s" % (removed, self.path))
+        return removed
+
+
+def latest_release(path):
+    """
+    The most recent KEGG release stored in a cache, used when running offline
+    :param path: path to the SQLite database file
+    :return: the release, or None if the cache is empty or does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        connection = sqlite3.connect(path, timeout=60)
+        try:
+            row = connection.execute('SELECT release FROM entries ORDER BY fetched DESC LIMIT 1').fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    return row[0]
+
+
+def parse_release(info_text):
+    """
+    The KEGG release in the output of the KEGG info REST service
+    E.G.: 'kegg             Release 106.0+/04-18, Apr 23' = 106.0+/04-18
+    If the output names no release, the cache is keyed on the current date instead, E.G.: 'date-2026-10-18',
+    so entries are not shared with a release they may not belong to
+    :param info_text:
+    :return:
+    """
+    match = re.search(kegg_release_pattern, info_text)
+    if match:
+        return match.group(1)
+    release = time.strftime('date-%Y-%m-%d')
+    logging.warning("No KEGG release found in the output of %s, caching KEGG entries under %s" %
+                    (kegg_info_url, release))
+    return release
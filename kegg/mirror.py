@@ -0,0 +1,155 @@
+import logging
+import os
+
+# Flat files of a KEGG FTP ligand dump, keyed by the first character of the entry ids they hold
+# E.C. numbers start with a digit
+kegg_mirror_files = {'C': 'compound', 'G': 'glycan', 'R': 'reaction'}
+kegg_mirror_enzyme_file = 'enzyme'
+# Flat files a mirror may leave out, their entries are then empty
+kegg_mirror_optional_files = frozenset(['glycan'])
+
+
+class FlatFile:
+    """
+    A KEGG flat file (E.G. ligand/compound) read without loading the whole file into memory
+    Opening the file streams through it once to build an index of the byte offset of each entry,
+    after which an entry is read by seeking to its offset and reading up to the '///' line that ends it
+    The file stays open until close is called, or the with block it is used in ends
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, 'rb')
+        self._index = {}
+        for entry_id, offset in self.records():
+            self._index[entry_id] = offset
+        logging.info("Indexed %d entries in KEGG flat file %s" % (len(self._index), path))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def index(self):
+        return self._index
+
+    def __contains__(self, entry_id):
+        return entry_id in self._index
+
+    def records(self):
+        """
+        Stream through the file, yielding the id and byte offset of each entry
+        :return:
+        """
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if line.startswith(b'ENTRY'):
+                yield entry_id(line.decode('utf-8', 'replace')), offset
+            offset += len(line)
+
+    def lines(self, entry_id):
+        """
+        The lines of an entry, without the closing '///' line
+        Lines keep their 12 character field column, so they can be parsed like a KEGG REST response
+        :param entry_id:
+        :return: a list of lines, or an empty list if the entry is not in the file
+        """
+        if entry_id not in self._index:
+            return []
+        self._file.seek(self._index[entry_id])
+        lines = []
+        for line in self._file:
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            if line.startswith('///'):
+                break
+            lines.append(line)
+        return lines
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Mirror:
+    """
+    A local copy of the KEGG ligand flat files (enzyme, reaction, compound and optionally glycan)
+    Files are opened and indexed the first time an id they hold is requested, and closed by close or at the end
+    of the with block the mirror is used in. A closed mirror opens its files again when they are next needed
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the directory of the flat files
+        :raises FileNotFoundError: if a flat file that is not optional is missing
+        """
+        self._path = path
+        self._files = {}
+        missing = [name for name in sorted(set(kegg_mirror_files.values()) | {kegg_mirror_enzyme_file})
+                   if name not in kegg_mirror_optional_files and not os.path.exists(os.path.join(path, name))]
+        if missing:
+            raise FileNotFoundError("KEGG mirror %s has no %s flat file" % (path, ', '.join(missing)))
+
+    @property
+    def path(self):
+        return self._path
+
+    def flat_file(self, entry_id):
+        """
+        The flat file holding an id, or None if the mirror does not have that file
+        :param entry_id: an E.C. number, reaction id or compound id
+        :return:
+        """
+        name = kegg_mirror_files.get(entry_id[0], kegg_mirror_enzyme_file if entry_id[0].isdigit() else None)
+        if name is None:
+            return None
+        if name not in self._files:
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                self._files[name] = FlatFile(path)
+            else:
+                logging.warning("KEGG mirror %s has no %s flat file, its entries are empty" % (self.path, name))
+                self._files[name] = None
+        return self._files[name]
+
+    def lines(self, entry_id):
+        """
+        The lines of an entry, see FlatFile.lines
+        :param entry_id:
+        :return:
+        """
+        flat_file = self.flat_file(entry_id)
+        if flat_file is None:
+            return []
+        return flat_file.lines(entry_id)
+
+    def close(self):
+        for flat_file in self._files.values():
+            if flat_file is not None:
+                flat_file.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def entry_id(entry_line):
+    """
+    The id in the ENTRY line of a KEGG flat file
+    E.C. entries are returned without the 'EC ' prefix
+    E.G.: 'ENTRY       EC 1.1.1.1   Enzyme' = 1.1.1.1, 'ENTRY       C00001   Compound' = C00001
+    :param entry_line:
+    :return:
+    """
+    fields = entry_line[12:].split()
+    if fields[0] == 'EC':
+        return fields[1]
+    return fields[0]
@@ -0,0 +1,177 @@
+import collections
+import re
+
+from network_merging.metanetx import metanetx_metabolite_pattern
+
+inchikey_pattern = re.compile('^(InChIKey=)?([A-Z]{14})-[A-Z]{10}-[A-Z]$')
+
+
+class MetaboliteCanonicalizer:
+    """
+    Maps metabolites from any database to a canonical MetaNetX metabolite id
+    A metabolite is resolved from its identifiers, in order of confidence:
+        - an identifier that is a cross reference in chem_xref, keyed by its database (see metanetx.xref_key and
+          merge.species_xrefs), or a MNXM id in chem_prop
+        - its full InChIKey
+        - the first block (the skeleton, without stereochemistry or charge) of its InChIKey,
+          only if that block belongs to a single MNXM id
+    The MNXM id a metabolite resolves to is then replaced by its canonical metabolite (see canonical_metabolite),
+    so metabolites that chem_prop lists under several MNXM ids are merged
+    The InChIKey indexes are built in one pass over chem_prop when the canonicalizer is created
+    Each distinct set of identifiers is only resolved once, and the outcome of each resolution is counted in counts
+    """
+
+    def __init__(self, metanetx_dict):
+        """
+        :param metanetx_dict: a MetaNetXDict
+        """
+        self._metanetx_dict = metanetx_dict
+        self._inchikeys = {}
+        self._inchikey_blocks = {}
+        self._counts = collections.Counter()
+        for mnxm, inchikey in inchikey_rows(metanetx_dict):
+            match = re.match(inchikey_pattern, inchikey)
+            if match is None:
+                continue
+            key = normalise_inchikey(inchikey)
+            self._inchikeys.setdefault(key, []).append(mnxm)
+            blocks = self._inchikey_blocks.setdefault(match.group(2), [])
+            if mnxm not in blocks:
+                blocks.append(mnxm)
+        self._resolved = {}
+        self._canonical = {}
+
+    @property
+    def counts(self):
+        """
+        The number of metabolites resolved by xref, inchikey and inchikey_block, the number unresolved,
+        and the number of collisions: identifiers resolving to different MNXM ids, or an InChIKey or
+        InChIKey block shared by several MNXM ids
+        :return: a collections.Counter
+        """
+        return self._counts
+
+    @property
+    def inchikeys(self):
+        """
+        Full InChIKey to the MNXM ids with that InChIKey in chem_prop
+        :return:
+        """
+        return self._inchikeys
+
+    @property
+    def inchikey_blocks(self):
+        """
+        InChIKey first block to the MNXM ids with that block in chem_prop
+        :return:
+        """
+        return self._inchikey_blocks
+
+    def canonical_id(self, identifiers):
+        """
+        The canonical MetaNetX id of a metabolite
+        :param identifiers: the metabolite's ids, cross references and InChIKey,
+                            E.G. ('s_water', 'kegg:C00001', 'XLYOFNOQVPJJNP-UHFFFAOYSA-N')
+        :return: a MNXM id in chem_prop, or None
+        """
+        identifiers = tuple(identifiers)
+        if identifiers not in self._resolved:
+            mnxm = self.resolve(identifiers)
+            self._resolved[identifiers] = self.canonical_metabolite(mnxm) if mnxm is not None else None
+        return self._resolved[identifiers]
+
+    def canonical_metabolite(self, mnxm):
+        """
+        The canonical id of a MNXM id: the first MNXM id in chem_prop with the same full InChIKey
+        MNXM ids without an InChIKey, or not in chem_prop, are their own canonical id
+        :param mnxm:
+        :return: a MNXM id
+        """
+        if mnxm not in self._canonical:
+            metabolites = self._metanetx_dict.metabolites
+            inchikey = metabolites[mnxm]['INCHIKEY'] if mnxm in metabolites else ''
+            candidates = self._inchikeys.get(normalise_inchikey(inchikey), []) if inchikey else []
+            self._canonical[mnxm] = candidates[0] if candidates else mnxm
+        return self._canonical[mnxm]
+
+    def resolve(self, identifiers):
+        metabolites = self._metanetx_dict.metabolites
+        metabolites_xref = self._metanetx_dict.metabolites_xref
+        by_xref = None
+        inchikeys = []
+        for identifier in identifiers:
+            if re.match(inchikey_pattern, identifier):
+                inchikeys.append(identifier)
+            elif by_xref is None:
+                if identifier in metabolites_xref:
+                    mnxm = metabolites_xref[identifier]['MNXR']
+                elif re.match(metanetx_metabolite_pattern, identifier):
+                    mnxm = identifier
+                else:
+                    continue
+                if mnxm in metabolites:
+                    by_xref = mnxm
+
+        by_inchikey = None
+        method = None
+        for inchikey in inchikeys:
+            method = 'inchikey'
+            candidates = self._inchikeys.get(normalise_inchikey(inchikey), [])
+            if not candidates:
+                method = 'inchikey_block'
+                candidates = self._inchikey_blocks.get(re.match(inchikey_pattern, inchikey).group(2), [])
+                if len(candidates) > 1:
+                    # A skeleton shared by several metabolites is not enough to pick one
+                    self._counts['collision'] += 1
+                    continue
+            elif len(candidates) > 1:
+                self._counts['collision'] += 1
+            if candidates:
+                by_inchikey = candidates[0]
+                break
+
+        if by_xref is not None:
+            if by_inchikey is not None and by_inchikey != by_xref:
+                self._counts['collision'] += 1
+            self._counts['xref'] += 1
+            return by_xref
+        if by_inchikey is not None:
+            self._counts[method] += 1
+            return by_inchikey
+        self._counts['unresolved'] += 1
+        return None
+
+    def canonicalize(self, metabolites):
+        """
+        Map every metabolite to its canonical id in one pass
+        :param metabolites: an iterable of (key, identifiers) tuples
+        :return: an OrderedDict of key to MNXM id, or None for unresolved metabolites
+        """
+        return collections.OrderedDict((key, self.canonical_id(identifiers)) for key, identifiers in metabolites)
+
+    def report(self):
+        return "%d metabolites resolved by cross reference, %d by InChIKey, %d by InChIKey first block, " \
+               "%d unresolved, %d collisions" % (self.counts['xref'], self.counts['inchikey'],
+                                                 self.counts['inchikey_block'], self.counts['unresolved'],
+                                                 self.counts['collision'])
+
+
+def normalise_inchikey(inchikey):
+    """
+    An InChIKey without the InChIKey= prefix
+    :param inchikey:
+    :return:
+    """
+    return inchikey[len('InChIKey='):] if inchikey.startswith('InChIKey=') else inchikey
+
+
+def inchikey_rows(metanetx_dict):
+    """
+    The InChIKey of every metabolite in chem_prop, queried in one statement from a compiled store
+    :param metanetx_dict: a MetaNetXDict
+    :return: an iterable of (MNXM id, InChIKey) tuples
+    """
+    if metanetx_dict.store is not None:
+        return metanetx_dict.store.connection.execute("SELECT ID, INCHIKEY FROM metabolites WHERE INCHIKEY != ''")
+    metabolites = metanetx_dict.metabolites
+    return ((mnxm, metabolites[mnxm]['INCHIKEY']) for mnxm in metabolites)
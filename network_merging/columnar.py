@@ -0,0 +1,132 @@
+import array
+import collections.abc
+import sys
+
+
+class ColumnarTable(collections.abc.Mapping):
+    """
+    A read only table stored column by column instead of as one dict per row
+    Each column, including the row keys, is a single utf-8 encoded bytes buffer with an array of end offsets,
+    and an index maps each (interned) key to its row number
+    Rows are returned as RowView mappings that decode their values when they are accessed, so
+    table[key]['EQUATION'] works as it does for a dict of dicts
+    """
+
+    def __init__(self, columns, rows):
+        """
+        :param columns: the column names of the rows
+        :param rows: an iterable of (key, row dict) tuples. A repeated key replaces the earlier row
+        """
+        self._columns = tuple(columns)
+        self._column_numbers = dict((c, i) for i, c in enumerate(self._columns))
+        self._keys = Column()
+        self._values = [Column() for c in self._columns]
+        self._index = {}
+        for key, row in rows:
+            self._index[sys.intern(key)] = len(self._keys)
+            self._keys.append(key)
+            for column, values in zip(self._columns, self._values):
+                values.append(row[column])
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def __getitem__(self, key):
+        return RowView(self, self._index[key])
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def key(self, row_number):
+        return self._keys[row_number]
+
+    def value(self, row_number, column):
+        return self._values[self._column_numbers[column]][row_number]
+
+    def rows_by(self, column):
+        """
+        Group the current rows by the value of a column
+        :param column:
+        :return: a dict of column value to an array of row numbers, in table order
+        """
+        groups = {}
+        for row_number in sorted(self._index.values()):
+            value = sys.intern(self.value(row_number, column))
+            if value not in groups:
+                groups[value] = array.array('L')
+            groups[value].append(row_number)
+        return groups
+
+
+class Column:
+    """
+    A column of strings held in one utf-8 encoded buffer, with the end offset of each value in an array
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._ends = array.array('Q')
+
+    def append(self, value):
+        self._data += value.encode('utf-8')
+        self._ends.append(len(self._data))
+
+    def __getitem__(self, i):
+        start = self._ends[i - 1] if i > 0 else 0
+        return self._data[start:self._ends[i]].decode('utf-8')
+
+    def __len__(self):
+        return len(self._ends)
+
+
+class RowView(collections.abc.Mapping):
+    """
+    A lightweight read only view of one row of a ColumnarTable
+    """
+    __slots__ = ('_table', '_row_number')
+
+    def __init__(self, table, row_number):
+        self._table = table
+        self._row_number = row_number
+
+    def __getitem__(self, column):
+        try:
+            return self._table.value(self._row_number, column)
+        except KeyError:
+            raise KeyError(column)
+
+    def __iter__(self):
+        return iter(self._table.columns)
+
+    def __len__(self):
+        return len(self._table.columns)
+
+
+class ColumnarXrefIndex(collections.abc.Mapping):
+    """
+    MNX id to (DB, xref) pairs over a columnar xref table, see metanetx.xref_index
+    Only the row numbers of each MNX id are stored, the pairs are decoded when they are accessed
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._rows = table.rows_by('MNXR')
+
+    def __getitem__(self, key):
+        return [(self._table.value(row_number, 'DB'), self._table.key(row_number)) for row_number in self._rows[key]]
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
@@ -0,0 +1,157 @@
+import array
+import bisect
+import collections
+import heapq
+import re
+
+# Stereo and isomer prefixes that names of the same compound are often written with or without
+stereo_prefix_pattern = re.compile(r"(?<![a-z0-9])(\((?:[0-9]*[rsez],?)+\)|\([+-]\)|[dl]{1,2}|cis|trans|alpha|beta)-")
+punctuation_pattern = re.compile(r"[^a-z0-9]+")
+# Rows admitted from the rarest posting lists of a name before a search stops admitting new rows
+search_candidates = 5000
+
+
+def normalise_name(name):
+    """
+    A name reduced to the parts that matter for matching: lower case, without stereo prefixes or punctuation
+    E.G.: 'L-Glutamate' = 'glutamate', '(S)-2-Hydroxy-acid' = '2 hydroxy acid', 'beta-D-Glucose' = 'glucose'
+    :param name:
+    :return:
+    """
+    name = name.lower()
+    previous = None
+    while previous != name:
+        previous = name
+        name = re.sub(stereo_prefix_pattern, '', name)
+    return re.sub(punctuation_pattern, ' ', name).strip()
+
+
+def trigrams(name):
+    """
+    The trigrams of a normalised name, padded so the start and end of each word are trigrams of their own
+    :param name: a normalised name, see normalise_name
+    :return: a set of strings
+    """
+    padded = ' ' + name + ' '
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex:
+    """
+    A trigram inverted index over names, for fuzzy name search
+    Each trigram maps to an array of the numbers of the rows whose normalised name contains it, so a search only
+    reads the rows that share a trigram with the query instead of comparing it with every name.
+    Candidates are scored by the Dice coefficient of their trigram sets and only the best k are kept.
+    The minimum score bounds the search, see search
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: an iterable of (id, name) tuples, rows with an empty name are skipped
+        """
+        self._ids = []
+        self._names = []
+        self._sizes = array.array('H')
+        self._postings = {}
+        for row_id, name in rows:
+            grams = trigrams(normalise_name(name)) if name else None
+            if not grams:
+                continue
+            row_number = len(self._ids)
+            self._ids.append(row_id)
+            self._names.append(name)
+            self._sizes.append(min(len(grams), 65535))
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array.array('L')
+                postings.append(row_number)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def search(self, name, k=5, min_score=0.5, max_candidates=search_candidates):
+        """
+        The rows whose names are most similar to a name
+        Rows that share none of the rarest trigrams of the name may be missed once max_candidates rows are found,
+        these only share common trigrams and score poorly
+        :param name:
+        :param k: the maximum number of matches returned
+        :param min_score: the minimum Dice coefficient of a match
+        :param max_candidates: the number of rows after which no new rows are admitted to the search
+        :return: a list of (score, id, name) tuples, best first
+        """
+        grams = trigrams(normalise_name(name))
+        if not grams:
+            return []
+        n = len(grams)
+        postings = sorted((self._postings[g] for g in grams if g in self._postings), key=len)
+        # Posting lists are read rarest first. A row first seen in list i shares at most len(postings) - i trigrams
+        # with the name, which bounds its score. Once that bound is below min_score, or below the score the k best
+        # rows already have, or max_candidates rows have been admitted, no new rows are admitted, and the rows that
+        # can still make the top k are only looked up in the remaining, longer, lists
+        shared = collections.Counter()
+        i = 0
+        while i < len(postings):
+            left = len(postings) - i
+            bound = 2.0 * left / (n + left)
+            if bound < min_score or len(shared) >= max_candidates:
+                break
+            if len(shared) >= k and self.kth_score(shared, n, k) >= bound:
+                break
+            shared.update(postings[i])
+            i += 1
+        while i < len(postings):
+            # Drop the rows that can not reach the k-th best score with the lists left
+            floor = max(min_score, self.kth_score(shared, n, k))
+            left = len(postings) - i
+            shared = collections.Counter(dict((r, c) for r, c in shared.items()
+                                              if 2.0 * (c + left) / (n + self._sizes[r]) >= floor))
+            p = postings[i]
+            if len(shared) * 16 < len(p):
+                found = [row_number for row_number in shared if contains(p, row_number)]
+            else:
+                found = shared.keys() & set(p)
+            for row_number in found:
+                shared[row_number] += 1
+            i += 1
+        # Equal scores are kept in index order
+        scored = ((2.0 * count / (n + self._sizes[row_number]), -row_number) for row_number, count in shared.items())
+        return [(round(score, 3), self._ids[-row_number], self._names[-row_number])
+                for score, row_number in heapq.nlargest(k, scored) if score >= min_score]
+
+    def kth_score(self, shared, n, k):
+        """
+        The k-th best score of the rows counted so far, a lower bound of the k-th best final score
+        :param shared: row number to the number of trigrams it shares with the name so far
+        :param n: the number of trigrams of the name
+        :param k:
+        :return:
+        """
+        if len(shared) < k:
+            return 0.0
+        return heapq.nlargest(k, (2.0 * c / (n + self._sizes[r]) for r, c in shared.items()))[-1]
+
+
+def contains(postings, row_number):
+    """
+    Whether a sorted posting list holds a row number, by binary search
+    :param postings:
+    :param row_number:
+    :return:
+    """
+    i = bisect.bisect_left(postings, row_number)
+    return i < len(postings) and postings[i] == row_number
+
+
+def description_rows(metanetx_dict, table):
+    """
+    The DESCRIPTION of every row of reac_prop or chem_prop, queried in one statement from a compiled store
+    :param metanetx_dict: a MetaNetXDict
+    :param table: 'reactions' or 'metabolites'
+    :return: an iterable of (MNX id, description) tuples
+    """
+    if metanetx_dict.store is not None:
+        return metanetx_dict.store.connection.execute("SELECT ID, DESCRIPTION FROM %s WHERE DESCRIPTION != ''" % table)
+    rows = getattr(metanetx_dict, table)
+    return ((i, rows[i]['DESCRIPTION']) for i in rows)
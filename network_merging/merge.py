@@ -1,14 +1,26 @@
+import collections
+import concurrent.futures
 import glob
+import hashlib
+import json
+import logging
 import os
 import re
-
-import requests
+import time
 
 from interfaces import databaseExtraction, enzymeAssignment
-from sbml import sbml
-from tools import notes2dict
+import tools
+from network_merging import canonical, fuzzy, metanetx
+from network_merging.metanetx import MetaNetXDict, metanetx_metabolite_pattern
+from sbml import reader, sbml
 
-metanetx_reaction_pattern = re.compile("(MNXM[0-9]+)")
+metanetx_reaction_pattern = metanetx_metabolite_pattern
+# Species notes holding chemical properties rather than identifiers, not used to resolve species
+species_property_notes = frozenset(['CHARGE', 'FORMULA', 'INCHI', 'SMILES'])
+# Reaction notes that are not cross references, not used as db links of reactions merged by fingerprint
+reaction_property_notes = frozenset(['ENZYME', 'GENE_ASSOCIATION', 'SUBSYSTEM'])
+# Changes when the resolve_reactions results kept in merge caches change form
+merge_cache_format = '6'
 
 
 class NetworkMerger(databaseExtraction.DatabaseExtraction):
@@ -16,9 +28,43 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
     def __init__(self, **kwargs):
         super(NetworkMerger, self).__init__(**kwargs)
         self._path = kwargs['path']
-        self._metanetx_dict = MetaNetXDict()
         self._pathways = {}
+        self._equations = {}
+        self._fingerprint_reactions = collections.OrderedDict()
+        self._canonical_species = collections.OrderedDict()
+        self._canonicalizer = None
+        self._unmapped_reactions = []
+        self._unmapped_species = collections.OrderedDict()
+        # With merge_workers > 1, SBML files are read and resolved in a pool of processes
+        self._merge_workers = kwargs.get('merge_workers') or 1
+        # With sbml_stream, SBML files are read with sbml.reader, one reaction at a time, instead of loaded with libsbml
+        self._sbml_stream = kwargs.get('sbml_stream', False)
+        # The SBML files to merge, or every SBML file in path
+        self._sbml_files = list(kwargs.get('files') or self.find_sbml_files())
+        # With merge_cache, the resolved reactions of each file are kept in a JSON file keyed by the file's content
+        # hash and the MNXref release, and only files that are not in it are read and resolved again
+        self._merge_cache = self.open_merge_cache(kwargs.get('merge_cache'), kwargs.get('mnxref_path'),
+                                                  kwargs.get('mnxref_store'))
+        self._cached = self.load_cached()
+        # With mnxref_lazy, the reactions are read first and only the MNXref rows reachable from their xrefs,
+        # or from the MetaNetX ids of cached files, are loaded. With sbml_stream the reactions are not kept,
+        # the files are streamed once for the xrefs and again when they are merged
+        if kwargs.get('mnxref_lazy'):
+            self._sbml_reactions = self.read_sbml_reactions() if not self._sbml_stream else None
+            reaction_keys, metabolite_keys = self.candidate_keys()
+            for _mnxrids, _no_mnxrids, pathways in self._cached.values():
+                reaction_keys.update(_mnxrids)
+        else:
+            self._sbml_reactions = None
+            reaction_keys = None
+            metabolite_keys = None
+        self._metanetx_dict = MetaNetXDict(mnxref_path=kwargs.get('mnxref_path'), store=kwargs.get('mnxref_store'),
+                                           reaction_keys=reaction_keys, metabolite_keys=metabolite_keys,
+                                           columnar=kwargs.get('mnxref_columnar', False))
         self._merged_reactions = self.merge_reactions()
+        # With fuzzy_report, MetaNetX ids are proposed for the reactions and species left unmapped by name
+        if kwargs.get('fuzzy_report'):
+            self.propose_matches(kwargs['fuzzy_report'], kwargs.get('fuzzy_top') or 3)
         self.get_reactions()
 
     def database_name(self):
@@ -27,21 +73,37 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
     def metabolite_charge(self, **kwargs):
         pass
 
+    def reaction_equation(self, **kwargs):
+        """
+        The parsed MetaNetX equation of a reaction (see tools.parse_equation), memoized per reaction id
+        Its metabolites are canonical MNXM ids (see canonical.MetaboliteCanonicalizer.canonical_metabolite),
+        so a metabolite is the same species in every reaction of the merged model
+        :param kwargs:
+        :return:
+        """
+        reaction_id = kwargs['reaction_id']
+        if reaction_id not in self._equations:
+            equation = tools.parse_equation(self.metanetx_dict.reactions[reaction_id]['EQUATION'],
+                                            metanetx_reaction_pattern)
+            self._equations[reaction_id] = equation._replace(
+                ids=tuple(self.canonicalizer.canonical_metabolite(i) for i in equation.ids))
+        return self._equations[reaction_id]
+
     def reaction_substrates(self, **kwargs):
-        reaction_substrate_ids = re.findall(metanetx_reaction_pattern,
-                                            self.metanetx_dict.reactions[kwargs['reaction_id']]['EQUATION'].split('=')[
-                                                0])
+        equation = self.reaction_equation(**kwargs)
         substrates = {}
-        for substrate_id in reaction_substrate_ids:
-            substrates[substrate_id] = self.extract_metabolite(substrate_id)
+        for substrate_id, side in zip(equation.ids, equation.sides):
+            if side == 0:
+                substrates[substrate_id] = self.extract_metabolite(substrate_id)
 
         return substrates
 
     def reaction_products(self, **kwargs):
-        reaction_product_ids = re.findall(metanetx_reaction_pattern, self.metanetx_dict.reactions[kwargs['reaction_id']]['EQUATION'].split('=')[1])
+        equation = self.reaction_equation(**kwargs)
         products = {}
-        for product_id in reaction_product_ids:
-            products[product_id] = self.extract_metabolite(product_id)
+        for product_id, side in zip(equation.ids, equation.sides):
+            if side == 1:
+                products[product_id] = self.extract_metabolite(product_id)
 
         return products
 
@@ -83,18 +145,16 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
 
     def reaction_dblinks(self, **kwargs):
         db_links = {}
-        for reaction_xref in self.metanetx_dict.reactions_xref:
-            if self.metanetx_dict.reactions_xref[reaction_xref]['MNXR'] == kwargs['reaction_id']:
-                db = self.metanetx_dict.reactions_xref[reaction_xref]['DB'].split(':')[0].upper()
-                db_links[db] = reaction_xref
+        for db, reaction_xref in self.metanetx_dict.reaction_xref_index.get(kwargs['reaction_id'], []):
+            database, xref = metanetx.db_link(db)
+            db_links[database] = xref
         return db_links
 
     def metabolite_dblinks(self, **kwargs):
         db_links = {}
-        for metabolite_xref in self.metanetx_dict.metabolites_xref:
-            if self.metanetx_dict.metabolites_xref[metabolite_xref]['MNXR'] == kwargs['metabolite_id']:
-                db = self.metanetx_dict.metabolites_xref[metabolite_xref]['DB'].split(':')[0].upper()
-                db_links[db] = metabolite_xref
+        for db, metabolite_xref in self.metanetx_dict.metabolite_xref_index.get(kwargs['metabolite_id'], []):
+            database, xref = metanetx.db_link(db)
+            db_links[database] = xref
         return db_links
 
     def metabolite_inchi(self, **kwargs):
@@ -104,22 +164,8 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
         pass
 
     def reaction_stoichiometry(self, **kwargs):
-        stoichiometry = {}
-        equation = self.metanetx_dict.reactions[kwargs['reaction_id']]['EQUATION'].replace(" ", "")
-        for substrate in kwargs['substrates']:
-            index = equation.index(substrate)
-            if equation[index - 1].isdigit():
-                stoichiometry[substrate] = int(equation[index - 1])
-            else:
-                stoichiometry[substrate] = 1
-
-        for product in kwargs['products']:
-            index = equation.index(product)
-            if equation[index - 1].isdigit():
-                stoichiometry[product] = int(equation[index - 1])
-            else:
-                stoichiometry[product] = 1
-        return stoichiometry
+        equation = self.reaction_equation(**kwargs)
+        return dict(zip(equation.ids, equation.coefficients))
 
     def reaction_pathways(self, **kwargs):
         pass
@@ -137,17 +183,14 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
             enzymes = []
             for ec_number in self.metanetx_dict.reactions[reaction_id]['EC'].split(';'):
                 try:
-                    assert re.match(enzymeAssignment.ec_pattern, ec_number)
+                    assert re.fullmatch(enzymeAssignment.ec_pattern, ec_number)
                     enzymes.append(ec_number)
                 except AssertionError:
                     pass
 
             genes = []
             for ec_number in enzymes:
-                try:
-                    genes.extend(self.enzymes[ec_number])
-                except KeyError:
-                    pass
+                genes.extend(self.enzymes.genes(ec_number))
 
             print(enzymes)
 
@@ -157,6 +200,43 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
                                                 db_links, stoichiometry, pathways)
             self.reactions[reaction_id] = r
 
+        for fingerprint, members in self.fingerprint_reactions.items():
+            self.add_fingerprint_reaction(fingerprint, members)
+
+    def add_fingerprint_reaction(self, fingerprint, members):
+        """
+        Add one reaction for a group of reactions without a MetaNetX id that share a fingerprint
+        Its metabolites and stoichiometry are those of the fingerprint, and its enzymes, pathways and
+        db links are gathered from the notes of every member
+        :param fingerprint: see reaction_fingerprint
+        :param members: a list of (file, reaction id, notes dict, canonical participants) tuples
+        :return:
+        """
+        reaction_id = 'FP_' + fingerprint[:16]
+        print("Adding reaction %s, merged from %s" % (reaction_id, ', '.join(m[1] for m in members)))
+        participants = members[0][3]
+        substrates = dict((m, self.extract_metabolite(m)) for m, c, side in participants if side == 0)
+        products = dict((m, self.extract_metabolite(m)) for m, c, side in participants if side == 1)
+        stoichiometry = dict((m, c) for m, c, side in participants)
+        enzymes = []
+        pathways = []
+        db_links = {}
+        for file, member_id, notes, _participants in members:
+            for ec_number in notes.get('ENZYME', '').split(', '):
+                if re.fullmatch(enzymeAssignment.ec_pattern, ec_number) and ec_number not in enzymes:
+                    enzymes.append(ec_number)
+            if 'SUBSYSTEM' in notes:
+                pathways.extend(notes['SUBSYSTEM'].split(' || '))
+            for key, value in notes.items():
+                if key not in reaction_property_notes:
+                    db_links.setdefault(key.upper(), value)
+        genes = []
+        for ec_number in enzymes:
+            genes.extend(self.enzymes.genes(ec_number))
+        self.reactions[reaction_id] = databaseExtraction.ReactionDict(
+            reaction_id, [m[1] for m in members], substrates, products, True, enzymes, genes, db_links,
+            stoichiometry, pathways)
+
     @property
     def path(self):
         return self._path
@@ -173,135 +253,483 @@ class NetworkMerger(databaseExtraction.DatabaseExtraction):
     def pathways(self):
         return self._pathways
 
-    def merge_reactions(self):
-        mnxrids = []
-        no_mnxrids = []
-
-        os.chdir(self.path)
-        for file in [f for f_ in [glob.glob(e) for e in ('*.xml', '*.sbml')] for f in f_]:
-            sbml_file = sbml.load_sbml(file)
-            _mnxrids = []
-            _no_mnxrids = []
-            for reaction in sbml_file.getModel().getListOfReactions():
-                reaction_notes = notes2dict(reaction.getNotesString())
-                del reaction_notes['ENZYME']
-                try:
-                    del reaction_notes['GENE_ASSOCIATION']
-                except:
-                    print()
-                added = False
-                for key in reaction_notes.keys():
-                    if reaction_notes[key] in self.metanetx_dict.reactions_xref:
-                        mnxid = self.metanetx_dict.reactions_xref[reaction_notes[key]]['MNXR']
-                        try:
-                            if mnxid not in self.pathways:
-                                self.pathways[mnxid] = reaction_notes['SUBSYSTEM'].split(' || ')
-                            else:
-                                self.pathways[mnxid].extend(reaction_notes['SUBSYSTEM'].split(' || '))
-                            _mnxrids.append(mnxid)
-                            added = True
-                            break
-                        except KeyError:
-                            pass
-                try:
-                    if reaction.getId() in self.metanetx_dict.reactions_xref:
-                        mnxid = self.metanetx_dict.reactions_xref[reaction_notes[key]]['MNXR']
-                        try:
-                            if mnxid not in self.pathways:
-                                self.pathways[mnxid] = reaction_notes['SUBSYSTEM'].split(' || ')
-                            else:
-                                self.pathways[mnxid].extend(reaction_notes['SUBSYSTEM'].split(' || '))
-                            _mnxrids.append(self.metanetx_dict.reactions_xref[reaction.getId()]['MNXR'])
-                            added = True
-                        except KeyError:
-                            pass
-                except KeyError:
-                    pass
-
-                if not added:
-                    _no_mnxrids.append(file + ': ' + reaction.getId())
-
-            _mnxrids = set(_mnxrids)
-            print(file + ":\n\t%d unique reaction MetaNetX ids\n\t%d reactions with no MetaNetX id" % (
-                len(_mnxrids), len(_no_mnxrids)))
-            mnxrids.extend(_mnxrids)
-            no_mnxrids.extend(_no_mnxrids)
-
-        return set(mnxrids)
-
-
-reac_xref_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/reac_xref.tsv'
-reac_prop_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/reac_prop.tsv'
-chem_xref_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/chem_xref.tsv'
-chem_prop_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/chem_prop.tsv'
-
+    @property
+    def fingerprint_reactions(self):
+        """
+        Reactions without a MetaNetX id grouped by fingerprint, see merge_unmapped
+        :return:
+        """
+        return self._fingerprint_reactions
 
-class MetaNetXDict:
-    def __init__(self):
-        self.store = dict()
-        self._reactions_xref = self.load_xref(reac_xref_url)
-        self._reactions = self.load_reactions(reac_prop_url)
-        self._metabolites_xref = self.load_xref(chem_xref_url)
-        self._metabolites = self.load_metabolites(chem_prop_url)
+    @property
+    def canonicalizer(self):
+        """
+        The canonical.MetaboliteCanonicalizer every species of the merged model is mapped with,
+        built the first time it is used
+        :return:
+        """
+        if self._canonicalizer is None:
+            self._canonicalizer = canonical.MetaboliteCanonicalizer(self.metanetx_dict)
+        return self._canonicalizer
 
     @property
-    def reactions_xref(self):
-        return self._reactions_xref
+    def canonical_species(self):
+        """
+        (file, species id) to the MNXM id of the species of every reaction without a MetaNetX id,
+        or None if it could not be resolved, see merge_unmapped
+        :return:
+        """
+        return self._canonical_species
 
     @property
-    def reactions(self):
-        return self._reactions
+    def sbml_files(self):
+        return self._sbml_files
 
     @property
-    def metabolites_xref(self):
-        return self._metabolites_xref
+    def sbml_reactions(self):
+        return self._sbml_reactions
 
     @property
-    def metabolites(self):
-        return self._metabolites
+    def stale_files(self):
+        """
+        The SBML files whose reactions are not in the merge cache
+        :return:
+        """
+        return [file for file in self.sbml_files if file not in self._cached]
+
+    def find_sbml_files(self):
+        """
+        The SBML files in path, plain or gzip compressed
+        :return: a list of file paths
+        """
+        return [f for e in sbml.sbml_extensions for f in sorted(glob.glob(os.path.join(self.path, '*' + e)))]
 
     @staticmethod
-    def load_xref(url):
-        print('Loading XRefs from %s' % url)
-        response = requests.get(url)
-        xref = {}
-        try:
-            for line in response.text.split('\n'):
-                if not line[0] == '#' and 'deprecated' not in line and ':' in line:
-                    line = line.split('\t')
-                    xref[line[0].split(':')[1]] = {'MNXR': line[1], 'DB': line[0]}
-        except IndexError:
-            pass
-        return xref
+    def open_merge_cache(path, mnxref_path, store):
+        """
+        Open the merge cache for the MNXref release the merge is resolved against
+        Without a release key (see metanetx.release_key) cached results could outlive a MNXref release,
+        so the merge cache is not used for that run
+        :param path: the merge cache file, or None to merge without a cache
+        :param mnxref_path:
+        :param store:
+        :return: a MergeCache, or None
+        """
+        if path is None:
+            return None
+        release = metanetx.release_key(mnxref_path, store)
+        if release is None:
+            logging.warning("The MNXref release of the tables streamed from MetaNetX could not be read from their "
+                            "header, merge cache %s not used" % path)
+            return None
+        return MergeCache(path, release)
+
+    def load_cached(self):
+        """
+        Look up the SBML files in the merge cache
+        :return: a dict of file path to its cached resolve_reactions result
+        """
+        if self._merge_cache is None:
+            return {}
+        cached = {}
+        for file in self.sbml_files:
+            result = self._merge_cache.get(file)
+            if result is not None:
+                cached[file] = result
+        print('%d of %d SBML files found in merge cache %s' % (len(cached), len(self.sbml_files),
+                                                                self._merge_cache.path))
+        return cached
+
+    def read_sbml_reactions(self):
+        """
+        Read the reactions of the SBML files that are not in the merge cache
+        :return: an OrderedDict of file path to a list of reactions, see read_sbml_reactions
+        """
+        files = self.stale_files
+        if self._merge_workers > 1 and len(files) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self._merge_workers) as executor:
+                return collections.OrderedDict(zip(files, executor.map(read_sbml_reactions, files)))
+        return collections.OrderedDict((file, read_sbml_reactions(file)) for file in files)
+
+    def candidate_keys(self):
+        """
+        Every key that merge_reactions may look up in reactions_xref, see reaction_xrefs,
+        and every value that merge_unmapped may look up in metabolites_xref: the xrefs of the reaction participants,
+        in the SBML files and in the unresolved reactions of cached files
+        :return: a set of reaction xrefs and a set of species xrefs
+        """
+        xrefs = set()
+        species_xrefs = set()
+        if self.sbml_reactions is not None:
+            file_reactions = self.sbml_reactions.values()
+        else:
+            file_reactions = (read_sbml_reactions(file, stream=True) for file in self.stale_files)
+        for reactions in file_reactions:
+            for reaction_id, reaction_notes, participants, name in reactions:
+                for keys in reaction_xrefs(reaction_id, reaction_notes):
+                    xrefs.update(keys)
+                for participant_xrefs, coefficient, side, species_name in participants:
+                    species_xrefs.update(participant_xrefs)
+        for _mnxrids, _no_mnxrids, pathways in self._cached.values():
+            for reaction_id, reaction_notes, participants, name in _no_mnxrids:
+                for participant_xrefs, coefficient, side, species_name in participants:
+                    species_xrefs.update(participant_xrefs)
+        return xrefs, species_xrefs
 
-    @staticmethod
-    def load_reactions(url):
-        print('Loading Reactions from %s' % url)
-        response = requests.get(url)
-        reactions = {}
-        try:
-            for line in response.text.split('\n'):
-                if not line[0] == '#':
-                    line = line.split('\t')
-                    reactions[line[0]] = {'EQUATION': line[1], 'DESCRIPTION': line[2], 'BALANCE': line[3],
-                                          'EC': line[4],
-                                          'SOURCE': line[5]}
-        except IndexError:
-            pass
-        return reactions
+    def merge_reactions(self):
+        """
+        Resolve the reactions of every SBML file to MetaNetX reaction ids (see resolve_reactions)
+        Files found in the merge cache are not read again, only the stale files are resolved.
+        With merge_workers > 1 the files are mapped to a pool of processes. The reactions_xref table is sent to
+        each worker once when it starts (a compiled store is reopened by path instead), not with every file.
+        The results are reduced in file order, so the merge does not depend on which worker finishes first
+        :return: the set of MetaNetX reaction ids
+        """
+        files = self.stale_files
+        reactions = [self.sbml_reactions[file] if self.sbml_reactions is not None else None for file in files]
+        if self._merge_workers > 1 and len(files) > 1:
+            store = self.metanetx_dict.store
+            initargs = (None, store.path) if store is not None else (self.metanetx_dict.reactions_xref, None)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self._merge_workers, initializer=init_worker,
+                                                        initargs=initargs) as executor:
+                results = dict(zip(files, executor.map(merge_file, files, reactions,
+                                                       [self._sbml_stream] * len(files))))
+        else:
+            results = dict((file, resolve_reactions(
+                r if r is not None else read_sbml_reactions(file, self._sbml_stream), self.metanetx_dict.reactions_xref))
+                for file, r in zip(files, reactions))
+        results.update(self._cached)
+        if self._merge_cache is not None:
+            self._merge_cache.save((file, results[file]) for file in self.sbml_files)
 
-    @staticmethod
-    def load_metabolites(url):
-        print('Loading Metabolites from %s' % url)
-        response = requests.get(url)
-        metabolites = {}
+        mnxrids = []
+        no_mnxrids = []
+        for file in self.sbml_files:
+            _mnxrids, _no_mnxrids, pathways = results[file]
+            for mnxid, pathway in pathways.items():
+                self.pathways.setdefault(mnxid, []).extend(pathway)
+            _mnxrids = set(_mnxrids)
+            print(file + ":\n\t%d unique reaction MetaNetX ids\n\t%d reactions with no MetaNetX id%s" % (
+                len(_mnxrids), len(_no_mnxrids), " (cached)" if file in self._cached else ""))
+            mnxrids.extend(_mnxrids)
+            no_mnxrids.extend((file,) + tuple(reaction) for reaction in _no_mnxrids)
+
+        self.merge_unmapped(no_mnxrids)
+        return set(mnxrids)
+
+    def merge_unmapped(self, no_mnxrids):
+        """
+        Group the reactions without a MetaNetX id by their fingerprint (see reaction_fingerprint), computed once
+        per reaction, so the same reaction from several models is merged by one pass over the reactions instead
+        of comparing them pairwise
+        The species of these reactions are first mapped to MetaNetX metabolites in one pass with a
+        canonical.MetaboliteCanonicalizer, through their ids, cross reference notes and InChIKeys.
+        Reactions with a species that can not be resolved, or without reactants or products,
+        have no fingerprint and are left out
+        :param no_mnxrids: a list of (file, reaction id, notes dict, participants, name) tuples
+        :return:
+        """
+        canonicalizer = self.canonicalizer
+        self._canonical_species = canonicalizer.canonicalize(
+            ((file, species_xrefs[0]), species_xrefs) for file, reaction_id, notes, participants, name in no_mnxrids
+            for species_xrefs, coefficient, side, species_name in participants)
+        print("Species of reactions with no MetaNetX id: " + canonicalizer.report())
+
+        for file, reaction_id, notes, participants, name in no_mnxrids:
+            resolved = []
+            for species_xrefs, coefficient, side, species_name in participants:
+                mnxm = self.canonical_species[(file, species_xrefs[0])]
+                if mnxm is None:
+                    self._unmapped_species[(file, species_xrefs[0])] = species_name
+                resolved.append((mnxm, coefficient, side))
+            if any(mnxm is None for mnxm, coefficient, side in resolved) or \
+                    not set(side for mnxm, coefficient, side in resolved) == {0, 1}:
+                self._unmapped_reactions.append((file, reaction_id, name))
+                continue
+            fingerprint, canonical_participants = reaction_fingerprint(resolved)
+            self.fingerprint_reactions.setdefault(fingerprint, []).append(
+                (file, reaction_id, notes, canonical_participants))
+        merged = sum(len(members) for members in self.fingerprint_reactions.values())
+        print("%d reactions with no MetaNetX id:\n\t%d merged into %d reactions by fingerprint\n\t"
+              "%d left unmapped" % (
+                  len(no_mnxrids), merged, len(self.fingerprint_reactions), len(self._unmapped_reactions)))
+
+    def propose_matches(self, path, k):
+        """
+        Propose MetaNetX ids for the reactions and species left unmapped, by matching their names to the MNXref
+        DESCRIPTION fields through a fuzzy.TrigramIndex, and write them to a tab separated report
+        Only proposals are made, the merge itself is not changed
+        :param path: the report file
+        :param k: the number of proposals per unmapped item
+        :return: the number of unmapped items with at least one proposal
+        """
+        start = time.time()
+        items = [('reaction', 'reactions', file, reaction_id, name)
+                 for file, reaction_id, name in self._unmapped_reactions]
+        items.extend(('metabolite', 'metabolites', file, species_id, name)
+                     for (file, species_id), name in self._unmapped_species.items())
+        indexes = {}
+        proposed = 0
+        with open(path, 'w') as report:
+            report.write('#TYPE\tFILE\tID\tNAME\tMNX ID\tDESCRIPTION\tSCORE\n')
+            for kind, table, file, item_id, name in items:
+                if table not in indexes:
+                    indexes[table] = fuzzy.TrigramIndex(fuzzy.description_rows(self.metanetx_dict, table))
+                matches = indexes[table].search(name or item_id, k=k)
+                for score, mnx_id, description in matches:
+                    report.write('\t'.join((kind, file, item_id, name, mnx_id, description, str(score))) + '\n')
+                proposed += bool(matches)
+        print("Proposed MetaNetX ids for %d of %d unmapped reactions and species in %.1f seconds, written to %s" % (
+            proposed, len(items), time.time() - start, path))
+        return proposed
+
+
+class MergeCache:
+    """
+    A JSON file holding the resolve_reactions result of each merged SBML file, so unchanged files are not read
+    and resolved again. Entries are keyed by the sha256 of the file content and the MNXref release they were
+    resolved against (see metanetx.release_key), so a changed file or a different release is a miss
+    """
+
+    def __init__(self, path, release):
+        """
+        :param path: the cache file, created when it is first saved
+        :param release: the MNXref release key
+        """
+        self._path = path
+        self._release = release
+        self._digests = {}
         try:
-            for line in response.text.split('\n'):
-                if not line[0] == '#':
-                    line = line.split('\t')
-                    metabolites[line[0]] = {'DESCRIPTION': line[1], 'FORMULA': line[2], 'CHARGE': line[3],
-                                            'MASS': line[4],
-                                            'INCHI': line[5], 'SMILES': line[6], 'SOURCE': line[7], 'INCHIKEY': line[8]}
-        except IndexError:
-            pass
-        return metabolites
+            with open(path) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except ValueError:
+            logging.warning("Ignoring unreadable merge cache %s" % path)
+            self._entries = {}
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def release(self):
+        return self._release
+
+    def key(self, file):
+        if file not in self._digests:
+            self._digests[file] = file_digest(file)
+        return ':'.join((self._digests[file], merge_cache_format, self.release))
+
+    def get(self, file):
+        """
+        :param file:
+        :return: the cached resolve_reactions result of a file, or None
+        """
+        entry = self._entries.get(self.key(file))
+        if entry is None:
+            return None
+        return entry['mnxrids'], entry['no_mnxrids'], collections.OrderedDict(entry['pathways'])
+
+    def save(self, results):
+        """
+        Replace the cache file with the results of the files of this merge
+        Entries of files that are no longer merged are dropped
+        :param results: an iterable of (file, resolve_reactions result) tuples
+        :return:
+        """
+        self._entries = {}
+        for file, (_mnxrids, _no_mnxrids, pathways) in results:
+            self._entries[self.key(file)] = {'file': file, 'mnxrids': list(_mnxrids),
+                                             'no_mnxrids': list(_no_mnxrids), 'pathways': list(pathways.items())}
+        with open(self.path + '.part', 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(self.path + '.part', self.path)
+
+
+def file_digest(file, chunk_size=1024 * 1024):
+    """
+    The sha256 hex digest of a file's content
+    :param file:
+    :param chunk_size: bytes read at a time
+    :return:
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_sbml_reactions(file, stream=False):
+    """
+    Read the id, notes, participants and name of every reaction in a SBML file
+    :param file:
+    :param stream: stream the reactions with sbml.reader instead of loading the file with libsbml,
+                   see stream_sbml_reactions
+    :return: a list of (reaction id, notes dict, participants, name) tuples, or a generator of them with stream.
+             Participants are (species xrefs, stoichiometry, side, species name) tuples, side is 0 for reactants
+             and 1 for products, see species_xrefs
+    """
+    if stream:
+        return stream_sbml_reactions(file)
+    model = sbml.load_sbml(file).getModel()
+    notes = sbml.notes_index(model)
+    species = dict((s.getId(), (species_xrefs(s.getId(), notes[s.getId()]), s.getName()))
+                   for s in model.getListOfSpecies())
+    return [(reaction.getId(), notes[reaction.getId()], reaction_participants(reaction, species), reaction.getName())
+            for reaction in model.getListOfReactions()]
+
+
+def stream_sbml_reactions(file):
+    """
+    read_sbml_reactions with sbml.reader. Only the xrefs and names of the species are kept while the file is read,
+    reactions are yielded one at a time
+    :param file:
+    :return: a generator of (reaction id, notes dict, participants, name) tuples
+    """
+    species = {}
+    for element in reader.iter_model(file):
+        if element.getElementName() == 'species':
+            species[element.getId()] = (species_xrefs(element.getId(), element.notes), element.getName())
+        else:
+            yield element.getId(), element.notes, reaction_participants(element, species), element.getName()
+
+
+def reaction_participants(reaction, species):
+    """
+    The participants of a reaction, see read_sbml_reactions
+    :param reaction: a libsbml Reaction, or a sbml.reader.Reaction
+    :param species: species id to a (species xrefs, species name) tuple
+    :return: a list of (species xrefs, stoichiometry, side, species name) tuples
+    """
+    participants = []
+    for side, refs in enumerate((reaction.getListOfReactants(), reaction.getListOfProducts())):
+        for ref in refs:
+            xrefs, name = species.get(ref.getSpecies(), ((ref.getSpecies(),), ''))
+            participants.append((xrefs, ref.getStoichiometry(), side, name))
+    return participants
+
+
+def species_xrefs(species_id, notes):
+    """
+    The values a species can be resolved to a MetaNetX metabolite with: its id, its cross reference notes
+    in the database of their key (see metanetx.xref_key) and its InChIKey, see canonical.MetaboliteCanonicalizer
+    E.G.: ('s_water', {'KEGG': 'C00001', 'INCHI KEY': 'XLYOFNOQVPJJNP-UHFFFAOYSA-N'}) =
+          ('s_water', 'kegg:C00001', 'XLYOFNOQVPJJNP-UHFFFAOYSA-N')
+    :param species_id:
+    :param notes: the species' notes, see sbml.notes_index
+    :return: a tuple of xrefs
+    """
+    return (species_id,) + tuple(value if re.match(canonical.inchikey_pattern, value) else
+                                 metanetx.xref_key(key, value)
+                                 for key, value in notes.items() if key not in species_property_notes)
+
+
+def reaction_xrefs(reaction_id, notes):
+    """
+    The reactions_xref keys a reaction is resolved with (see metanetx.xref_key): the value of each cross
+    reference note in the database of its key, and the reaction id in the databases of those notes
+    E.G.: ('R00001', {'KEGG': 'R00001', 'RHEA': '10000'}) = (('kegg:R00001', 'rhea:10000'),
+                                                           ('kegg:R00001', 'rhea:R00001'))
+    :param reaction_id:
+    :param notes: the reaction's notes, see sbml.notes_index
+    :return: a tuple of note keys and a tuple of reaction id keys
+    """
+    databases = [key for key in notes if key not in reaction_property_notes]
+    return (tuple(metanetx.xref_key(key, notes[key]) for key in databases),
+            tuple(metanetx.xref_key(key, reaction_id) for key in databases))
+
+
+def reaction_fingerprint(participants):
+    """
+    A canonical fingerprint of a reaction's chemistry
+    The coefficients of each metabolite are summed per side, each side is sorted by metabolite id, and the sides
+    are put in a fixed order (the smaller side first), so the same reaction written in either direction, in any
+    participant order or with repeated participants has the same fingerprint
+    E.G.: [('MNXM3', 1, 0), ('MNXM1', 1, 1)] and [('MNXM1', 1, 0), ('MNXM3', 1, 1)] both give 1 MNXM1 = 1 MNXM3
+    :param participants: a list of (MNXM id, stoichiometry, side) tuples
+    :return: the sha1 hex digest of the canonical equation, and the canonical participants
+    """
+    sides = ({}, {})
+    for mnxm, coefficient, side in participants:
+        sides[side][mnxm] = sides[side].get(mnxm, 0) + coefficient
+    sides = [tuple(sorted(side.items())) for side in sides]
+    if sides[1] < sides[0]:
+        sides.reverse()
+    equation = ' = '.join(' + '.join('%g %s' % (coefficient, mnxm) for mnxm, coefficient in side) for side in sides)
+    canonical = [(mnxm, coefficient, side) for side, items in enumerate(sides) for mnxm, coefficient in items]
+    return hashlib.sha1(equation.encode('utf-8')).hexdigest(), canonical
+
+
+def resolve_reactions(reactions, reactions_xref):
+    """
+    Resolve the reactions of one SBML file to MetaNetX reaction ids through their notes values and ids
+    :param reactions: a list of (reaction id, notes dict, participants, name) tuples, see read_sbml_reactions
+    :param reactions_xref: MetaNetXDict.reactions_xref
+    :return: the resolved MetaNetX ids, the (reaction id, notes dict, participants, name) tuples of the reactions
+             that could not be resolved, and an OrderedDict of MetaNetX id to the pathways of the reactions
+             resolved to it
+    """
+    _mnxrids = []
+    _no_mnxrids = []
+    pathways = collections.OrderedDict()
+    for reaction_id, notes, participants, name in reactions:
+        note_keys, id_keys = reaction_xrefs(reaction_id, notes)
+        added = False
+        for key in note_keys:
+            if key in reactions_xref:
+                mnxid = reactions_xref[key]['MNXR']
+                try:
+                    pathways.setdefault(mnxid, []).extend(notes['SUBSYSTEM'].split(' || '))
+                    _mnxrids.append(mnxid)
+                    added = True
+                    break
+                except KeyError:
+                    pass
+        for key in id_keys:
+            if key in reactions_xref:
+                mnxid = reactions_xref[key]['MNXR']
+                try:
+                    pathways.setdefault(mnxid, []).extend(notes['SUBSYSTEM'].split(' || '))
+                    _mnxrids.append(mnxid)
+                    added = True
+                except KeyError:
+                    pass
+                break
+
+        if not added:
+            _no_mnxrids.append((reaction_id, notes, participants, name))
+
+    return _mnxrids, _no_mnxrids, pathways
+
+
+# reactions_xref of a merge worker process, set once by init_worker when the process starts
+_worker_reactions_xref = None
+
+
+def init_worker(reactions_xref, store_path):
+    """
+    Initialise a merge worker process with the reactions_xref table, or the path of a compiled MNXref store
+    :param reactions_xref:
+    :param store_path:
+    :return:
+    """
+    global _worker_reactions_xref
+    if store_path is not None:
+        _worker_reactions_xref = metanetx.MNXrefStore(store_path).reactions_xref
+    else:
+        _worker_reactions_xref = reactions_xref
+
+
+def merge_file(file, reactions=None, stream=False):
+    """
+    Resolve the reactions of one SBML file in a merge worker process, reading the file if reactions is None
+    :param file:
+    :param reactions:
+    :param stream: see read_sbml_reactions
+    :return: see resolve_reactions
+    """
+    if reactions is None:
+        reactions = read_sbml_reactions(file, stream)
+    return resolve_reactions(reactions, _worker_reactions_xref)
@@ -0,0 +1,601 @@
+import collections.abc
+import gzip
+import os
+import re
+import sqlite3
+import time
+
+import tools
+import transport
+from interfaces import enzymeAssignment
+from network_merging import columnar
+
+reac_xref_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/reac_xref.tsv'
+reac_prop_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/reac_prop.tsv'
+chem_xref_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/chem_xref.tsv'
+chem_prop_url = 'https://www.metanetx.org/cgi-bin/mnxget/mnxref/chem_prop.tsv'
+mnxref_urls = {'reac_xref': reac_xref_url, 'reac_prop': reac_prop_url,
+               'chem_xref': chem_xref_url, 'chem_prop': chem_prop_url}
+metanetx_metabolite_pattern = re.compile("(MNXM[0-9]+)")
+# The release named in the header comment of a MNXref table, E.G.: '### MNXref Version 4.4 ###'
+mnxref_version_pattern = re.compile(r'MNXref\s+Version\s+([\w.]+)', re.I)
+# MNXref database prefixes and SBML notes keys that name the same database under another name
+xref_database_aliases = {'biocyc': 'metacyc', 'metacycm': 'metacyc', 'metacycr': 'metacyc',
+                         'keggc': 'kegg', 'keggd': 'kegg', 'keggg': 'kegg', 'keggr': 'kegg',
+                         'biggm': 'bigg', 'biggr': 'bigg', 'seedm': 'seed', 'seedr': 'seed',
+                         'sabiorkm': 'sabiork', 'sabiorkr': 'sabiork', 'rhear': 'rhea',
+                         'envipathm': 'envipath', 'envipathr': 'envipath', 'reactomem': 'reactome',
+                         'reactomer': 'reactome', 'lipidm': 'lipidmaps', 'slm': 'swisslipids'}
+# Changes when the keys or rows of compiled MNXref stores change form
+store_format = '2'
+
+
+class MetaNetXDict:
+    """
+    The MNXref tables, parsed line by line into dicts as they are read
+    With mnxref_path, tables are read from <mnxref_path>/<table>.tsv or <table>.tsv.gz,
+    and a table that is not there is first downloaded to <mnxref_path>/<table>.tsv (resuming interrupted downloads)
+    Without it, tables are streamed straight from the MetaNetX website
+    With store, an MNXrefStore, the tables are queried from its SQLite database instead of being loaded
+    reac_xref and chem_xref are keyed by database and xref (see xref_key), so an xref is only ever matched
+    within its own database
+    reaction_xref_index and metabolite_xref_index map each MNX id back to its (DB, xref) pairs,
+    and ec_index maps each E.C. number to the MNXR ids of the reactions that list it
+    With reaction_keys, only the rows needed to resolve those reaction xrefs, and metabolite_keys, are kept
+    (see load_filtered)
+    With columnar, loaded tables are held as columnar.ColumnarTable instead of a dict per row
+    """
+
+    def __init__(self, mnxref_path=None, store=None, reaction_keys=None, metabolite_keys=None, columnar=False):
+        self._mnxref_path = mnxref_path
+        self._columnar = columnar
+        if store is not None:
+            print('Using MNXref release %s from %s' % (store.release, store.path))
+            self.store = store
+            self._reactions_xref = store.reactions_xref
+            self._reactions = store.reactions
+            self._metabolites_xref = store.metabolites_xref
+            self._metabolites = store.metabolites
+            self._reaction_xref_index = store.reaction_xref_index
+            self._metabolite_xref_index = store.metabolite_xref_index
+        elif reaction_keys is not None:
+            self.store = None
+            self.load_filtered(reaction_keys, metabolite_keys or ())
+        else:
+            self.store = None
+            self._reactions_xref = self.table(xref_rows(self.table_lines('reac_xref')), xref_columns)
+            self._reactions = self.table(reaction_rows(self.table_lines('reac_prop')), reaction_columns)
+            self._metabolites_xref = self.table(xref_rows(self.table_lines('chem_xref')), xref_columns)
+            self._metabolites = self.table(metabolite_rows(self.table_lines('chem_prop')), metabolite_columns)
+        if store is None:
+            self._reaction_xref_index = self.xref_index(self._reactions_xref)
+            self._metabolite_xref_index = self.xref_index(self._metabolites_xref)
+            self._ec_index = ec_index((i, self._reactions[i]['EC']) for i in self._reactions)
+
+    @property
+    def reactions_xref(self):
+        return self._reactions_xref
+
+    @property
+    def reactions(self):
+        return self._reactions
+
+    @property
+    def metabolites_xref(self):
+        return self._metabolites_xref
+
+    @property
+    def metabolites(self):
+        return self._metabolites
+
+    @property
+    def reaction_xref_index(self):
+        """
+        MNXR id to the list of (DB, xref) pairs that map to it in reactions_xref
+        :return:
+        """
+        return self._reaction_xref_index
+
+    @property
+    def metabolite_xref_index(self):
+        """
+        MNXM id to the list of (DB, xref) pairs that map to it in metabolites_xref
+        :return:
+        """
+        return self._metabolite_xref_index
+
+    @property
+    def ec_index(self):
+        """
+        E.C. number to the MNXR ids with that E.C. number in reactions, see ec_index
+        :return:
+        """
+        if self.store is not None:
+            return self.store.ec_index
+        return self._ec_index
+
+    def table_lines(self, table):
+        """
+        The lines of a MNXref table
+        :param table: reac_xref, reac_prop, chem_xref or chem_prop
+        :return: a generator of lines
+        """
+        source = mnxref_source(table, self._mnxref_path)
+        print('Loading %s from %s' % (table, source))
+        return tsv_lines(source)
+
+    def load_filtered(self, reaction_keys, metabolite_keys=()):
+        """
+        Load only the MNXref rows reachable from a set of reaction xrefs, streaming each table once more:
+        reac_xref is read once to find the MNXR ids of the xrefs and again to keep every xref of those MNXR ids,
+        reac_prop is filtered to those MNXR ids, and chem_prop and chem_xref to the MNXM ids in their equations
+        The MNXM ids of the metabolite xrefs in metabolite_keys are kept too, with every xref of theirs: chem_xref
+        is then read once more to find them
+        :param reaction_keys: the reaction xrefs that will be looked up, and MNXR ids that are needed directly
+        :param metabolite_keys: metabolite xrefs that will be looked up
+        :return:
+        """
+        mnxrs = set(row['MNXR'] for xref, row in xref_rows(self.table_lines('reac_xref'))
+                    if xref in reaction_keys or row['MNXR'] in reaction_keys)
+        self._reactions_xref = self.table(
+            ((xref, row) for xref, row in xref_rows(self.table_lines('reac_xref')) if row['MNXR'] in mnxrs),
+            xref_columns)
+        self._reactions = self.table(
+            ((i, row) for i, row in reaction_rows(self.table_lines('reac_prop')) if i in mnxrs), reaction_columns)
+        mnxms = set()
+        for row in self._reactions.values():
+            mnxms.update(tools.parse_equation(row['EQUATION'], metanetx_metabolite_pattern).ids)
+        if metabolite_keys:
+            mnxms.update(row['MNXR'] for xref, row in xref_rows(self.table_lines('chem_xref'))
+                         if xref in metabolite_keys)
+        self._metabolites_xref = self.table(
+            ((xref, row) for xref, row in xref_rows(self.table_lines('chem_xref')) if row['MNXR'] in mnxms),
+            xref_columns)
+        self._metabolites = self.table(
+            ((i, row) for i, row in metabolite_rows(self.table_lines('chem_prop')) if i in mnxms), metabolite_columns)
+        print('Loaded %d reactions and %d metabolites needed by %d reaction xrefs' % (
+            len(self._reactions), len(self._metabolites), len(reaction_keys)))
+
+    def table(self, rows, columns):
+        """
+        Build a loaded table, as a dict of row dicts or as a columnar.ColumnarTable
+        :param rows: an iterable of (key, row dict) tuples
+        :param columns: the column names of the rows
+        :return:
+        """
+        if self._columnar:
+            return columnar.ColumnarTable(columns, rows)
+        return dict(rows)
+
+    def xref_index(self, xrefs):
+        if self._columnar:
+            return columnar.ColumnarXrefIndex(xrefs)
+        return xref_index(xrefs)
+
+    @staticmethod
+    def load_xref(lines):
+        return dict(xref_rows(lines))
+
+    @staticmethod
+    def load_reactions(lines):
+        return dict(reaction_rows(lines))
+
+    @staticmethod
+    def load_metabolites(lines):
+        return dict(metabolite_rows(lines))
+
+
+xref_columns = ('MNXR', 'DB')
+reaction_columns = ('EQUATION', 'DESCRIPTION', 'BALANCE', 'EC', 'SOURCE')
+metabolite_columns = ('DESCRIPTION', 'FORMULA', 'CHARGE', 'MASS', 'INCHI', 'SMILES', 'SOURCE', 'INCHIKEY')
+
+
+def xref_index(xrefs):
+    """
+    Invert a reac_xref or chem_xref dict
+    E.G.: {'kegg:R00001': {'MNXR': 'MNXR1', 'DB': 'kegg:R00001'}} = {'MNXR1': [('kegg:R00001', 'kegg:R00001')]}
+    :param xrefs:
+    :return: a dict of MNX id to a list of (DB, xref) pairs, in table order
+    """
+    index = {}
+    for xref, row in xrefs.items():
+        index.setdefault(row['MNXR'], []).append((row['DB'], xref))
+    return index
+
+
+def ec_index(reactions):
+    """
+    Index reactions by E.C. number, from the ';' separated EC column of reac_prop
+    E.G.: [('MNXR1', '1.1.1.1;1.1.1.2')] matches '1.1.1.1' = ['MNXR1'] and '1.1.1.-' = ['MNXR1']
+    Values of the EC column that are not E.C. numbers are left out
+    :param reactions: an iterable of (MNXR id, EC) tuples
+    :return: an enzymeAssignment.ECTrie of E.C. number to MNXR ids, in table order
+    """
+    index = enzymeAssignment.ECTrie()
+    for mnxr, ec_numbers in reactions:
+        for ec_number in ec_numbers.split(';'):
+            ec_number = ec_number.strip()
+            if re.fullmatch(enzymeAssignment.ec_pattern, ec_number):
+                index.add(ec_number, mnxr)
+    return index
+
+
+def xref_rows(lines):
+    """
+    Parse the lines of a reac_xref or chem_xref table, keyed by database and xref (see xref_key)
+    Deprecated and malformed lines are skipped
+    E.G.: 'kegg.reaction:R00001	MNXR1' = ('kegg:R00001', {'MNXR': 'MNXR1', 'DB': 'kegg.reaction:R00001'})
+    :param lines:
+    :return: a generator of (xref, row) tuples
+    """
+    for line in lines:
+        if line and not line[0] == '#' and 'deprecated' not in line and ':' in line:
+            line = line.split('\t')
+            if len(line) > 1:
+                database, xref = line[0].split(':', 1)
+                yield xref_key(database, xref), {'MNXR': line[1], 'DB': line[0]}
+
+
+def xref_database(name):
+    """
+    The database named by a MNXref database prefix or a SBML notes key
+    E.G.: 'kegg.compound' = 'kegg', 'keggC' = 'kegg', 'KEGG' = 'kegg', 'BIOCYC' = 'metacyc', 'ChEBI' = 'chebi'
+    :param name:
+    :return:
+    """
+    database = name.split('.')[0].lower()
+    return xref_database_aliases.get(database, database)
+
+
+def xref_key(database, xref):
+    """
+    The key of an xref in reac_xref and chem_xref, so the same id in two databases has two keys
+    E.G.: ('KEGG', 'C00001') = 'kegg:C00001', ('PubChem', '3303') = 'pubchem:3303', ('ChEBI', '3303') = 'chebi:3303'
+    :param database: a MNXref database prefix or a SBML notes key
+    :param xref:
+    :return:
+    """
+    return xref_database(database) + ':' + xref
+
+
+def db_link(db):
+    """
+    The DB_LINKS name and id of the DB column of a reac_xref or chem_xref row
+    E.G.: 'kegg:R00001' = ('KEGG', 'R00001')
+    :param db:
+    :return:
+    """
+    database, xref = db.split(':', 1)
+    return database.upper(), xref
+
+
+def reaction_rows(lines):
+    """
+    Parse the lines of a reac_prop table
+    :param lines:
+    :return: a generator of (MNXR id, row) tuples
+    """
+    for line in lines:
+        if line and not line[0] == '#':
+            line = line.split('\t')
+            if len(line) > len(reaction_columns):
+                yield line[0], dict(zip(reaction_columns, line[1:]))
+
+
+def metabolite_rows(lines):
+    """
+    Parse the lines of a chem_prop table
+    :param lines:
+    :return: a generator of (MNXM id, row) tuples
+    """
+    for line in lines:
+        if line and not line[0] == '#':
+            line = line.split('\t')
+            if len(line) > len(metabolite_columns):
+                yield line[0], dict(zip(metabolite_columns, line[1:]))
+
+
+def mnxref_source(table, mnxref_path):
+    """
+    Where a MNXref table is read from
+    :param table: reac_xref, reac_prop, chem_xref or chem_prop
+    :param mnxref_path: directory holding local copies of the tables, or None to read from the MetaNetX website
+    :return: a local file path or a url
+    """
+    if mnxref_path is None:
+        return mnxref_urls[table]
+    for extension in ('.tsv', '.tsv.gz'):
+        path = os.path.join(mnxref_path, table + extension)
+        if os.path.exists(path):
+            return path
+    os.makedirs(mnxref_path, exist_ok=True)
+    return transport.download(mnxref_urls[table], os.path.join(mnxref_path, table + '.tsv'))
+
+
+def tsv_lines(source):
+    """
+    Read a tab separated file one line at a time, without line endings
+    :param source: a url, or a path to a .tsv or .tsv.gz file
+    :return: a generator of lines
+    """
+    if source.startswith('http://') or source.startswith('https://'):
+        response = transport.get(source, stream=True)
+        response.raise_for_status()
+        try:
+            for line in response.iter_lines():
+                yield line.decode('utf-8', 'replace')
+        finally:
+            response.close()
+    else:
+        with (gzip.open if source.endswith('.gz') else open)(source, 'rt', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                yield line.rstrip('\r\n')
+
+
+# SQLite tables of a compiled MNXref store: (MNXref table, row parser, key column, columns)
+store_tables = collections.OrderedDict([
+    ('reactions_xref', ('reac_xref', xref_rows, 'XREF', xref_columns)),
+    ('reactions', ('reac_prop', reaction_rows, 'ID', reaction_columns)),
+    ('metabolites_xref', ('chem_xref', xref_rows, 'XREF', xref_columns)),
+    ('metabolites', ('chem_prop', metabolite_rows, 'ID', metabolite_columns))])
+
+
+class MNXrefStore:
+    """
+    A MNXref release compiled into an indexed SQLite database
+    The tables are exposed as read only mappings with the same keys and rows as the MetaNetXDict dicts
+    Each release is compiled once into its own database file (see store_path), so runs can pin a release
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._release = self._connection.execute("SELECT VALUE FROM meta WHERE KEY = 'release'").fetchone()[0]
+        row = self._connection.execute("SELECT VALUE FROM meta WHERE KEY = 'format'").fetchone()
+        self._format = row[0] if row is not None else '1'
+        self._tables = {}
+        for name, (table, rows, key, columns) in store_tables.items():
+            self._tables[name] = StoreTable(self._connection, name, key, columns)
+        self.create_indexes(self._connection)
+        self._reaction_xref_index = StoreXrefIndex(self._connection, 'reactions_xref')
+        self._metabolite_xref_index = StoreXrefIndex(self._connection, 'metabolites_xref')
+        self._ec_index = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def release(self):
+        return self._release
+
+    @property
+    def format(self):
+        return self._format
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @property
+    def reactions_xref(self):
+        return self._tables['reactions_xref']
+
+    @property
+    def reactions(self):
+        return self._tables['reactions']
+
+    @property
+    def metabolites_xref(self):
+        return self._tables['metabolites_xref']
+
+    @property
+    def metabolites(self):
+        return self._tables['metabolites']
+
+    @property
+    def reaction_xref_index(self):
+        return self._reaction_xref_index
+
+    @property
+    def metabolite_xref_index(self):
+        return self._metabolite_xref_index
+
+    @property
+    def ec_index(self):
+        """
+        E.C. number to MNXR ids, see ec_index. Built from the reactions table the first time it is used
+        :return:
+        """
+        if self._ec_index is None:
+            self._ec_index = ec_index(self._connection.execute("SELECT ID, EC FROM reactions WHERE EC != ''"))
+        return self._ec_index
+
+    @staticmethod
+    def create_indexes(connection):
+        """
+        Index the xref tables on their MNX id, used by the xref indexes
+        Stores compiled before these indexes existed get them the first time they are opened
+        :param connection:
+        :return:
+        """
+        with connection:
+            for name in ('reactions_xref', 'metabolites_xref'):
+                connection.execute('CREATE INDEX IF NOT EXISTS %s_mnxr ON %s (MNXR)' % (name, name))
+
+    @staticmethod
+    def compile(path, release, mnxref_path=None):
+        """
+        Compile the MNXref tables into a SQLite database
+        The database is written to a temporary file that replaces path once complete
+        :param path: the database file to write
+        :param release: the MNXref release the tables belong to
+        :param mnxref_path: directory of the MNXref tables, see MetaNetXDict
+        :return: an MNXrefStore for the new database
+        """
+        print('Compiling MNXref release %s into %s' % (release, path))
+        temp_path = path + '.part'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        connection = sqlite3.connect(temp_path)
+        try:
+            connection.execute('CREATE TABLE meta (KEY TEXT PRIMARY KEY, VALUE TEXT)')
+            connection.executemany('INSERT INTO meta VALUES (?, ?)',
+                                   [('release', release), ('format', store_format), ('compiled', time.ctime())])
+            for name, (table, rows, key, columns) in store_tables.items():
+                source = mnxref_source(table, mnxref_path)
+                print('Loading %s from %s' % (table, source))
+                connection.execute('CREATE TABLE %s (%s TEXT PRIMARY KEY, %s)' % (
+                    name, key, ', '.join('%s TEXT' % c for c in columns)))
+                connection.executemany('INSERT OR REPLACE INTO %s VALUES (%s)' % (name, ', '.join('?' * (len(columns) + 1))),
+                                       ((k,) + tuple(row[c] for c in columns) for k, row in rows(tsv_lines(source))))
+            connection.commit()
+            MNXrefStore.create_indexes(connection)
+        finally:
+            connection.close()
+        os.replace(temp_path, path)
+        return MNXrefStore(path)
+
+
+class StoreTable(collections.abc.Mapping):
+    """
+    A read only mapping over one table of an MNXref store, rows are returned as dicts
+    """
+
+    def __init__(self, connection, name, key, columns):
+        self._connection = connection
+        self._name = name
+        self._key = key
+        self._columns = columns
+        self._select = 'SELECT %s FROM %s WHERE %s = ?' % (', '.join(columns), name, key)
+
+    def __getitem__(self, key):
+        row = self._connection.execute(self._select, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return dict(zip(self._columns, row))
+
+    def __contains__(self, key):
+        return self._connection.execute('SELECT 1 FROM %s WHERE %s = ?' % (self._name, self._key),
+                                        (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for row in self._connection.execute('SELECT %s FROM %s' % (self._key, self._name)):
+            yield row[0]
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM %s' % self._name).fetchone()[0]
+
+
+class StoreXrefIndex(collections.abc.Mapping):
+    """
+    A read only mapping of MNX id to (DB, xref) pairs over an xref table of an MNXref store, see xref_index
+    """
+
+    def __init__(self, connection, name):
+        self._connection = connection
+        self._name = name
+
+    def __getitem__(self, key):
+        rows = self._connection.execute('SELECT DB, XREF FROM %s WHERE MNXR = ? ORDER BY rowid' % self._name,
+                                        (key,)).fetchall()
+        if not rows:
+            raise KeyError(key)
+        return rows
+
+    def __iter__(self):
+        for row in self._connection.execute('SELECT DISTINCT MNXR FROM %s' % self._name):
+            yield row[0]
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(DISTINCT MNXR) FROM %s' % self._name).fetchone()[0]
+
+
+def release_key(mnxref_path=None, store=None):
+    """
+    A key identifying the MNXref tables a merge is resolved against, for caches of merge results
+    A compiled store is identified by its release. Other tables are identified by the release in the header of
+    reac_xref (see header_release), read from the local copy if there is one or else from the MetaNetX website,
+    so tables downloaded by a first run have the same key in later runs. Local tables whose header names no
+    release are identified by their names, sizes and modification times
+    :param mnxref_path: the directory of MNXref tables, see MetaNetXDict
+    :param store: an MNXrefStore
+    :return: the key, or None if the release of streamed tables can not be read
+    """
+    if store is not None:
+        return store.release
+    tables = []
+    for table in sorted(mnxref_urls) if mnxref_path else []:
+        for extension in ('.tsv', '.tsv.gz'):
+            path = os.path.join(mnxref_path, table + extension)
+            if os.path.exists(path):
+                tables.append((table, path))
+                break
+    reac_xref = dict(tables).get('reac_xref', mnxref_urls['reac_xref'])
+    release = header_release(reac_xref)
+    if release is not None:
+        return 'MNXref ' + release
+    if tables:
+        return ','.join('%s:%d:%d' % (os.path.basename(path), os.path.getsize(path), os.path.getmtime(path))
+                        for table, path in tables)
+    return None
+
+
+def header_release(source):
+    """
+    The MNXref release named in the '#' comment lines at the start of a MNXref table
+    Only the header is read, a streamed table is closed at its first row
+    :param source: a url, or a path to a .tsv or .tsv.gz file
+    :return: the release, E.G. '4.4', or None if the header does not name one
+    """
+    lines = tsv_lines(source)
+    try:
+        for line in lines:
+            if not line.startswith('#'):
+                break
+            match = mnxref_version_pattern.search(line)
+            if match:
+                return match.group(1)
+    finally:
+        lines.close()
+    return None
+
+
+def store_path(store_directory, release):
+    """
+    The database file of a MNXref release in a store directory
+    :param store_directory:
+    :param release:
+    :return:
+    """
+    return os.path.join(store_directory, 'mnxref_%s.sqlite' % release)
+
+
+def open_store(store_directory, release=None, mnxref_path=None):
+    """
+    Open the compiled store of a MNXref release, compiling it first if it does not exist
+    A store compiled in an older store_format is compiled again
+    :param store_directory: directory holding one compiled database per release
+    :param release: the release to use. If None, the most recently compiled release in the directory is used
+    :param mnxref_path: directory of the MNXref tables to compile from, see MetaNetXDict
+    :return: an MNXrefStore
+    """
+    if release is None:
+        releases = [f for f in os.listdir(store_directory) if f.startswith('mnxref_') and f.endswith('.sqlite')]
+        if not releases:
+            raise LookupError("No compiled MNXref release in %s, a release name is needed to compile one" %
+                              store_directory)
+        latest = MNXrefStore(max((os.path.join(store_directory, f) for f in releases), key=os.path.getmtime))
+        release = latest.release
+        latest.connection.close()
+    path = store_path(store_directory, release)
+    if not os.path.exists(path):
+        os.makedirs(store_directory, exist_ok=True)
+        return MNXrefStore.compile(path, release, mnxref_path)
+    store = MNXrefStore(path)
+    if store.format != store_format:
+        print('MNXref store %s was compiled in format %s, compiling it again in format %s' % (
+            path, store.format, store_format))
+        store.connection.close()
+        return MNXrefStore.compile(path, release, mnxref_path)
+    return store
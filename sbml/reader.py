@@ -0,0 +1,219 @@
+import gzip
+import itertools
+import xml.etree.ElementTree as ElementTree
+
+import tools
+
+# The SBML list elements iter_model reads, and the element each of them lists
+list_elements = {'listOfSpecies': 'species', 'listOfReactions': 'reaction'}
+
+
+def iter_model(path):
+    """
+    Stream the species and reactions of a SBML file, one at a time, in document order
+    The file is read with ElementTree.iterparse, and each species or reaction element is discarded once the object
+    standing for it is built, so memory does not grow with the size of the file
+    Species and reactions are yielded as Species and Reaction objects, which answer the libsbml methods the
+    extractors and the merger call. Use getElementName to tell them apart
+    Only the elements of the SBML namespace, in listOfSpecies and listOfReactions, are read: a species element in
+    an annotation is not a species of the model
+    :param path: a SBML file, gzip compressed if it ends with .gz
+    :return: a generator of Species and Reaction objects
+    """
+    with open_sbml(path) as f:
+        namespace = None
+        container = None
+        for event, element in ElementTree.iterparse(f, events=('start', 'end')):
+            if namespace is None:
+                namespace = element_namespace(element.tag)
+            if element_namespace(element.tag) != namespace:
+                continue
+            name = local_name(element.tag)
+            if event == 'start':
+                if name in list_elements:
+                    container = element
+                continue
+            if element is container:
+                container = None
+            elif container is not None and name == list_elements[local_name(container.tag)]:
+                yield Species(element) if name == 'species' else Reaction(element)
+                container.clear()
+
+
+def iter_species(path):
+    """
+    The species of iter_model
+    :param path:
+    :return: a generator of Species objects
+    """
+    return (element for element in iter_model(path) if element.getElementName() == 'species')
+
+
+def iter_reactions(path):
+    """
+    The reactions of iter_model
+    :param path:
+    :return: a generator of Reaction objects
+    """
+    return (element for element in iter_model(path) if element.getElementName() == 'reaction')
+
+
+def model_id(path):
+    """
+    The id of the model of a SBML file, read without parsing the rest of the file
+    :param path:
+    :return:
+    """
+    with open_sbml(path) as f:
+        for event, element in ElementTree.iterparse(f, events=('start',)):
+            if local_name(element.tag) == 'model':
+                return element.get('id', '')
+    return ''
+
+
+def model_header(path, sample=50):
+    """
+    The metadata of the model of a SBML file, read from the start of the file only
+    :param path:
+    :param sample: number of species and reactions, from the start of the file, to read the notes keys of
+    :return: a (model id, model name, model notes dict, set of notes keys) tuple
+    """
+    model = None
+    with open_sbml(path) as f:
+        for event, element in ElementTree.iterparse(f, events=('start',)):
+            name = local_name(element.tag)
+            if name == 'model':
+                model = element
+            elif model is not None and name.startswith('listOf'):
+                break
+    if model is None:
+        return '', '', {}, set()
+    notes_keys = set()
+    for element in itertools.islice(iter_model(path), sample):
+        notes_keys.update(element.notes.keys())
+    return model.get('id', ''), model.get('name', ''), element_notes(model), notes_keys
+
+
+def open_sbml(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def local_name(tag):
+    """
+    A tag without its namespace, E.G.: '{http://www.sbml.org/sbml/level3/version1/core}species' = 'species'
+    :param tag:
+    :return:
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def element_namespace(tag):
+    """
+    The namespace of a tag, E.G.: '{http://www.sbml.org/sbml/level3/version1/core}species' =
+    'http://www.sbml.org/sbml/level3/version1/core', and '' for a tag without one
+    :param tag:
+    :return:
+    """
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
+
+def element_notes(element):
+    """
+    The items of the <p> paragraphs of an element's notes, as tools.notes2dict parses them from a notes string
+    :param element: an ElementTree element
+    :return: a dict
+    """
+    items = {}
+    for child in element:
+        if local_name(child.tag) == 'notes':
+            for paragraph in child.iter():
+                if local_name(paragraph.tag) == 'p':
+                    item = tools.notes_item(''.join(paragraph.itertext()))
+                    if item is not None:
+                        items[item[0]] = item[1]
+    return items
+
+
+class Species:
+    """
+    A species read by iter_model, with its notes parsed (see element_notes)
+    """
+    __slots__ = ('_id', '_name', '_compartment', 'notes')
+
+    def __init__(self, element):
+        self._id = element.get('id', '')
+        self._name = element.get('name', '')
+        self._compartment = element.get('compartment', '')
+        self.notes = element_notes(element)
+
+    def getElementName(self):
+        return 'species'
+
+    def getId(self):
+        return self._id
+
+    def getName(self):
+        return self._name
+
+    def getCompartment(self):
+        return self._compartment
+
+
+class SpeciesReference:
+    """
+    A reactant or product of a Reaction read by iter_model
+    """
+    __slots__ = ('_species', '_stoichiometry')
+
+    def __init__(self, element):
+        self._species = element.get('species', '')
+        self._stoichiometry = float(element.get('stoichiometry', 1))
+
+    def getSpecies(self):
+        return self._species
+
+    def getStoichiometry(self):
+        return self._stoichiometry
+
+
+def species_references(element):
+    return [SpeciesReference(ref) for ref in element if local_name(ref.tag) == 'speciesReference']
+
+
+class Reaction:
+    """
+    A reaction read by iter_model, with its notes parsed (see element_notes) and its species references
+    """
+    __slots__ = ('_id', '_name', '_reversible', '_reactants', '_products', 'notes')
+
+    def __init__(self, element):
+        self._id = element.get('id', '')
+        self._name = element.get('name', '')
+        self._reversible = element.get('reversible', 'true') in ('true', '1')
+        self._reactants = []
+        self._products = []
+        for child in element:
+            name = local_name(child.tag)
+            if name == 'listOfReactants':
+                self._reactants = species_references(child)
+            elif name == 'listOfProducts':
+                self._products = species_references(child)
+        self.notes = element_notes(element)
+
+    def getElementName(self):
+        return 'reaction'
+
+    def getId(self):
+        return self._id
+
+    def getName(self):
+        return self._name
+
+    def getReversible(self):
+        return self._reversible
+
+    def getListOfReactants(self):
+        return self._reactants
+
+    def getListOfProducts(self):
+        return self._products
@@ -1,21 +1,112 @@
+import gzip
+import io
+import itertools
 import libsbml
 import logging
 import time
 import sys
+from xml.sax.saxutils import escape
+
+import tools
+from sbml import reader, stream
+
+# Backends that build_sbml can write a model with
+writers = ('libsbml', 'stream')
+# Extensions of SBML files, the .gz ones are gzip compressed
+sbml_extensions = ('.xml', '.sbml', '.xml.gz', '.sbml.gz')
 
 
 def load_sbml(path):
     print('Importing SBML model from %s' % path)
     reader = libsbml.SBMLReader()
     start = time.time() * 1000
-    document = reader.readSBMLFromFile(path)
+    if path.endswith('.gz') and not libsbml.SBMLReader.hasZlib():
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            document = reader.readSBMLFromString(f.read())
+    else:
+        document = reader.readSBMLFromFile(path)
     stop = time.time() * 1000
 
     errors = document.getNumErrors(libsbml.LIBSBML_SEV_ERROR)
     return document
 
 
-def build_sbml(database_extractor, path, name):
+def notes_index(model):
+    """
+    The notes of every species and reaction of a model, parsed once so all the code reading a model can share them
+    :param model: a libsbml Model
+    :return: a dict of species or reaction id to its notes, see tools.notes2dict
+    """
+    return dict((element.getId(), tools.notes2dict(element.getNotesString()))
+                for element in itertools.chain(model.getListOfSpecies(), model.getListOfReactions()))
+
+
+class SBMLInput:
+    """
+    A SBML input file parsed once, with the metadata used to detect its source
+    It is shared by the source detection of every SBMLExtraction plugin and by the plugin that claims it
+    With stream the file is not loaded with libsbml: document is None, notes is empty and the metadata is read
+    from the start of the file, see reader.model_header
+    """
+
+    def __init__(self, path, stream=False):
+        self.path = path
+        self.stream = stream
+        if stream:
+            self.document = None
+            self.notes = {}
+            self.model_id, self.model_name, self.model_notes, self.notes_keys = reader.model_header(path)
+        else:
+            self.document = load_sbml(path)
+            model = self.document.getModel()
+            self.notes = notes_index(model)
+            self.model_id = model.getId()
+            self.model_name = model.getName()
+            self.model_notes = tools.notes2dict(model.getNotesString())
+            self.notes_keys = set(key for notes in self.notes.values() for key in notes.keys())
+
+    def metadata_text(self):
+        """
+        The model id, name and notes values as one string, to search for source names in
+        :return:
+        """
+        return ' '.join([self.model_id, self.model_name] + list(self.model_notes.values()))
+
+
+def load_inputs(paths, stream=False):
+    """
+    Parse each SBML input file once. Files that fail to load are logged and left out
+    :param paths:
+    :param stream: see SBMLInput
+    :return: a list of SBMLInput, in the order of paths
+    """
+    inputs = []
+    for path in paths:
+        try:
+            inputs.append(SBMLInput(path, stream))
+        except Exception:
+            logging.exception("Failed to load SBML file %s" % path)
+    return inputs
+
+
+def build_sbml(database_extractor, path, name, writer='libsbml', compress_level=None):
+    """
+    Build a SBML model of the reactions and metabolites of an extractor and write it to path
+    :param database_extractor:
+    :param path: output folder
+    :param name: model name
+    :param writer: 'libsbml' to build the model as libsbml objects, or 'stream' to write the SBML directly
+                   with stream.write_model, which is faster and uses less memory for large models
+    :param compress_level: a gzip compression level (1-9) to write the model to a .xml.gz file with,
+                           or None to write an uncompressed .xml file
+    :return:
+    """
+    if writer == 'stream':
+        filename = sbml_filename(database_extractor, name, path, compress_level is not None)
+        with open_sbml(filename, compress_level) as out:
+            stream.write_model(database_extractor, out, name + "_" + database_extractor.database_name(), name)
+        logging.info("Successfully built SMBL model: %s" % filename)
+        return
     # try:
     document = libsbml.SBMLDocument(3, 1)
     model = document.createModel()
@@ -26,16 +117,38 @@ def build_sbml(database_extractor, path, name):
     species(database_extractor, model)
     reactions(database_extractor, model)
 
-    write_sbml(database_extractor, document, name, path)
+    write_sbml(database_extractor, document, name, path, compress_level)
     logging.info("Successfully built SMBL model: %s" % path)
     # except:
     #     logging.error("FAILED TO BUILD SBML MODEL: %s" % path)
     #     sys.exit(1)
 
 
-def write_sbml(database_extractor, document, name, path):
-    filename = path + '/' + name + '_' + database_extractor.database_name() + '.xml'
-    libsbml.writeSBMLToFile(document, filename)
+def write_sbml(database_extractor, document, name, path, compress_level=None):
+    filename = sbml_filename(database_extractor, name, path, compress_level is not None)
+    if compress_level is None:
+        libsbml.writeSBMLToFile(document, filename)
+    else:
+        with open_sbml(filename, compress_level) as out:
+            out.write(libsbml.writeSBMLToString(document))
+
+
+def sbml_filename(database_extractor, name, path, compressed=False):
+    return path + '/' + name + '_' + database_extractor.database_name() + ('.xml.gz' if compressed else '.xml')
+
+
+def open_sbml(filename, compress_level=None):
+    """
+    Open a SBML file for writing text, gzip compressed at compress_level unless it is None
+    The gzip header has no timestamp, so writing the same model twice gives the same bytes and the merge cache
+    (see merge.MergeCache) still recognises the file
+    :param filename:
+    :param compress_level:
+    :return: a text file object
+    """
+    if compress_level is None:
+        return open(filename, 'w', encoding='utf-8')
+    return io.TextIOWrapper(gzip.GzipFile(filename, 'wb', compresslevel=compress_level, mtime=0), encoding='utf-8')
 
 
 def reactions(database_extractor, model):
@@ -95,17 +208,17 @@ def metabolite_notes_string(metabolite):
     try:
         notes_string = '<body xmlns="http://www.w3.org/1999/xhtml">\n'
         if not metabolite.__getitem__('CHARGE') == 'NA':
-            notes_string += '\t<p>CHARGE: %s</p>\n' % metabolite.__getitem__('CHARGE')
+            notes_string += '\t<p>CHARGE: %s</p>\n' % escape(str(metabolite.__getitem__('CHARGE')))
         if not metabolite.__getitem__('FORMULA') == 'NA':
-            notes_string += '\t<p>FORMULA: %s</p>\n' % metabolite.__getitem__('FORMULA')
+            notes_string += '\t<p>FORMULA: %s</p>\n' % escape(metabolite.__getitem__('FORMULA'))
         if not metabolite.__getitem__('INCHI') == 'NA':
-            notes_string += '\t<p>INCHI: %s</p>\n' % metabolite.__getitem__('INCHI')
+            notes_string += '\t<p>INCHI: %s</p>\n' % escape(metabolite.__getitem__('INCHI'))
         if not metabolite.__getitem__('INCHIKEY') == 'NA':
-            notes_string += '\t<p>INCHI KEY: %s</p>\n' % metabolite.__getitem__('INCHIKEY')
+            notes_string += '\t<p>INCHI KEY: %s</p>\n' % escape(metabolite.__getitem__('INCHIKEY'))
         if not metabolite.__getitem__('SMILES') == 'NA':
-            notes_string += '\t<p>SMILES: %s</p>\n' % metabolite.__getitem__('SMILES')
+            notes_string += '\t<p>SMILES: %s</p>\n' % escape(metabolite.__getitem__('SMILES'))
         for db in metabolite.__getitem__('DB_LINKS').keys():
-            notes_string += '\t<p>%s: %s</p>\n' % (db, metabolite.__getitem__('DB_LINKS')[db])
+            notes_string += '\t<p>%s: %s</p>\n' % (escape(db), escape(str(metabolite.__getitem__('DB_LINKS')[db])))
         notes_string += '</body>'
         return str(notes_string)
     except:
@@ -124,17 +237,17 @@ def reaction_notes_string(reaction):
 
 def notes_string_enzyme(reaction):
     if len(reaction.__getitem__('ENZYME')) > 0:
-        return '\t<p>ENZYME: %s</p>\n' % ', '.join(reaction.__getitem__('ENZYME'))
+        return '\t<p>ENZYME: %s</p>\n' % escape(', '.join(reaction.__getitem__('ENZYME')))
 
 
 def notes_string_gene_association(reaction):
-    return '\t<p>GENE_ASSOCIATION: %s</p>\n' % ', '.join(set(reaction.__getitem__('GENE_ASSOCIATION')))
+    return '\t<p>GENE_ASSOCIATION: %s</p>\n' % escape(', '.join(set(reaction.__getitem__('GENE_ASSOCIATION'))))
 
 
 def notes_string_db_links(reaction):
     out = ""
     for db in reaction.__getitem__('DB_LINKS').keys():
-        out += '\t<p>%s: %s</p>\n' % (db, reaction.__getitem__('DB_LINKS')[db])
+        out += '\t<p>%s: %s</p>\n' % (escape(db), escape(str(reaction.__getitem__('DB_LINKS')[db])))
     return out
 
 
@@ -142,7 +255,7 @@ def notes_string_subsystem(reaction):
     out = ""
     try:
         if len(reaction.__getitem__('SUBSYSTEM')) > 0:
-            out += '\t<p>SUBSYSTEM: %s</p>\n' % ' || '.join(reaction.__getitem__('SUBSYSTEM'))
+            out += '\t<p>SUBSYSTEM: %s</p>\n' % escape(' || '.join(reaction.__getitem__('SUBSYSTEM')))
         return out
     except TypeError:
         return out
@@ -0,0 +1,123 @@
+from xml.sax.saxutils import escape, quoteattr
+
+sbml_namespace = 'http://www.sbml.org/sbml/level3/version1/core'
+xhtml_namespace = 'http://www.w3.org/1999/xhtml'
+
+
+def write_model(database_extractor, out, model_id, name):
+    """
+    Write the reactions and metabolites of an extractor as a SBML L3V1 document, element by element
+    The document holds the same compartments, species, reactions and notes as one built with libsbml by
+    sbml.build_sbml, but no libsbml objects are created and no part of the document is held in memory
+    :param database_extractor: a DatabaseExtraction, or any object with reactions and metabolites
+    :param out: a text file open for writing
+    :param model_id:
+    :param name:
+    :return:
+    """
+    write = out.write
+    write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    write('<sbml xmlns=%s level="3" version="1">\n' % quoteattr(sbml_namespace))
+    write('  <model id=%s name=%s>\n' % (quoteattr(model_id), quoteattr(name)))
+
+    metabolites = database_extractor.metabolites
+    write('    <listOfCompartments>\n')
+    for compartment in compartments(metabolites):
+        write('      <compartment id=%s name=%s constant="false"/>\n' % (quoteattr(compartment),
+                                                                         quoteattr(compartment)))
+    write('    </listOfCompartments>\n')
+
+    write('    <listOfSpecies>\n')
+    for m in metabolites.keys():
+        metabolite = metabolites[m]
+        write('      <species id=%s name=%s compartment=%s hasOnlySubstanceUnits="false" boundaryCondition="false" '
+              'constant="false">\n' % (quoteattr(metabolite['ID']), quoteattr(metabolite['NAME'][0]),
+                                       quoteattr(metabolite['COMPARTMENT'])))
+        write_notes(out, metabolite_notes(metabolite), '        ')
+        write('      </species>\n')
+    write('    </listOfSpecies>\n')
+
+    write('    <listOfReactions>\n')
+    for r in database_extractor.reactions.keys():
+        reaction = database_extractor.reactions[r]
+        write('      <reaction id=%s name=%s reversible="%s" fast="false">\n' % (
+            quoteattr(reaction['ID']), quoteattr(reaction['NAME'][0]), 'true' if reaction['REVERSIBLE'] else 'false'))
+        write_notes(out, reaction_notes(reaction), '        ')
+        for element, side in (('listOfReactants', 'SUBSTRATES'), ('listOfProducts', 'PRODUCTS')):
+            write('        <%s>\n' % element)
+            for species in reaction[side]:
+                write('          <speciesReference species=%s stoichiometry="%s" constant="true"/>\n' % (
+                    quoteattr(species), number(reaction['STOICHIOMETRY'][species])))
+            write('        </%s>\n' % element)
+        write('      </reaction>\n')
+    write('    </listOfReactions>\n')
+
+    write('  </model>\n')
+    write('</sbml>\n')
+
+
+def write_notes(out, notes, indent):
+    """
+    Write notes as a XHTML body with one <p> per item, so tools.notes2dict can read them back
+    :param out:
+    :param notes: an iterable of (key, value) tuples
+    :param indent:
+    :return:
+    """
+    out.write('%s<notes>\n%s  <body xmlns=%s>\n' % (indent, indent, quoteattr(xhtml_namespace)))
+    out.write(''.join('%s    <p>%s: %s</p>\n' % (indent, escape(str(key)), escape(str(value))) for key, value in notes))
+    out.write('%s  </body>\n%s</notes>\n' % (indent, indent))
+
+
+def metabolite_notes(metabolite):
+    """
+    The notes of a metabolite, in the order sbml.metabolite_notes_string writes them
+    :param metabolite: a MetaboliteDict
+    :return: a list of (key, value) tuples
+    """
+    notes = [(key, metabolite[item]) for key, item in (('CHARGE', 'CHARGE'), ('FORMULA', 'FORMULA'),
+                                                        ('INCHI', 'INCHI'), ('INCHI KEY', 'INCHIKEY'),
+                                                        ('SMILES', 'SMILES'))
+             if not metabolite[item] == 'NA']
+    notes.extend((db, metabolite['DB_LINKS'][db]) for db in metabolite['DB_LINKS'].keys())
+    return notes
+
+
+def reaction_notes(reaction):
+    """
+    The notes of a reaction, in the order sbml.reaction_notes_string writes them
+    :param reaction: a ReactionDict
+    :return: a list of (key, value) tuples
+    """
+    notes = []
+    if reaction['ENZYME']:
+        notes.append(('ENZYME', ', '.join(reaction['ENZYME'])))
+    notes.append(('GENE_ASSOCIATION', ', '.join(set(reaction['GENE_ASSOCIATION']))))
+    notes.extend((db, reaction['DB_LINKS'][db]) for db in reaction['DB_LINKS'].keys())
+    if reaction['SUBSYSTEM']:
+        notes.append(('SUBSYSTEM', ' || '.join(reaction['SUBSYSTEM'])))
+    return notes
+
+
+def compartments(metabolites):
+    """
+    The compartments of the metabolites, in the order they are first used
+    :param metabolites:
+    :return:
+    """
+    seen = []
+    for m in metabolites.keys():
+        compartment = metabolites[m]['COMPARTMENT']
+        if compartment not in seen:
+            seen.append(compartment)
+    return seen
+
+
+def number(value):
+    """
+    A stoichiometric coefficient as libsbml writes it, without a trailing .0 for whole numbers
+    :param value:
+    :return:
+    """
+    value = float(value)
+    return '%d' % value if value.is_integer() else repr(value)
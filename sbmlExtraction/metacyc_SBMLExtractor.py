@@ -1,7 +1,11 @@
+import collections
 import re
 
-from interfaces import sbmlExtraction, databaseExtraction
-from tools import notes2dict
+from interfaces import sbmlExtraction, databaseExtraction, enzymeAssignment
+from sbml import reader
+
+# MetaCyc and BioCyc named in a model's id, name or notes
+metacyc_source_pattern = re.compile(r'metacyc|biocyc', re.I)
 
 
 class MetaCycSBMLExtraction(sbmlExtraction.SBMLExtraction):
@@ -10,6 +14,20 @@ class MetaCycSBMLExtraction(sbmlExtraction.SBMLExtraction):
     This module extends the databaseExtraction interface
     """
 
+    def __init__(self, **kwargs):
+        super(MetaCycSBMLExtraction, self).__init__(**kwargs)
+        # With sbml_stream, the species of the matched reactions, read from the file by stream_reactions
+        self._stream_species = {}
+
+    @classmethod
+    def claims(cls, sbml_input):
+        """
+        MetaCyc and BioCyc models are named so in their metadata, or have BIOCYC ids in their species notes
+        :param sbml_input:
+        :return:
+        """
+        return bool(metacyc_source_pattern.search(sbml_input.metadata_text())) or 'BIOCYC' in sbml_input.notes_keys
+
     def metabolite_inchi_key(self, **kwargs):
         pass
 
@@ -102,7 +120,7 @@ class MetaCycSBMLExtraction(sbmlExtraction.SBMLExtraction):
         return substrates
 
     def get_species_id(self, species):
-        return notes2dict(self.sbml_file.getModel().getSpecies(species).getNotesString())['BIOCYC']
+        return self.notes[species]['BIOCYC']
 
     def reaction_dblinks(self, **kwargs):
         """
@@ -132,22 +150,30 @@ class MetaCycSBMLExtraction(sbmlExtraction.SBMLExtraction):
         :return:
         """
         if metabolite_id not in self.metabolites:
-            metabolite_notes_dict = notes2dict(
-                self.sbml_file.getModel().getListOfSpecies().get(metabolite_id).getNotesString())
-            name = self.metabolite_name(
-                metabolite=self.sbml_file.getModel().getListOfSpecies().get(metabolite_id))
-            charge = self.metabolite_charge(metabolite_notes_dict=metabolite_notes_dict)
-            formula = self.metabolite_formula(metabolite_notes_dict=metabolite_notes_dict)
-            inchi = self.metabolite_inchi(metabolite_notes_dict=metabolite_notes_dict)
-            db_links = self.metabolite_dblinks(notes_dict=metabolite_notes_dict)
-
-            metabolite = databaseExtraction.MetaboliteDict(metabolite_id, name, formula, db_links, charge=charge,
-                                                           inchi=inchi)
-            self.metabolites[metabolite_id] = metabolite
-
-            return metabolite
-        else:
-            return self.metabolites[metabolite_id]
+            if self.sbml_stream:
+                # sbml_file is None: the species is read from the stream, wherever it is declared in the file
+                species = self._stream_species[metabolite_id]
+                self.metabolites[metabolite_id] = self.species_metabolite(species, species.notes)
+            else:
+                species = self.sbml_file.getModel().getListOfSpecies().get(metabolite_id)
+                self.metabolites[metabolite_id] = self.species_metabolite(species, self.notes.get(metabolite_id, {}))
+        return self.metabolites[metabolite_id]
+
+    def species_metabolite(self, species, notes):
+        """
+        Build the metabolite of a species
+        :param species: a libsbml Species, or a sbml.reader.Species
+        :param notes: the species' notes, they are not changed
+        :return: a MetaboliteDict
+        """
+        metabolite_notes_dict = dict(notes)
+        name = self.metabolite_name(metabolite=species)
+        charge = self.metabolite_charge(metabolite_notes_dict=metabolite_notes_dict)
+        formula = self.metabolite_formula(metabolite_notes_dict=metabolite_notes_dict)
+        inchi = self.metabolite_inchi(metabolite_notes_dict=metabolite_notes_dict)
+        db_links = self.metabolite_dblinks(notes_dict=metabolite_notes_dict)
+
+        return databaseExtraction.MetaboliteDict(species.getId(), name, formula, db_links, charge=charge, inchi=inchi)
 
     def get_reactions(self):
         """
@@ -155,34 +181,96 @@ class MetaCycSBMLExtraction(sbmlExtraction.SBMLExtraction):
         :return:
         """
         print("Executing MetaCyc SBML Extractor")
+        if self.sbml_stream:
+            self.stream_reactions()
+            return
+        model = self.sbml_file.getModel()
+        index = ec_index(self.notes[reaction.getId()] for reaction in model.getListOfReactions())
         for ec_number in self.enzymes.keys():
             print("Extracting reactions linked to %s" % ec_number)
-            for reaction in self.sbml_file.getModel().getListOfReactions():
-                if len(re.findall('\\b' + ec_number + '\\b', reaction.getNotesString())) > 0:
-                    for ec in re.findall('\\b' + ec_number + '\\b', reaction.getNotesString()):
-                        if ec == ec_number:
-                            if reaction.getId() not in self.reactions:
-                                print('\tExtracting reaction: %s' % reaction.getId())
-                                notes_dict = notes2dict(reaction.getNotesString())
-                                name = self.reaction_name(reaction=reaction)
-                                substrates = self.reaction_substrates(reaction=reaction)
-                                products = self.reaction_products(reaction=reaction)
-                                reversible = self.reaction_reversibility(reaction=reaction)
-                                stoichiometry = self.reaction_stoichiometry(reaction=reaction)
-                                pathways = self.reaction_pathways(notes_dict=notes_dict)
-
-                                db_links = self.reaction_dblinks(notes_dict=notes_dict)
-
-                                r = databaseExtraction.ReactionDict(reaction.getId(), name, substrates, products,
-                                                                    reversible, ec_number, self.enzymes[ec_number],
-                                                                    db_links, stoichiometry, pathways)
-                                self.reactions[reaction.getId()] = r
-                            else:
-                                print(
-                                    '\tReaction %s is already extracted .... appending E.C. number and Gene IDs' %
-                                    reaction.getId())
-                                r = self.reactions[reaction.getId()]
-                                r.append_enzyme(ec_number)
-                                r.append_gene(self.enzymes[ec_number])
+            for position in sorted(index.match(ec_number)):
+                reaction = model.getReaction(position)
+                self.add_reaction(reaction, self.notes[reaction.getId()], ec_number)
+
+    def stream_reactions(self):
+        """
+        get_reactions for sbml_stream, in two passes over the file that only keep the matched reactions and species
+        The first pass finds the reactions with an assigned E.C. number in their notes, or an E.C. number covered
+        by an assigned partial one (see enzymeAssignment.ec_wildcards), the second reads their species, declared
+        before or after them. Reactions are then added in the same order as from a loaded file
+        :return:
+        """
+        ec_reactions = collections.OrderedDict((ec_number, collections.OrderedDict())
+                                               for ec_number in self.enzymes.keys())
+        matched = {}
+        for reaction in reader.iter_reactions(self.sbml_path):
+            for ec in reaction_ecs(reaction.notes):
+                for assigned in enzymeAssignment.ec_wildcards(ec):
+                    if assigned in ec_reactions:
+                        ec_reactions[assigned][reaction.getId()] = None
+                        matched[reaction.getId()] = reaction
+        species_ids = set(ref.getSpecies() for reaction in matched.values()
+                          for ref in reaction.getListOfReactants() + reaction.getListOfProducts())
+        for species in reader.iter_species(self.sbml_path):
+            if species.getId() in species_ids:
+                self._stream_species[species.getId()] = species
+        missing = species_ids.difference(self._stream_species)
+        if missing:
+            raise ValueError('%s: species %s are referenced by reactions but not declared' %
+                             (self.sbml_path, ', '.join(sorted(missing))))
+        for ec_number, reaction_ids in ec_reactions.items():
+            print("Extracting reactions linked to %s" % ec_number)
+            for reaction_id in reaction_ids:
+                self.add_reaction(matched[reaction_id], matched[reaction_id].notes, ec_number)
+
+    def add_reaction(self, reaction, notes, ec_number):
+        """
+        Add a reaction linked to an E.C. number, or only the E.C. number and its genes if it is already extracted
+        :param reaction: a libsbml Reaction, or a sbml.reader.Reaction
+        :param notes: the reaction's notes, they are not changed
+        :param ec_number:
+        :return:
+        """
+        if reaction.getId() not in self.reactions:
+            print('\tExtracting reaction: %s' % reaction.getId())
+            notes_dict = dict(notes)
+            name = self.reaction_name(reaction=reaction)
+            substrates = self.reaction_substrates(reaction=reaction)
+            products = self.reaction_products(reaction=reaction)
+            reversible = self.reaction_reversibility(reaction=reaction)
+            stoichiometry = self.reaction_stoichiometry(reaction=reaction)
+            pathways = self.reaction_pathways(notes_dict=notes_dict)
+
+            db_links = self.reaction_dblinks(notes_dict=notes_dict)
+
+            r = databaseExtraction.ReactionDict(reaction.getId(), name, substrates, products,
+                                                reversible, ec_number, self.enzymes[ec_number],
+                                                db_links, stoichiometry, pathways)
+            self.reactions[reaction.getId()] = r
+        else:
+            print('\tReaction %s is already extracted .... appending E.C. number and Gene IDs' % reaction.getId())
+            r = self.reactions[reaction.getId()]
+            r.append_enzyme(ec_number)
+            r.append_gene(self.enzymes[ec_number])
 
 
+def reaction_ecs(notes):
+    """
+    The E.C. numbers of a reaction's EC Number note, E.G.: 'EC-1.1.1.1, EC-1.1.1.-' = ['1.1.1.1', '1.1.1.-']
+    :param notes: the reaction's notes dict
+    :return: a list of E.C. numbers, without duplicates
+    """
+    return list(collections.OrderedDict.fromkeys(re.findall(enzymeAssignment.ec_pattern, notes.get('EC Number', ''))))
+
+
+def ec_index(reaction_notes):
+    """
+    Index the reactions of a model by the E.C. numbers of their notes, in a single pass
+    :param reaction_notes: the notes dict of every reaction, in model order
+    :return: an enzymeAssignment.ECTrie of E.C. number to the positions of its reactions in the model
+    """
+    index = enzymeAssignment.ECTrie()
+    for position, notes in enumerate(reaction_notes):
+        for ec in reaction_ecs(notes):
+            index.add(ec, position)
+    return index
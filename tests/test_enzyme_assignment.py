@@ -0,0 +1,44 @@
+import unittest
+
+from interfaces import enzymeAssignment
+
+
+class AssignedEnzymeDictTest(unittest.TestCase):
+
+    def test_partial_and_preliminary_keys(self):
+        enzymes = enzymeAssignment.AssignedEnzymeDict({'1.1.1.-': ['g1'], '1.1.1.1': ['g2'], '2.7.1.n1': ['g3']})
+        self.assertEqual(enzymes.genes('1.1.1.1'), ['g2', 'g1'])
+        self.assertEqual(enzymes.genes('1.1.1.5'), ['g1'])
+        self.assertEqual(enzymes.genes('2.7.1.n1'), ['g3'])
+        self.assertEqual(enzymes.genes('3.1.1.1'), [])
+
+    def test_malformed_keys_are_rejected(self):
+        for key in ('1.1.1.1.1', '1.1.1.1abc', '1.1.1', 'EC 1.1.1.1'):
+            with self.assertRaises(SystemExit):
+                enzymeAssignment.AssignedEnzymeDict({key: ['g1']})
+
+
+class ECTrieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = enzymeAssignment.ECTrie({'1.1.1.1': ['R1', 'R2'], '1.1.1.2': ['R3'], '1.1.2.1': ['R2'],
+                                             '1.1.1.-': ['R4'], '2.7.1.n1': ['R5']})
+
+    def test_match(self):
+        self.assertEqual(self.trie.match('1.1.1.1'), ['R1', 'R2'])
+        self.assertEqual(self.trie.match('1.1.1.-'), ['R1', 'R2', 'R3', 'R4'])
+        self.assertEqual(self.trie.match('1.-.-.-'), ['R1', 'R2', 'R3', 'R4'])
+        self.assertEqual(self.trie.match('2.7.1.n1'), ['R5'])
+        self.assertEqual(self.trie.match('3.1.1.1'), [])
+
+    def test_ec_numbers(self):
+        self.assertEqual(self.trie.ec_numbers('1.1.-.-'), ['1.1.1.1', '1.1.1.2', '1.1.1.-', '1.1.2.1'])
+        self.assertEqual(len(self.trie), 5)
+
+    def test_malformed_ec_number(self):
+        with self.assertRaises(ValueError):
+            self.trie.add('1.1.1', 'R6')
+
+
+if __name__ == '__main__':
+    unittest.main()
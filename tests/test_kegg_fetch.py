@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+import transport
+from databaseExtraction import keggExtractor
+from interfaces.enzymeAssignment import AssignedEnzymeDict
+
+reaction_entry = """ENTRY       R00001                      Reaction
+NAME        Polyphosphate polyphosphohydrolase
+EQUATION    C00404 + n C00001 <=> (n+1) C02174
+///
+"""
+
+# The entries of a small KEGG network, as returned by KEGG REST and kept in the ligand flat files
+enzyme_entries = {'1.1.1.1': """ENTRY       EC 1.1.1.1                  Enzyme
+NAME        alcohol dehydrogenase
+ALL_REAC    R00754 R00755
+///
+"""}
+reaction_entries = {'R00754': """ENTRY       R00754                      Reaction
+NAME        ethanol:NAD+ oxidoreductase
+EQUATION    C00469 + C00003 <=> C00084 + C00004 + C00080
+///
+""", 'R00755': """ENTRY       R00755                      Reaction
+NAME        acetaldehyde:NADP+ oxidoreductase
+EQUATION    C00084 + C00005 <=> C00469 + 2 C00006
+DBLINKS     RHEA: 10001
+///
+"""}
+compound_entries = dict((compound_id, """ENTRY       %s                      Compound
+NAME        %s
+FORMULA     C%dH6O
+DBLINKS     ChEBI: %d
+///
+""" % (compound_id, compound_id.lower(), i, 16000 + i)) for i, compound_id in enumerate(
+    ('C00469', 'C00003', 'C00084', 'C00004', 'C00080', 'C00005', 'C00006', 'C00007', 'C00008', 'C00009', 'C00010',
+     'C00011')))
+
+
+class CassetteTest(unittest.TestCase):
+    """
+    KEGG REST responses are replayed from a cassette
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cassette = transport.Cassette(os.path.join(self.path, 'cassette'))
+        self.shared = transport.transport()
+        transport.configure(cassette=self.cassette.path, cassette_mode='replay')
+
+    def tearDown(self):
+        transport._transport = self.shared
+        shutil.rmtree(self.path)
+
+    def record(self, entry_ids, status_code, body):
+        url = keggExtractor.kegg_url % '+'.join(entry_ids)
+        key = self.cassette.key(url, None)
+        with open(key + '.body', 'w') as f:
+            f.write(body)
+        with open(key + '.json', 'w') as f:
+            json.dump({'url': url, 'status_code': status_code, 'headers': {}}, f)
+
+    def record_entries(self, entries, entry_ids):
+        self.record(entry_ids, 200, ''.join(entries[entry_id] for entry_id in entry_ids))
+
+    def extractor(self, **kwargs):
+        return keggExtractor.KeggExtraction(enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}), **kwargs)
+
+
+class BatchFetchTest(CassetteTest):
+    """
+    Entries fetched in multi-entry calls are the entries fetched one at a time, and the pipelined prefetch
+    extracts the same network as the flat files of a KEGG mirror
+    """
+
+    def test_batched_entries_are_single_entries(self):
+        compound_ids = list(compound_entries)
+        self.record_entries(compound_entries, compound_ids[:keggExtractor.kegg_batch_size])
+        self.record_entries(compound_entries, compound_ids[keggExtractor.kegg_batch_size:])
+        batched = self.extractor()
+        batched.fetch_entries(compound_ids)
+
+        single = self.extractor()
+        for compound_id in compound_ids:
+            self.record_entries(compound_entries, [compound_id])
+            single.fetch_entries([compound_id])
+        self.assertEqual(batched.kegg_entries, single.kegg_entries)
+        self.assertEqual(batched.kegg_entries['C00084']['DBLINKS'], ['ChEBI: 16002'])
+
+    def test_prefetch_matches_mirror(self):
+        self.record_entries(enzyme_entries, ['1.1.1.1'])
+        self.record_entries(reaction_entries, ['R00754', 'R00755'])
+        self.record_entries(compound_entries, ['C00469', 'C00003', 'C00084', 'C00004', 'C00080', 'C00005',
+                                               'C00006'])
+        fetched = self.extractor(kegg_workers=2)
+        fetched.get_reactions()
+
+        mirror_path = os.path.join(self.path, 'mirror')
+        os.mkdir(mirror_path)
+        for name, entries in (('enzyme', enzyme_entries), ('reaction', reaction_entries),
+                              ('compound', compound_entries)):
+            with open(os.path.join(mirror_path, name), 'w') as f:
+                f.write(''.join(entries.values()))
+        mirrored = self.extractor(kegg_mirror=mirror_path)
+        mirrored.get_reactions()
+
+        self.assertEqual(list(fetched.reactions), ['R00754', 'R00755'])
+        self.assertEqual(dict(fetched.reactions), dict(mirrored.reactions))
+        self.assertEqual(dict(fetched.metabolites), dict(mirrored.metabolites))
+        self.assertEqual(fetched.reactions['R00755']['STOICHIOMETRY'],
+                         {'C00084': 1, 'C00005': 1, 'C00469': 1, 'C00006': 2})
+
+
+class KeggFetchTest(CassetteTest):
+    """
+    Only the entries KEGG returned are cached
+    """
+
+    def setUp(self):
+        super(KeggFetchTest, self).setUp()
+        self.cached = self.extractor(kegg_cache=os.path.join(self.path, 'kegg.sqlite'), kegg_release='1')
+
+    def test_error_status_is_not_cached(self):
+        self.record(['R00001'], 503, 'Service Unavailable')
+        self.assertRaises(requests.HTTPError, self.cached.fetch_entries, ['R00001'])
+        self.assertEqual(self.cached.entry_cache.get_many(['R00001']), {})
+        self.assertNotIn('R00001', self.cached.kegg_entries)
+
+        self.record(['R00001'], 200, reaction_entry)
+        entry = self.cached.kegg_entry('R00001')
+        self.assertEqual(self.cached.reaction_equation(reaction_id='R00001', reaction_kegg_entry=entry).ids,
+                         ('C00404', 'C00001', 'C02174'))
+        self.assertEqual(self.cached.entry_cache.get_many(['R00001']), {'R00001': entry})
+
+    def test_error_page_is_not_parsed(self):
+        self.record(['R00001'], 403, '<html><body>Forbidden</body></html>')
+        self.assertRaises(requests.HTTPError, self.cached.fetch_entries, ['R00001'])
+        self.assertEqual(self.cached.entry_cache.get_many(['R00001']), {})
+
+    def test_not_found(self):
+        self.record(['R99999'], 404, '')
+        self.assertEqual(self.cached.kegg_entry('R99999'), {})
+        self.assertEqual(self.cached.entry_cache.get_many(['R99999']), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
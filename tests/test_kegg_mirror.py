@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from databaseExtraction import keggExtractor
+from interfaces.enzymeAssignment import AssignedEnzymeDict
+from kegg import mirror
+
+flat_files = {
+    'enzyme': """ENTRY       EC 1.1.1.1                  Enzyme
+NAME        alcohol dehydrogenase
+ALL_REAC    R00754
+///
+""",
+    'reaction': """ENTRY       R00754                      Reaction
+NAME        ethanol:NAD+ oxidoreductase
+EQUATION    C00469 + C00003 <=> C00084 + C00004 + C00080
+///
+""",
+    'compound': "".join("""ENTRY       %s                      Compound
+NAME        %s
+FORMULA     C2H6O
+DBLINKS     ChEBI: 16236
+///
+""" % (compound_id, compound_id.lower()) for compound_id in ('C00469', 'C00003', 'C00084', 'C00004', 'C00080'))}
+
+
+class KeggMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for name, text in flat_files.items():
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get_reactions(self):
+        extractor = keggExtractor.KeggExtraction(enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}),
+                                                 kegg_mirror=self.path)
+        extractor.get_reactions()
+        self.assertEqual(list(extractor.reactions), ['R00754'])
+        self.assertEqual(sorted(extractor.metabolites), ['C00003', 'C00004', 'C00080', 'C00084', 'C00469'])
+        self.assertEqual(extractor.metabolites['C00469']['DB_LINKS'], {'KEGG': 'C00469', 'ChEBI': '16236'})
+
+    def test_files_are_closed(self):
+        with mirror.Mirror(self.path) as kegg_mirror:
+            flat_file = kegg_mirror.flat_file('R00754')
+            self.assertEqual(flat_file.lines('R00754')[0].split()[:2], ['ENTRY', 'R00754'])
+        self.assertTrue(flat_file._file.closed)
+        # A closed mirror opens its files again
+        self.assertEqual(kegg_mirror.lines('C00469')[1], 'NAME        c00469')
+        kegg_mirror.close()
+
+    def test_missing_flat_file(self):
+        os.remove(os.path.join(self.path, 'compound'))
+        self.assertRaises(FileNotFoundError, mirror.Mirror, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
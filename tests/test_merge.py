@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import libsbml
+    from interfaces.enzymeAssignment import AssignedEnzymeDict
+    from network_merging import canonical, merge, metanetx
+except ImportError:
+    libsbml = None
+
+water_inchikey = 'XLYOFNOQVPJJNP-UHFFFAOYSA-N'
+
+mnxref_tables = {
+    'reac_xref': ['### MNXref Version 4.4 ###', 'kegg:R00001\tMNXR1', 'kegg:R00002\tMNXR2'],
+    'reac_prop': ['### MNXref Version 4.4 ###',
+                  'MNXR1\t1 MNXM99@MNXD1 = 1 MNXM2@MNXD1\tR00001\ttrue\t1.1.1.1\tkegg:R00001',
+                  'MNXR2\t1 MNXM4@MNXD1 = 1 MNXM5@MNXD1\tR00002\ttrue\t2.7.1.1\tkegg:R00002'],
+    'chem_xref': ['### MNXref Version 4.4 ###', 'kegg:C00001\tMNXM1', 'kegg:C00002\tMNXM2',
+                  'kegg:C00003\tMNXM3', 'chebi:3303\tMNXM3'],
+    'chem_prop': ['### MNXref Version 4.4 ###',
+                  'MNXM1\tH2O\tH2O\t0\t18.0\tInChI=1S/H2O/h1H2\tO\tkegg:C00001\t' + water_inchikey,
+                  'MNXM2\tB\tC2\t0\t24.0\t\t\tkegg:C00002\tBQJCRHHNABKAKU-KBQPJGBKSA-N',
+                  'MNXM3\tC\tC3\t0\t36.0\t\t\tkegg:C00003\tCSNNHWWHGAXBCP-UHFFFAOYSA-L',
+                  'MNXM99\twater\tH2O\t0\t18.0\tInChI=1S/H2O/h1H2\tO\tchebi:15377\t' + water_inchikey]}
+
+sbml_model = """<?xml version="1.0" encoding="UTF-8"?>
+<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" level="3" version="1">
+  <model id="test">
+    <listOfCompartments>
+      <compartment id="c" constant="true"/>
+    </listOfCompartments>
+    <listOfSpecies>
+%s
+    </listOfSpecies>
+    <listOfReactions>
+%s
+    </listOfReactions>
+  </model>
+</sbml>
+"""
+
+sbml_species = """      <species id="%s" name="%s" compartment="c" hasOnlySubstanceUnits="false" boundaryCondition="false"
+               constant="false">
+        <notes><body xmlns="http://www.w3.org/1999/xhtml"><p>KEGG: %s</p></body></notes>
+      </species>"""
+
+sbml_reaction = """      <reaction id="%s" reversible="true" fast="false">
+        <notes><body xmlns="http://www.w3.org/1999/xhtml">%s</body></notes>
+        <listOfReactants><speciesReference species="%s" stoichiometry="1" constant="true"/></listOfReactants>
+        <listOfProducts><speciesReference species="%s" stoichiometry="1" constant="true"/></listOfProducts>
+      </reaction>"""
+
+
+def write_inputs(path):
+    """
+    Write the MNXref tables and a model with a mapped and an unmapped reaction
+    :return: the MNXref directory and the model file
+    """
+    mnxref_path = os.path.join(path, 'mnxref')
+    os.mkdir(mnxref_path)
+    for table, lines in mnxref_tables.items():
+        with open(os.path.join(mnxref_path, table + '.tsv'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    species = '\n'.join([sbml_species % ('s_water', 'water', 'C00001'), sbml_species % ('s_b', 'b', 'C00002'),
+                         sbml_species % ('s_c', 'c', 'C00003')])
+    reactions = '\n'.join([
+        sbml_reaction % ('R00001', '<p>KEGG: R00001</p><p>SUBSYSTEM: p1</p>', 's_water', 's_b'),
+        sbml_reaction % ('RXN1', '<p>ENZYME: 2.7.1.1</p>', 's_water', 's_c')])
+    sbml_file = os.path.join(path, 'model.xml')
+    with open(sbml_file, 'w') as f:
+        f.write(sbml_model % (species, reactions))
+    return mnxref_path, sbml_file
+
+
+@unittest.skipIf(libsbml is None, 'libsbml is not installed')
+class CanonicalSpeciesTest(unittest.TestCase):
+    """
+    MNXref lists water as MNXM1 and MNXM99. The reaction mapped to MNXR1 uses MNXM99, the unmapped reaction uses a
+    species resolved to MNXM1: the merged model has a single water species, shared by both reactions
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        mnxref_path, sbml_file = write_inputs(self.path)
+        self.merger = merge.NetworkMerger(path=self.path, enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}),
+                                          mnxref_path=mnxref_path, files=[sbml_file])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_mapped_and_unmapped_reactions_share_one_species(self):
+        self.assertEqual(self.merger.merged_reactions, {'MNXR1'})
+        self.assertEqual(len(self.merger.fingerprint_reactions), 1)
+        self.assertEqual(sorted(self.merger.metabolites), ['MNXM1', 'MNXM2', 'MNXM3'])
+        fingerprint_reaction = [r for r in self.merger.reactions.values() if r['ID'] != 'MNXR1'][0]
+        self.assertIn('MNXM1', self.merger.reactions['MNXR1']['SUBSTRATES'])
+        self.assertIn('MNXM1', list(fingerprint_reaction['SUBSTRATES']) + list(fingerprint_reaction['PRODUCTS']))
+
+
+@unittest.skipIf(libsbml is None, 'libsbml is not installed')
+class LazyLoadTest(unittest.TestCase):
+    """
+    With mnxref_lazy, only the MNXref rows reachable from the model are loaded, and the merge is the same
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.mnxref_path, self.sbml_file = write_inputs(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def merger(self, **kwargs):
+        return merge.NetworkMerger(path=self.path, enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}),
+                                   mnxref_path=self.mnxref_path, files=[self.sbml_file], **kwargs)
+
+    def test_lazy_merge_is_the_same(self):
+        eager = self.merger()
+        for kwargs in ({'mnxref_lazy': True}, {'mnxref_lazy': True, 'sbml_stream': True}):
+            lazy = self.merger(**kwargs)
+            self.assertEqual(set(lazy.metanetx_dict.reactions), {'MNXR1'}, kwargs)
+            self.assertNotIn('kegg:R00002', lazy.metanetx_dict.reactions_xref)
+            self.assertNotIn('MNXM4', lazy.metanetx_dict.metabolites)
+            self.assertEqual(lazy.merged_reactions, eager.merged_reactions)
+            self.assertEqual(lazy.reactions, eager.reactions)
+            self.assertEqual(lazy.metabolites, eager.metabolites)
+
+@unittest.skipIf(libsbml is None, 'libsbml is not installed')
+class SpeciesXrefTest(unittest.TestCase):
+    """
+    Species cross references only resolve within their own database: PubChem 3303 is not ChEBI 3303
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for table, lines in mnxref_tables.items():
+            with open(os.path.join(self.path, table + '.tsv'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        self.canonicalizer = canonical.MetaboliteCanonicalizer(metanetx.MetaNetXDict(mnxref_path=self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_databases_sharing_an_id(self):
+        self.assertEqual(self.canonicalizer.canonical_id(merge.species_xrefs('s1', {'ChEBI': '3303'})), 'MNXM3')
+        self.assertIsNone(self.canonicalizer.canonical_id(merge.species_xrefs('s2', {'PubChem': '3303'})))
+        self.assertEqual(self.canonicalizer.canonical_id(
+            merge.species_xrefs('s3', {'PubChem': '3303', 'KEGG': 'C00002'})), 'MNXM2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import libsbml
+    from interfaces.enzymeAssignment import AssignedEnzymeDict
+    from sbmlExtraction.metacyc_SBMLExtractor import MetaCycSBMLExtraction
+except ImportError:
+    libsbml = None
+
+# The reactions are declared before the species they reference
+sbml_model = """<?xml version="1.0" encoding="UTF-8"?>
+<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" level="3" version="1">
+  <model id="metacyc" name="MetaCyc">
+    <listOfCompartments>
+      <compartment id="c" constant="true"/>
+    </listOfCompartments>
+    <listOfReactions>
+      <reaction id="RXN1" name="rxn1" reversible="false" fast="false">
+        <notes><body xmlns="http://www.w3.org/1999/xhtml"><p>EC Number: EC-1.1.1.1</p></body></notes>
+        <listOfReactants><speciesReference species="ETOH" stoichiometry="1" constant="true"/></listOfReactants>
+        <listOfProducts><speciesReference species="ACETALD" stoichiometry="2" constant="true"/></listOfProducts>
+      </reaction>
+    </listOfReactions>
+    <listOfSpecies>
+      <species id="ETOH" name="ethanol" compartment="c" hasOnlySubstanceUnits="false" boundaryCondition="false"
+               constant="false">
+        <notes><body xmlns="http://www.w3.org/1999/xhtml"><p>BIOCYC: ETOH</p><p>CHARGE: 0</p></body></notes>
+      </species>
+      <species id="ACETALD" name="acetaldehyde" compartment="c" hasOnlySubstanceUnits="false"
+               boundaryCondition="false" constant="false"/>
+    </listOfSpecies>
+  </model>
+</sbml>
+"""
+
+
+@unittest.skipIf(libsbml is None, 'libsbml is not installed')
+class MetaCycStreamTest(unittest.TestCase):
+    """
+    With sbml_stream, species are read from the file wherever they are declared, and sbml_file is never used
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.sbml_file = os.path.join(self.path, 'metacyc.xml')
+        with open(self.sbml_file, 'w') as f:
+            f.write(sbml_model)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_species_declared_after_reaction(self):
+        extractor = MetaCycSBMLExtraction(enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}),
+                                          sbml_file=self.sbml_file, sbml_stream=True)
+        self.assertIsNone(extractor.sbml_file)
+        extractor.get_reactions()
+        self.assertEqual(list(extractor.reactions), ['RXN1'])
+        self.assertEqual(sorted(extractor.metabolites), ['ACETALD', 'ETOH'])
+        self.assertEqual(extractor.metabolites['ETOH']['NAME'], ['ethanol'])
+        self.assertEqual(extractor.reactions['RXN1']['GENE_ASSOCIATION'], ['g1'])
+
+    def test_undeclared_species(self):
+        with open(self.sbml_file, 'w') as f:
+            f.write(sbml_model.replace('species="ACETALD"', 'species="MISSING"'))
+        extractor = MetaCycSBMLExtraction(enzymes=AssignedEnzymeDict({'1.1.1.1': ['g1']}),
+                                          sbml_file=self.sbml_file, sbml_stream=True)
+        self.assertRaisesRegex(ValueError, 'MISSING', extractor.get_reactions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import transport
+from network_merging import merge, metanetx
+
+reac_xref = ['### MNXref Version 4.4 ###', 'kegg.reaction:R00001\tMNXR1', 'rhea:10000\tMNXR2',
+             'sabiork.reaction:10000\tMNXR3']
+
+
+class XrefKeyTest(unittest.TestCase):
+    """
+    reac_xref and chem_xref are keyed by database and xref, so the same id in two databases is never confused
+    """
+
+    def test_xref_rows(self):
+        self.assertEqual(list(metanetx.xref_rows(['kegg.compound:C00001\tMNXM1', 'keggC:C00002\tMNXM2',
+                                                  'chebi:3303\tMNXM3'])),
+                         [('kegg:C00001', {'MNXR': 'MNXM1', 'DB': 'kegg.compound:C00001'}),
+                          ('kegg:C00002', {'MNXR': 'MNXM2', 'DB': 'keggC:C00002'}),
+                          ('chebi:3303', {'MNXR': 'MNXM3', 'DB': 'chebi:3303'})])
+        self.assertEqual(metanetx.xref_key('BIOCYC', 'WATER'), 'metacyc:WATER')
+        self.assertEqual(metanetx.db_link('kegg:R00001'), ('KEGG', 'R00001'))
+
+    def test_reactions_sharing_an_id(self):
+        reactions_xref = metanetx.MetaNetXDict.load_xref(reac_xref)
+        reactions = [('r1', {'SABIORK': '10000', 'SUBSYSTEM': 'p1'}, [], 'r1'),
+                     ('R00001', {'KEGG': 'R00001', 'SUBSYSTEM': 'p2'}, [], 'r2'),
+                     ('10000', {'PUBCHEM': '10000', 'SUBSYSTEM': 'p3'}, [], 'r3')]
+        _mnxrids, _no_mnxrids, pathways = merge.resolve_reactions(reactions, reactions_xref)
+        self.assertEqual(set(_mnxrids), {'MNXR1', 'MNXR3'})
+        self.assertEqual([r[0] for r in _no_mnxrids], ['10000'])
+
+
+filter_tables = {
+    'reac_xref': ['### MNXref Version 4.4 ###', 'kegg:R00001\tMNXR1', 'rhea:10001\tMNXR1', 'kegg:R00002\tMNXR2',
+                  'rhea:10002\tMNXR2', 'kegg:R00003\tMNXR3'],
+    'reac_prop': ['### MNXref Version 4.4 ###',
+                  'MNXR1\t1 MNXM1@MNXD1 + 1 MNXM2@MNXD1 = 1 MNXM3@MNXD1\tR00001\ttrue\t1.1.1.1\tkegg:R00001',
+                  'MNXR2\t1 MNXM4@MNXD1 = 1 MNXM5@MNXD1\tR00002\ttrue\t1.1.1.2\tkegg:R00002',
+                  'MNXR3\t2 MNXM1@MNXD1 = 1 MNXM6@MNXD1\tR00003\ttrue\t1.1.1.1\tkegg:R00003'],
+    'chem_xref': ['### MNXref Version 4.4 ###'] + ['kegg:C0000%d\tMNXM%d' % (i, i) for i in range(1, 8)] + [
+        'chebi:15377\tMNXM1', 'chebi:7\tMNXM7'],
+    'chem_prop': ['### MNXref Version 4.4 ###'] + ['MNXM%d\tm%d\tC%d\t0\t12.0\t\t\tkegg:C0000%d\t' % (i, i, i, i)
+                                                 for i in range(1, 8)]}
+
+
+class FilteredLoadTest(unittest.TestCase):
+    """
+    With reaction_keys, only the rows reachable from those keys are loaded, and they are the rows a full load has
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for table, lines in filter_tables.items():
+            with open(os.path.join(self.path, table + '.tsv'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        self.full = metanetx.MetaNetXDict(mnxref_path=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assertRowsOf(self, filtered, keys):
+        for table in ('reactions_xref', 'reactions', 'metabolites_xref', 'metabolites'):
+            self.assertEqual(set(getattr(filtered, table)), keys[table], table)
+            for key in keys[table]:
+                self.assertEqual(getattr(filtered, table)[key], getattr(self.full, table)[key])
+
+    def test_reachable_rows(self):
+        for columnar in (False, True):
+            filtered = metanetx.MetaNetXDict(mnxref_path=self.path, reaction_keys={'kegg:R00001', 'MNXR3'},
+                                             metabolite_keys={'chebi:7'}, columnar=columnar)
+            self.assertRowsOf(filtered, {
+                'reactions_xref': {'kegg:R00001', 'rhea:10001', 'kegg:R00003'},
+                'reactions': {'MNXR1', 'MNXR3'},
+                'metabolites_xref': {'kegg:C00001', 'kegg:C00002', 'kegg:C00003', 'kegg:C00006', 'kegg:C00007',
+                                     'chebi:15377', 'chebi:7'},
+                'metabolites': {'MNXM1', 'MNXM2', 'MNXM3', 'MNXM6', 'MNXM7'}})
+            self.assertEqual(sorted(filtered.reaction_xref_index['MNXR1']),
+                             sorted(self.full.reaction_xref_index['MNXR1']))
+            self.assertEqual(sorted(filtered.metabolite_xref_index['MNXM1']),
+                             sorted(self.full.metabolite_xref_index['MNXM1']))
+            self.assertEqual(sorted(filtered.ec_index.match('1.1.1.1')), ['MNXR1', 'MNXR3'])
+            self.assertNotIn('1.1.1.2', filtered.ec_index)
+
+    def test_unknown_keys(self):
+        filtered = metanetx.MetaNetXDict(mnxref_path=self.path, reaction_keys={'kegg:R99999', 'rhea:10000'})
+        self.assertRowsOf(filtered, dict.fromkeys(['reactions_xref', 'reactions', 'metabolites_xref', 'metabolites'],
+                                                  set()))
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.mnxref_path = os.path.join(self.path, 'mnxref')
+        os.mkdir(self.mnxref_path)
+        for table, lines in (('reac_xref', reac_xref), ('reac_prop', []), ('chem_xref', []), ('chem_prop', [])):
+            with open(os.path.join(self.mnxref_path, table + '.tsv'), 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_store_keys(self):
+        store = metanetx.open_store(self.path, '4.4', self.mnxref_path)
+        self.assertEqual(store.reactions_xref['sabiork:10000']['MNXR'], 'MNXR3')
+        self.assertNotIn('10000', store.reactions_xref)
+
+    def test_older_store_format_is_compiled_again(self):
+        store = metanetx.open_store(self.path, '4.4', self.mnxref_path)
+        store.connection.execute("DELETE FROM meta WHERE KEY = 'format'")
+        store.connection.commit()
+        store.connection.close()
+        self.assertEqual(metanetx.MNXrefStore(store.path).format, '1')
+        self.assertEqual(metanetx.open_store(self.path, mnxref_path=self.mnxref_path).format,
+                         metanetx.store_format)
+
+
+class ReleaseKeyTest(unittest.TestCase):
+    """
+    The merge cache key of MNXref tables is the same when they are streamed, downloaded or read from local copies
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.mnxref_path = os.path.join(self.path, 'mnxref')
+        cassette = transport.Cassette(os.path.join(self.path, 'cassette'))
+        key = cassette.key(metanetx.reac_xref_url, None)
+        with open(key + '.body', 'w') as f:
+            f.write('\n'.join(reac_xref) + '\n')
+        with open(key + '.json', 'w') as f:
+            json.dump({'url': metanetx.reac_xref_url, 'status_code': 200, 'headers': {}}, f)
+        self.shared = transport.transport()
+        transport.configure(cassette=cassette.path, cassette_mode='replay')
+
+    def tearDown(self):
+        transport._transport = self.shared
+        shutil.rmtree(self.path)
+
+    def test_downloaded_tables_keep_their_key(self):
+        streamed = metanetx.release_key(self.mnxref_path)
+        self.assertEqual(streamed, 'MNXref 4.4')
+        transport.download(metanetx.reac_xref_url, os.path.join(self.mnxref_path + '.tmp'))
+        os.mkdir(self.mnxref_path)
+        os.replace(self.mnxref_path + '.tmp', os.path.join(self.mnxref_path, 'reac_xref.tsv'))
+        self.assertEqual(metanetx.release_key(self.mnxref_path), streamed)
+        os.utime(os.path.join(self.mnxref_path, 'reac_xref.tsv'), (0, 0))
+        self.assertEqual(metanetx.release_key(self.mnxref_path), streamed)
+
+    def test_local_tables_without_a_release(self):
+        os.mkdir(self.mnxref_path)
+        with open(os.path.join(self.mnxref_path, 'reac_xref.tsv'), 'w') as f:
+            f.write('\n'.join(reac_xref[1:]) + '\n')
+        self.assertRegex(metanetx.release_key(self.mnxref_path), r'^reac_xref\.tsv:\d+:\d+$')
+
+
+if __name__ == '__main__':
+    unittest.main()
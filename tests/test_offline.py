@@ -0,0 +1,21 @@
+import unittest
+
+import transport
+from kegg import cache
+
+
+class OfflineTest(unittest.TestCase):
+
+    def test_offline_transport_does_not_call_the_network(self):
+        with self.assertRaises(transport.OfflineError):
+            transport.Transport(offline=True).get('http://rest.kegg.jp/info/kegg')
+
+    def test_release(self):
+        self.assertEqual(cache.parse_release('kegg             Release 106.0+/04-18, Apr 23'), '106.0+/04-18')
+
+    def test_unparsable_release_falls_back_to_a_dated_key(self):
+        self.assertRegex(cache.parse_release('unexpected output'), r'^date-\d{4}-\d{2}-\d{2}$')
+
+
+if __name__ == '__main__':
+    unittest.main()
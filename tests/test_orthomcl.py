@@ -0,0 +1,50 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+import transport
+from enzymeAssignment.orthoMCL import OrthoMCL
+
+group_url = 'http://www.orthomcl.org/webservices/GroupQuestions/ByNameList.xml?group_names_data=%s&o-fields=ec_numbers'
+group_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<response><recordset><record><field name="ec_numbers">1.1.1.1 (2); 2.7.1.- (1)</field></record></recordset></response>
+"""
+
+
+class OrthoMCLTest(unittest.TestCase):
+    """
+    OrthoMCL REST responses are replayed from a cassette
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cassette = transport.Cassette(self.path)
+        self.shared = transport.transport()
+        transport.configure(cassette=self.path, cassette_mode='replay')
+
+    def tearDown(self):
+        transport._transport = self.shared
+        shutil.rmtree(self.path)
+
+    def record(self, group, status_code, body):
+        key = self.cassette.key(group_url % group, None)
+        with open(key + '.body', 'w') as f:
+            f.write(body)
+        with open(key + '.json', 'w') as f:
+            json.dump({'url': group_url % group, 'status_code': status_code, 'headers': {}}, f)
+
+    def test_ec_numbers(self):
+        self.record('OG5_126538', 200, group_xml)
+        self.assertEqual(OrthoMCL.get_ec_numbers_for_orthoMCL_group('OG5_126538'), ['1.1.1.1', '2.7.1.-'])
+
+    def test_error_status(self):
+        self.record('OG5_126538', 500, '<html><body>Internal Server Error</body></html>')
+        self.assertRaises(requests.HTTPError, OrthoMCL.get_ec_numbers_for_orthoMCL_group, 'OG5_126538')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import tools
+from sbml import reader
+
+try:
+    import libsbml
+except ImportError:
+    libsbml = None
+
+
+def model_text(species, reactions, seed=1):
+    """
+    A SBML model generated with a fixed seed, with its parts out of the usual order: the reactions come before the
+    species, between unit definitions and a second compartment list, and the model has notes and an annotation
+    Notes hold entities, non-ASCII characters, markup inside paragraphs and values with ': '
+    """
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<sbml xmlns="http://www.sbml.org/sbml/level3/version1/core" level="3" version="1">',
+             '  <model id="large" name="Large &amp; out of order">',
+             '    <notes><body xmlns="http://www.w3.org/1999/xhtml"><p>SOURCE: test</p></body></notes>',
+             '    <annotation><data xmlns="http://example.org/data"><species id="not_a_species"/></data>'
+             '</annotation>',
+             '    <listOfUnitDefinitions><unitDefinition id="mmol"><listOfUnits>'
+             '<unit kind="mole" exponent="1" scale="-3" multiplier="1"/></listOfUnits></unitDefinition>'
+             '</listOfUnitDefinitions>',
+             '    <listOfReactions>']
+    for i in range(reactions):
+        participants = rng.sample(range(species), rng.randint(2, 5))
+        split = rng.randint(1, len(participants) - 1)
+        lines.append('      <reaction id="R_%d" name="reaction %d%s" reversible="%s" fast="false">' % (
+            i, i, rng.choice(['', ' &lt;b&gt;', ' →']), rng.choice(['true', 'false'])))
+        lines.append('        <notes><body xmlns="http://www.w3.org/1999/xhtml"><p>ENZYME: 1.1.1.%d</p>'
+                     '<p><b>KEGG</b>: R%05d</p><p>SUBSYSTEM: urea &amp; amino acids || p%d</p>'
+                     '<p>NOTE: a: b</p><p>no separator</p></body></notes>' % (i % 50, i, i % 30))
+        for element, side in (('listOfReactants', participants[:split]), ('listOfProducts', participants[split:])):
+            lines.append('        <%s>%s</%s>' % (element, ''.join(
+                '<speciesReference species="M_%d" stoichiometry="%s" constant="true"/>' % (
+                    m, rng.choice(['1', '2', '0.5', '1.25'])) for m in side), element))
+        lines.append('      </reaction>')
+    lines.append('    </listOfReactions>')
+    lines.append('    <listOfSpecies>')
+    for i in range(species):
+        lines.append('      <species id="M_%d" name="metabolite %d%s" compartment="%s" hasOnlySubstanceUnits="false" '
+                     'boundaryCondition="false" constant="false">' % (i, i, rng.choice(['', ' &amp; ion', ' α']),
+                                                                      rng.choice('cep')))
+        if rng.random() < 0.9:
+            lines.append('        <notes><body xmlns="http://www.w3.org/1999/xhtml"><p>CHARGE: %d</p>'
+                         '<p>KEGG: C%05d</p><p>INCHI: InChI=1S/C%dH4O2</p></body></notes>' % (i % 3 - 1, i, i % 9))
+        lines.append('      </species>')
+    lines.append('    </listOfSpecies>')
+    lines.append('    <listOfCompartments>%s</listOfCompartments>' % ''.join(
+        '<compartment id="%s" constant="true"/>' % c for c in 'cep'))
+    lines.append('  </model>')
+    lines.append('</sbml>')
+    return '\n'.join(lines) + '\n'
+
+
+@unittest.skipIf(libsbml is None, 'libsbml is not installed')
+class ReaderTest(unittest.TestCase):
+    """
+    A large model with its reactions before its species reads with iter_model as libsbml reads it
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        text = model_text(species=2000, reactions=4000)
+        cls.file = os.path.join(cls.path, 'model.xml')
+        with open(cls.file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        with gzip.open(cls.file + '.gz', 'wt', encoding='utf-8') as f:
+            f.write(text)
+        document = libsbml.readSBMLFromString(text)
+        assert document.getNumErrors(libsbml.LIBSBML_SEV_ERROR) == 0
+        cls.document = document
+        cls.model = document.getModel()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+
+    def assertSpeciesEqual(self, species):
+        self.assertEqual([s.getId() for s in species], [s.getId() for s in self.model.getListOfSpecies()])
+        for streamed, expected in zip(species, self.model.getListOfSpecies()):
+            self.assertEqual(streamed.getName(), expected.getName())
+            self.assertEqual(streamed.getCompartment(), expected.getCompartment())
+            self.assertEqual(streamed.notes, tools.notes2dict(expected.getNotesString()))
+
+    def assertReactionsEqual(self, reactions):
+        self.assertEqual([r.getId() for r in reactions], [r.getId() for r in self.model.getListOfReactions()])
+        for streamed, expected in zip(reactions, self.model.getListOfReactions()):
+            self.assertEqual(streamed.getName(), expected.getName())
+            self.assertEqual(streamed.getReversible(), expected.getReversible())
+            self.assertEqual(streamed.notes, tools.notes2dict(expected.getNotesString()))
+            for side in ('getListOfReactants', 'getListOfProducts'):
+                self.assertEqual([(ref.getSpecies(), ref.getStoichiometry()) for ref in getattr(streamed, side)()],
+                                 [(ref.getSpecies(), ref.getStoichiometry()) for ref in getattr(expected, side)()])
+
+    def test_iter_model(self):
+        for path in (self.file, self.file + '.gz'):
+            elements = list(reader.iter_model(path))
+            self.assertEqual([e.getElementName() for e in elements], ['reaction'] * 4000 + ['species'] * 2000)
+            self.assertReactionsEqual(elements[:4000])
+            self.assertSpeciesEqual(elements[4000:])
+
+    def test_iter_species_and_reactions(self):
+        self.assertSpeciesEqual(list(reader.iter_species(self.file + '.gz')))
+        self.assertReactionsEqual(list(reader.iter_reactions(self.file)))
+
+    def test_notes(self):
+        reaction = next(reader.iter_reactions(self.file))
+        self.assertEqual(reaction.notes['KEGG'], 'R00000')
+        self.assertEqual(reaction.notes['SUBSYSTEM'], 'urea & amino acids || p0')
+        self.assertEqual(reaction.notes['NOTE'], 'a: b')
+        self.assertNotIn('no separator', reaction.notes)
+
+    def test_model_header(self):
+        for path in (self.file, self.file + '.gz'):
+            self.assertEqual(reader.model_id(path), 'large')
+            model_id, name, notes, notes_keys = reader.model_header(path)
+            self.assertEqual((model_id, name, notes), ('large', 'Large & out of order', {'SOURCE': 'test'}))
+            self.assertEqual(notes_keys, {'ENZYME', 'KEGG', 'SUBSYSTEM', 'NOTE'})
+
+
+if __name__ == '__main__':
+    unittest.main()
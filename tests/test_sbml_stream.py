@@ -0,0 +1,168 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import tools
+
+try:
+    import libsbml
+    from interfaces.databaseExtraction import MetaboliteDict, ReactionDict
+    from sbml import sbml
+except ImportError:
+    libsbml = None
+
+
+class Extractor:
+    """
+    The reactions and metabolites sbml.build_sbml reads from a DatabaseExtraction
+    """
+
+    def __init__(self, reactions, metabolites):
+        self.reactions = reactions
+        self.metabolites = metabolites
+
+    def database_name(self):
+        return 'Test'
+
+
+def metabolite(metabolite_id, name, **kwargs):
+    m = {'ID': metabolite_id, 'NAME': [name], 'COMPARTMENT': 'c', 'CHARGE': 'NA', 'FORMULA': 'NA', 'INCHI': 'NA',
+         'INCHIKEY': 'NA', 'SMILES': 'NA', 'DB_LINKS': {}}
+    m.update(kwargs)
+    return m
+
+
+def reaction(reaction_id, substrates, products, stoichiometry, **kwargs):
+    r = {'ID': reaction_id, 'NAME': [reaction_id.lower()], 'SUBSTRATES': substrates, 'PRODUCTS': products,
+         'STOICHIOMETRY': stoichiometry, 'REVERSIBLE': True, 'ENZYME': ['1.1.1.1'], 'GENE_ASSOCIATION': ['g1'],
+         'DB_LINKS': {}, 'SUBSYSTEM': []}
+    r.update(kwargs)
+    return r
+
+
+def extractor(db_value='C00001'):
+    metabolites = {'A': metabolite('A', 'alpha', CHARGE='-1', FORMULA='C2H4O2', DB_LINKS={'KEGG': db_value}),
+                   'B': metabolite('B', 'beta'),
+                   'C': metabolite('C', 'gamma', INCHIKEY='QTBSBXVTEAMEQO-UHFFFAOYSA-M')}
+    reactions = {'R1': reaction('R1', {'A': None}, {'B': None, 'C': None}, {'A': 2, 'B': 1, 'C': 1.5},
+                                DB_LINKS={'KEGG': 'R00001'}, SUBSYSTEM=['glycolysis', 'TCA']),
+                 'R2': reaction('R2', {'B': None}, {'A': None}, {'A': 1, 'B': 1}, REVERSIBLE=False,
+                                ENZYME=['2.7.1.1'])}
+    return Extractor(reactions, metabolites)
+
+
+def generated_extractor(reactions, metabolites, seed=1):
+    """
+    An extractor of ReactionDict and MetaboliteDict objects, generated with a fixed seed: species in three
+    compartments, names with markup and non-ASCII characters, whole and fractional coefficients, reactions with and
+    without enzymes, genes, dblinks and pathways
+    """
+    rng = random.Random(seed)
+    metabolite_dicts = {}
+    for i in range(metabolites):
+        metabolite_id = 'M_%d_%s' % (i, rng.choice('cep'))
+        metabolite_dicts[metabolite_id] = MetaboliteDict(
+            metabolite_id, ['metabolite %d%s' % (i, rng.choice(['', ' <acid>', ' & ion', ' \u03b1-D'])), 'alias'],
+            rng.choice(['NA', 'C%dH%dO' % (i % 9 + 1, i % 13)]),
+            dict(rng.sample([('KEGG', 'C%05d' % i), ('ChEBI', str(i)), ('MetaCyc', 'CPD-%d' % i)], rng.randint(0, 3))),
+            compartment=metabolite_id[-1], charge=rng.choice(['NA', '0', '-1', '2']),
+            inchikey=rng.choice(['NA', 'XLYOFNOQVPJJNP-UHFFFAOYSA-N']))
+    metabolite_ids = list(metabolite_dicts)
+    reaction_dicts = {}
+    for i in range(reactions):
+        participants = rng.sample(metabolite_ids, rng.randint(2, 5))
+        split = rng.randint(1, len(participants) - 1)
+        reaction_id = 'R_%d' % i
+        reaction_dicts[reaction_id] = ReactionDict(
+            reaction_id, ['reaction %d%s' % (i, rng.choice(['', ' "quoted"', ' \u2192 out']))],
+            dict((m, metabolite_dicts[m]) for m in participants[:split]),
+            dict((m, metabolite_dicts[m]) for m in participants[split:]),
+            rng.random() < 0.5, rng.sample(['1.1.1.1', '2.7.1.1', '3.1.3.-'], rng.randint(1, 2)),
+            rng.choice([['g%d' % i], ['g%d' % i, 'g%d' % (i + 1)]]),
+            dict(rng.sample([('KEGG', 'R%05d' % i), ('MetaCyc', 'RXN-%d' % i)], rng.randint(0, 2))),
+            dict((m, rng.choice([1, 2, 3, 0.5, 1.25])) for m in participants),
+            rng.sample(['glycolysis', 'TCA cycle', 'urea & amino acids'], rng.randint(0, 2)))
+    return Extractor(reaction_dicts, metabolite_dicts)
+
+@unittest.skipIf(libsbml is None, 'libsbml is not installed')
+class StreamWriterTest(unittest.TestCase):
+    """
+    Models written by the stream writer read back with libsbml as the model the libsbml writer builds
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def build(self, database_extractor, writer, compress_level=None):
+        directory = os.path.join(self.path, writer + str(compress_level))
+        os.mkdir(directory)
+        sbml.build_sbml(database_extractor, directory, 'test', writer=writer, compress_level=compress_level)
+        filename = sbml.sbml_filename(database_extractor, 'test', directory, compress_level is not None)
+        document = sbml.load_sbml(filename)
+        self.assertEqual(document.getNumErrors(libsbml.LIBSBML_SEV_ERROR), 0)
+        return document.getModel()
+
+    def assertModelsEqual(self, model, expected):
+        self.assertEqual(model.getId(), expected.getId())
+        self.assertEqual(model.getName(), expected.getName())
+        self.assertEqual(sorted(c.getId() for c in model.getListOfCompartments()),
+                         sorted(c.getId() for c in expected.getListOfCompartments()))
+        self.assertEqual([s.getId() for s in model.getListOfSpecies()],
+                         [s.getId() for s in expected.getListOfSpecies()])
+        for species in expected.getListOfSpecies():
+            streamed = model.getSpecies(species.getId())
+            self.assertEqual(streamed.getName(), species.getName())
+            self.assertEqual(streamed.getCompartment(), species.getCompartment())
+            self.assertEqual(streamed.getConstant(), species.getConstant())
+            self.assertEqual(streamed.getBoundaryCondition(), species.getBoundaryCondition())
+            self.assertEqual(tools.notes2dict(streamed.getNotesString()),
+                             tools.notes2dict(species.getNotesString()))
+        self.assertEqual([r.getId() for r in model.getListOfReactions()],
+                         [r.getId() for r in expected.getListOfReactions()])
+        for reaction in expected.getListOfReactions():
+            streamed = model.getReaction(reaction.getId())
+            self.assertEqual(streamed.getName(), reaction.getName())
+            self.assertEqual(streamed.getReversible(), reaction.getReversible())
+            self.assertEqual(tools.notes2dict(streamed.getNotesString()),
+                             tools.notes2dict(reaction.getNotesString()))
+            for side in ('getListOfReactants', 'getListOfProducts'):
+                self.assertEqual(sorted((ref.getSpecies(), ref.getStoichiometry())
+                                        for ref in getattr(streamed, side)()),
+                                 sorted((ref.getSpecies(), ref.getStoichiometry())
+                                        for ref in getattr(reaction, side)()))
+
+    def test_stream_matches_libsbml_writer(self):
+        database_extractor = extractor()
+        self.assertModelsEqual(self.build(database_extractor, 'stream'), self.build(database_extractor, 'libsbml'))
+
+    def test_stream_matches_libsbml_writer_gzip(self):
+        database_extractor = extractor()
+        self.assertModelsEqual(self.build(database_extractor, 'stream', 6),
+                               self.build(database_extractor, 'libsbml', 6))
+
+    def test_generated_model(self):
+        database_extractor = generated_extractor(reactions=400, metabolites=250)
+        for compress_level in (None, 9):
+            model = self.build(database_extractor, 'stream', compress_level)
+            self.assertEqual(model.getNumReactions(), 400)
+            self.assertEqual(sorted(c.getId() for c in model.getListOfCompartments()), ['c', 'e', 'p'])
+            self.assertModelsEqual(model, self.build(database_extractor, 'libsbml', compress_level))
+
+    def test_stream_escapes_notes_and_attributes(self):
+        database_extractor = extractor(db_value='a < b & "c"')
+        database_extractor.metabolites['B']['NAME'] = ['beta & <delta>']
+        model = self.build(database_extractor, 'stream')
+        self.assertEqual(tools.notes2dict(model.getSpecies('A').getNotesString())['KEGG'], 'a < b & "c"')
+        self.assertEqual(model.getSpecies('B').getName(), 'beta & <delta>')
+        self.assertEqual(model.getReaction('R1').getReactant('A').getStoichiometry(), 2)
+        self.assertEqual(model.getReaction('R1').getProduct('C').getStoichiometry(), 1.5)
+        self.assertModelsEqual(model, self.build(database_extractor, 'libsbml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
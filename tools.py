@@ -1,6 +1,20 @@
+import collections
+import html
 import importlib
 import inspect
 import os
+import re
+import threading
+import time
+
+# A parsed reaction equation. ids, coefficients and sides are parallel tuples, side 0 holds the substrates
+Equation = collections.namedtuple('Equation', ['ids', 'coefficients', 'sides'])
+equation_arrows = frozenset(['=', '<=>', '<==>', '=>', '<=', '->', '<-', '-->', '<--'])
+# Numeric (2, 1.5) or symbolic (n, 2n, (n+1), (m-1)) stoichiometric coefficients
+equation_coefficient_pattern = re.compile(r'^(\d+(\.\d+)?|\(?\d*[nmx]([+-]\d+)?\)?)$')
+# A XHTML paragraph of SBML notes, with or without a namespace prefix, and any markup inside one
+notes_paragraph_pattern = re.compile(r'<(?:\w+:)?p(?:\s[^>]*)?>(.*?)</(?:\w+:)?p>', re.S)
+markup_pattern = re.compile(r'<[^>]*>')
 
 
 def load_classes(path, instance, **kwargs):
@@ -21,6 +35,26 @@ def load_classes(path, instance, **kwargs):
     return classes
 
 
+def find_classes(path, instance):
+    """
+    The subclasses of instance defined in the .py files of a directory, without instantiating them
+    :param path: The directory to find classes in
+    :param instance: The parent class of the classes to be found
+    :return: A list of classes, in file name order
+    """
+    classes = []
+
+    for file in sorted(os.listdir(os.path.dirname(__file__) + '/' + path)):
+        if file.endswith(".py"):
+            file_module = importlib.import_module(path + '.' + file.split('.')[0])
+            for name, the_class in inspect.getmembers(file_module, inspect.isclass):
+                if issubclass(the_class, instance) and the_class is not instance \
+                        and the_class.__module__ == file_module.__name__:
+                    classes.append(the_class)
+
+    return classes
+
+
 def load_class(path, instance, **kwargs):
     """
     Method for loading a class of a given instance from a path
@@ -39,20 +73,108 @@ def load_class(path, instance, **kwargs):
             return the_instance
 
 
+def parse_equation(equation, id_pattern):
+    """
+    Tokenizes a reaction equation in a single pass
+    Tokens are either a coefficient, a metabolite, '+' or the arrow separating substrates from products
+    Metabolite ids are taken from each metabolite token with id_pattern, tokens that do not match are skipped
+    Symbolic coefficients such as n or (n+1) are given a coefficient of 1
+    E.G.: '2 C00001 + C00002 <=> n C00003' = Equation(('C00001', 'C00002', 'C00003'), (2, 1, 1), (0, 0, 1))
+    :param equation: the equation string, E.G. a KEGG EQUATION or MetaNetX reac_prop equation
+    :param id_pattern: compiled regex matching a metabolite id within a metabolite token
+    :return: an Equation
+    """
+    ids = []
+    coefficients = []
+    sides = []
+    side = 0
+    coefficient = 1
+    for token in equation.split():
+        if token in equation_arrows:
+            side = 1
+        elif token == '+':
+            coefficient = 1
+        elif equation_coefficient_pattern.match(token):
+            coefficient = float(token) if '.' in token else int(token) if token.isdigit() else 1
+        else:
+            match = id_pattern.search(token)
+            if match:
+                ids.append(match.group(0))
+                coefficients.append(coefficient)
+                sides.append(side)
+            coefficient = 1
+    return Equation(tuple(ids), tuple(coefficients), tuple(sides))
+
+
 def notes2dict(notes_string):
     """
     Turns a SBML notes string into a dictionary
     Each item in the notes string that is inside a <p> tag is added to the dictionary
-    The keys are the left side of a colon, the value is the right side
+    The key is the text before the first ': ', the value is the rest, so values that contain ': ' are kept whole
     E.G.: KEGG: C00001 = {KEGG = C00001}
     :param notes_string: The SBML notes string
     :return: a dict <p> tagged items in the SBML notes string
     """
     notes_dict = {}
-    for line in notes_string.split('\n'):
-        if '<p>' in line:
-            line = line.replace('<p>', '')
-            line = line.replace('</p>', '')
-            s = line.split(': ')
-            notes_dict[s[0].strip()] = s[1]
-    return notes_dict
\ No newline at end of file
+    for paragraph in re.findall(notes_paragraph_pattern, notes_string):
+        item = notes_item(html.unescape(re.sub(markup_pattern, '', paragraph)))
+        if item is not None:
+            notes_dict[item[0]] = item[1]
+    return notes_dict
+
+
+def notes_item(text):
+    """
+    The key and value of the text of one notes paragraph, split at the first ': '
+    E.G.: 'NOTE: a: b' = ('NOTE', 'a: b'), 'GENE_ASSOCIATION:' = ('GENE_ASSOCIATION', '')
+    :param text: the paragraph's text, without markup or entities
+    :return: a (key, value) tuple, or None if the text has no colon separator
+    """
+    text = text.strip()
+    key, separator, value = text.partition(': ')
+    if not separator and text.endswith(':'):
+        key, separator = text[:-1], ':'
+    if not separator:
+        return None
+    return key.strip(), value.strip()
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter that can be shared between threads
+    Tokens are added at a fixed rate per second up to the bucket capacity
+    Each call to acquire takes one token, blocking until a token is available
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: tokens added per second. A rate of None or 0 disables the limit
+        :param capacity: the maximum number of tokens in the bucket, i.e. the largest allowed burst
+        """
+        self._rate = rate
+        self._capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting until one is available
+        :return:
+        """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+import requests.exceptions
+import requests.structures
+
+import tools
+
+# (connect, read) timeouts in seconds
+default_timeout = (10, 300)
+default_retries = 5
+default_backoff = 1
+default_pool_size = 16
+retry_status_codes = frozenset([429, 500, 502, 503, 504])
+cassette_modes = ('record', 'replay')
+
+
+class OfflineError(Exception):
+    """
+    Raised in offline mode when a request would go to the network
+    """
+    pass
+
+
+class Transport:
+    """
+    HTTP transport shared by the modules that call remote services
+    Connections are pooled and kept alive in one requests session
+    Each host has its own concurrency limit and token bucket rate limit (see tools.RateLimiter)
+    Connection errors, timeouts and transient status codes are retried with exponential backoff
+    With a cassette directory, responses are recorded to it, or replayed from it without touching the network
+    Offline, any request that is not replayed from a cassette raises OfflineError
+    """
+
+    def __init__(self, timeout=default_timeout, retries=default_retries, backoff=default_backoff,
+                 pool_size=default_pool_size, cassette=None, cassette_mode=None, offline=False):
+        """
+        :param timeout: (connect, read) timeout in seconds
+        :param retries: the number of times a failed request is retried
+        :param backoff: seconds to wait before the first retry, doubled for each following retry
+        :param pool_size: the number of connections kept alive per host
+        :param cassette: directory responses are recorded to or replayed from
+        :param cassette_mode: 'record' or 'replay'
+        :param offline: never call the network
+        """
+        self._timeout = timeout
+        self._offline = offline
+        self._retries = retries
+        self._backoff = backoff
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self._cassette = Cassette(cassette) if cassette else None
+        self._cassette_mode = cassette_mode if cassette else None
+        if self._cassette_mode is not None and self._cassette_mode not in cassette_modes:
+            raise ValueError("Cassette mode must be one of %s" % ', '.join(cassette_modes))
+
+    def limit_host(self, host, concurrency=None, rate=None):
+        """
+        Set the concurrency and rate limits of a host
+        :param host: the host name, E.G. rest.kegg.jp
+        :param concurrency: the maximum number of requests in flight to the host, None for no limit
+        :param rate: the maximum number of requests per second to the host, None for no limit
+        :return:
+        """
+        semaphore = threading.BoundedSemaphore(concurrency) if concurrency else None
+        with self._hosts_lock:
+            self._hosts[host] = (semaphore, tools.RateLimiter(rate))
+
+    def host_limits(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (None, tools.RateLimiter(None))
+            return self._hosts[host]
+
+    def get(self, url, stream=False, headers=None):
+        """
+        GET a url
+        :param url:
+        :param stream: if True the body is not read until it is iterated over
+        :param headers: extra request headers, E.G. Range
+        :return: a requests.Response, or a CassetteResponse when recording or replaying
+        """
+        if self._cassette_mode == 'replay':
+            return self._cassette.load(url, headers)
+        response = self.request(url, stream or self._cassette_mode == 'record', headers)
+        if self._cassette_mode == 'record':
+            return self._cassette.save(url, headers, response)
+        return response
+
+    def download(self, url, path, chunk_size=1024 * 1024):
+        """
+        Download a url to a file, streaming the body to disk
+        The body is written to path + '.part' and renamed when complete
+        If the download is interrupted it is resumed from the end of the partial file with a HTTP range request
+        :param url:
+        :param path: the file to download to
+        :param chunk_size: bytes read from the response at a time
+        :return: the path
+        """
+        part = path + '.part'
+        attempt = 0
+        while True:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': 'bytes=%d-' % offset} if offset else None
+            response = self.get(url, stream=True, headers=headers)
+            if offset and response.status_code == 416:
+                # The partial file already holds the whole body
+                break
+            response.raise_for_status()
+            if offset and response.status_code == 206:
+                logging.info("Resuming download of %s at byte %d" % (url, offset))
+            try:
+                with open(part, 'ab' if offset and response.status_code == 206 else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= self._retries:
+                    raise
+                logging.warning("Download of %s interrupted (%s), resuming" % (url, e))
+                attempt += 1
+            finally:
+                response.close()
+        os.replace(part, path)
+        return path
+
+    def request(self, url, stream, headers):
+        if self._offline:
+            raise OfflineError("Offline mode, %s is not available locally" % url)
+        semaphore, rate_limiter = self.host_limits(url)
+        attempt = 0
+        while True:
+            response = None
+            try:
+                if semaphore is not None:
+                    semaphore.acquire()
+                try:
+                    rate_limiter.acquire()
+                    response = self._session.get(url, stream=stream, headers=headers, timeout=self._timeout)
+                finally:
+                    if semaphore is not None:
+                        semaphore.release()
+                if response.status_code not in retry_status_codes or attempt >= self._retries:
+                    return response
+                reason = 'HTTP %d' % response.status_code
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self._retries:
+                    raise
+                reason = str(e)
+            wait = self.retry_wait(attempt, response)
+            logging.warning("GET %s failed (%s), retrying in %.1f seconds" % (url, reason, wait))
+            if response is not None:
+                response.close()
+            time.sleep(wait)
+            attempt += 1
+
+    def retry_wait(self, attempt, response):
+        """
+        Seconds to wait before retrying, the server's Retry-After header is used if it is given in seconds
+        :param attempt: the number of retries so far
+        :param response: the failed response, or None if the request raised
+        :return:
+        """
+        try:
+            return float(response.headers['Retry-After'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return self._backoff * 2 ** attempt
+
+
+class Cassette:
+    """
+    A directory of recorded responses
+    Each response is stored as a body file and a json file holding the url and status code,
+    both named after a hash of the url and request headers
+    """
+
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def path(self):
+        return self._path
+
+    def key(self, url, headers):
+        request = json.dumps([url, sorted((headers or {}).items())])
+        return os.path.join(self.path, hashlib.sha1(request.encode('utf-8')).hexdigest())
+
+    def save(self, url, headers, response):
+        """
+        Record a response, streaming its body to disk
+        :param url:
+        :param headers:
+        :param response: a requests.Response opened with stream=True
+        :return: a CassetteResponse reading the recorded body
+        """
+        key = self.key(url, headers)
+        with open(key + '.body.part', 'wb') as body:
+            for chunk in response.iter_content(1024 * 1024):
+                body.write(chunk)
+        os.replace(key + '.body.part', key + '.body')
+        with open(key + '.json', 'w') as meta:
+            json.dump({'url': url, 'status_code': response.status_code, 'headers': dict(response.headers)}, meta)
+        response.close()
+        return self.load(url, headers)
+
+    def load(self, url, headers):
+        """
+        Replay a recorded response
+        :param url:
+        :param headers:
+        :return: a CassetteResponse
+        """
+        key = self.key(url, headers)
+        try:
+            with open(key + '.json') as meta:
+                meta = json.load(meta)
+        except FileNotFoundError:
+            raise LookupError("No recorded response in cassette %s for %s" % (self.path, url))
+        return CassetteResponse(meta['url'], meta['status_code'], meta.get('headers', {}), key + '.body')
+
+
+class CassetteResponse:
+    """
+    A recorded response, providing the parts of the requests.Response interface used in METRONOME
+    The body is read from disk when it is accessed
+    """
+
+    def __init__(self, url, status_code, headers, body_path):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.encoding = 'utf-8'
+        self._body_path = body_path
+
+    @property
+    def content(self):
+        with open(self._body_path, 'rb') as body:
+            return body.read()
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        with open(self._body_path, 'rb') as body:
+            chunk = body.read(chunk_size)
+            while chunk:
+                yield chunk.decode(self.encoding, 'replace') if decode_unicode else chunk
+                chunk = body.read(chunk_size)
+
+    def iter_lines(self, chunk_size=512, decode_unicode=False):
+        with open(self._body_path, 'rb') as body:
+            for line in body:
+                line = line.rstrip(b'\r\n')
+                yield line.decode(self.encoding, 'replace') if decode_unicode else line
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError("%d error for url: %s" % (self.status_code, self.url))
+
+    def close(self):
+        pass
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """
+    Replace the shared transport, see Transport for the arguments
+    :param kwargs:
+    :return: the new transport
+    """
+    global _transport
+    with _transport_lock:
+        _transport = Transport(**kwargs)
+        return _transport
+
+
+def transport():
+    """
+    The shared transport, created with the default settings if configure has not been called
+    :return:
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+
+def get(url, stream=False, headers=None):
+    """
+    GET a url with the shared transport, see Transport.get
+    :param url:
+    :param stream:
+    :param headers:
+    :return:
+    """
+    return transport().get(url, stream=stream, headers=headers)
+
+
+def download(url, path):
+    """
+    Download a url to a file with the shared transport, see Transport.download
+    :param url:
+    :param path:
+    :return:
+    """
+    return transport().download(url, path)
+
+
+def limit_host(host, concurrency=None, rate=None):
+    """
+    Set the concurrency and rate limits of a host on the shared transport, see Transport.limit_host
+    :param host:
+    :param concurrency:
+    :param rate:
+    :return:
+    """
+    transport().limit_host(host, concurrency=concurrency, rate=rate)